@@ -0,0 +1,25 @@
+# Compressed loop (rv32c): sums 31 + 30 + ... + 1 with 16-bit
+# instructions, spilling the running total through the stack, 2000
+# times. Exits 0 if the total is 2000 * 496 = 992000.
+.text
+main:
+    li sp, 0x20000
+    li x9, 0                # total
+    li x12, 2000            # rounds
+round:
+    c.li x8, 31
+inner:
+    c.add x9, x8
+    c.addi x8, -1
+    c.bnez x8, inner
+    c.swsp x9, 0
+    c.lwsp x10, 0
+    c.mv x9, x10
+    c.addi x12, -1
+    c.bnez x12, round
+
+    li t1, 992000
+    sub a0, x9, t1
+    snez a0, a0
+    li a7, 93
+    ecall
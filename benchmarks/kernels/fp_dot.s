@@ -0,0 +1,47 @@
+# Dot product (rv32f): x[i] = i, y[i] = 2.0 over 256 floats, repeated 128
+# times. Exits 0 if the result is 2 * (0 + 1 + ... + 255) = 65280.
+.data
+x: .space 1024
+y: .space 1024
+
+.text
+main:
+    la s0, x
+    la s1, y
+    li t0, 0
+    li t1, 256
+    li t2, 2
+    fcvt.s.w ft2, t2
+init:
+    fcvt.s.w ft0, t0
+    fsw ft0, 0(s0)
+    fsw ft2, 0(s1)
+    addi s0, s0, 4
+    addi s1, s1, 4
+    addi t0, t0, 1
+    blt t0, t1, init
+
+    li s5, 128              # rounds
+round:
+    la a0, x
+    la a1, y
+    li t0, 256
+    fmv.w.x fa0, zero
+dot:
+    flw ft0, 0(a0)
+    flw ft1, 0(a1)
+    fmul.s ft3, ft0, ft1
+    fadd.s fa0, fa0, ft3
+    addi a0, a0, 4
+    addi a1, a1, 4
+    addi t0, t0, -1
+    bnez t0, dot
+    addi s5, s5, -1
+    bnez s5, round
+
+    fcvt.w.s a1, fa0
+    li t1, 65280
+    sub a0, a1, t1
+    snez a0, a0
+    li a7, 93
+    ecall
@@ -0,0 +1,76 @@
+# Matrix multiply (rv32m): C = A * B for 16x16 integer matrices with
+# A[i][j] = i + j and B[i][j] = i - j + 1, repeated 8 times. Exits 0 if
+# the sum of C is 148480.
+.data
+A: .space 1024
+B: .space 1024
+C: .space 1024
+
+.text
+main:
+    la s0, A
+    la s1, B
+    li t4, 16               # N
+    li t0, 0                # i
+init_row:
+    li t1, 0                # j
+init_col:
+    add t2, t0, t1
+    sw t2, 0(s0)
+    sub t3, t0, t1
+    addi t3, t3, 1
+    sw t3, 0(s1)
+    addi s0, s0, 4
+    addi s1, s1, 4
+    addi t1, t1, 1
+    blt t1, t4, init_col
+    addi t0, t0, 1
+    blt t0, t4, init_row
+
+    li s5, 8                # rounds
+round:
+    la s0, A                # &A[i][0]
+    la s2, C                # &C[i][j]
+    li t0, 0
+row:
+    li t1, 0
+col:
+    la s1, B
+    slli t5, t1, 2
+    add s1, s1, t5          # &B[0][j]
+    mv a0, s0
+    li t2, 0                # k
+    li a1, 0                # dot product
+dot:
+    lw a2, 0(a0)
+    lw a3, 0(s1)
+    mul a4, a2, a3
+    add a1, a1, a4
+    addi a0, a0, 4
+    addi s1, s1, 64
+    addi t2, t2, 1
+    blt t2, t4, dot
+    sw a1, 0(s2)
+    addi s2, s2, 4
+    addi t1, t1, 1
+    blt t1, t4, col
+    addi s0, s0, 64
+    addi t0, t0, 1
+    blt t0, t4, row
+    addi s5, s5, -1
+    bnez s5, round
+
+    la a0, C
+    li t0, 256
+    li a1, 0
+checksum:
+    lw t1, 0(a0)
+    add a1, a1, t1
+    addi a0, a0, 4
+    addi t0, t0, -1
+    bnez t0, checksum
+    li t1, 148480
+    sub a0, a1, t1
+    snez a0, a0
+    li a7, 93
+    ecall
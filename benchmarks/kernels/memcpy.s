@@ -0,0 +1,48 @@
+# memcpy (rv32i): fill a 4 KiB buffer, copy it word by word 64 times,
+# exit 0 if the last word arrived intact.
+.data
+src: .space 4096
+dst: .space 4096
+
+.text
+main:
+    la s0, src
+    li t0, 1024             # words
+    li t1, 0
+fill:
+    sw t1, 0(s0)
+    addi t1, t1, 3
+    addi s0, s0, 4
+    addi t0, t0, -1
+    bnez t0, fill
+
+    li s2, 64               # rounds
+round:
+    la a0, dst
+    la a1, src
+    li a2, 256              # 4 words per iteration
+copy:
+    lw t0, 0(a1)
+    lw t1, 4(a1)
+    lw t2, 8(a1)
+    lw t3, 12(a1)
+    sw t0, 0(a0)
+    sw t1, 4(a0)
+    sw t2, 8(a0)
+    sw t3, 12(a0)
+    addi a0, a0, 16
+    addi a1, a1, 16
+    addi a2, a2, -1
+    bnez a2, copy
+    addi s2, s2, -1
+    bnez s2, round
+
+    la a0, dst
+    li t2, 4092
+    add a0, a0, t2
+    lw t0, 0(a0)
+    li t1, 3069             # 3 * 1023
+    sub a0, t0, t1
+    snez a0, a0
+    li a7, 93
+    ecall
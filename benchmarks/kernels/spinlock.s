@@ -0,0 +1,30 @@
+# Spinlock (rv32a): take an LR/SC lock, bump a shared counter with
+# amoadd.w and release with amoswap.w, 20000 times. Exits 0 if the
+# counter ends at 20000.
+.data
+lock: .word 0
+counter: .word 0
+
+.text
+main:
+    la s0, lock
+    la s1, counter
+    li s2, 20000
+    li t2, 1
+loop:
+acquire:
+    lr.w t0, (s0)
+    bnez t0, acquire
+    sc.w t1, t2, (s0)
+    bnez t1, acquire
+    amoadd.w zero, t2, (s1)
+    amoswap.w zero, zero, (s0)
+    addi s2, s2, -1
+    bnez s2, loop
+
+    lw a1, 0(s1)
+    li t1, 20000
+    sub a0, a1, t1
+    snez a0, a0
+    li a7, 93
+    ecall
@@ -0,0 +1,122 @@
+"""Memory access throughput, raw and inside memory-bound kernels.
+
+    python3 benchmarks/memory_bench.py [--steps N]
+
+Each kernel runs on the default paged Memory, with a flat RAM region
+covering its data, and on 'from_bytes': paged memory accessed through
+slicing and int.from_bytes/to_bytes as before the struct based access
+methods. Compiled blocks do word loads and stores on the pages directly, so
+word_copy mostly shows the difference between the first two.
+"""
+import argparse
+import functools
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from simulator.memory import Memory, PAGE_SIZE
+from simulator.riscv_sim import RISCVSimulator
+
+# Word copy of 16 KiB from 0x10000 to 0x14000, repeated forever
+WORD_COPY = '''
+lui x10, 16
+loop:
+addi x5, x10, 0
+lui x6, 20
+lui x7, 4
+add x7, x5, x7
+copy:
+lw x8, 0(x5)
+sw x8, 0(x6)
+addi x5, x5, 4
+addi x6, x6, 4
+blt x5, x7, copy
+jal x0, loop
+'''
+
+# Byte reads and half-word writes striding over 64 KiB
+MIXED = '''
+lui x10, 16
+lui x11, 32
+loop:
+addi x5, x10, 0
+walk:
+lbu x8, 0(x5)
+lh x9, 2(x5)
+add x8, x8, x9
+sh x8, 0(x5)
+sb x8, 3(x5)
+addi x5, x5, 64
+blt x5, x11, walk
+jal x0, loop
+'''
+
+class FromBytesMemory(Memory):
+    # The old access path, kept for comparison
+    def read(self, addr, size, signed=False):
+        page = self.pages.get(addr & ~0xFFF)
+        offset = addr & 0xFFF
+        if page is not None and offset + size <= PAGE_SIZE:
+            return int.from_bytes(page[offset:offset + size], 'little', signed=signed)
+        return Memory.read(self, addr, size, signed)
+
+    def write(self, addr, val, size):
+        offset = addr & 0xFFF
+        if offset + size <= PAGE_SIZE and (addr >= self.code_end or addr + size <= self.code_start):
+            page = self._get_page(addr)
+            page[offset:offset + size] = (val & ((1 << (size * 8)) - 1)).to_bytes(size, 'little')
+            self.page_versions[addr - offset] = self.epoch
+            return
+        Memory.write(self, addr, val, size)
+
+    def read_word(self, addr):
+        return self.read(addr, 4)
+
+    def write_word(self, addr, val):
+        self.write(addr, val, 4)
+
+KERNELS = {'word_copy': WORD_COPY, 'mixed': MIXED}
+RAM = (0x10000, 0x10000)
+
+def run_kernel(code, steps, memory_factory):
+    sim = RISCVSimulator(trace=False, memory_factory=memory_factory)
+    ok, msg = sim.assemble(code)
+    if not ok:
+        raise RuntimeError(msg)
+    sim.run(max_steps=1000) # compile the blocks outside the timed part
+    start = time.perf_counter()
+    sim.run(max_steps=steps)
+    return steps / (time.perf_counter() - start)
+
+def raw_access(n, memory):
+    addrs = [(0x10000 + (i * 4)) & 0x1FFFC for i in range(n)]
+    start = time.perf_counter()
+    for a in addrs:
+        memory.write(a, a, 4)
+    for a in addrs:
+        memory.read(a, 4)
+    for a in addrs:
+        memory.write_word(a, a)
+    for a in addrs:
+        memory.read_word(a)
+    return 4 * n / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--steps', type=int, default=500000)
+    parser.add_argument('--repeat', type=int, default=3, help='best of N runs')
+    args = parser.parse_args()
+
+    backends = {'from_bytes': FromBytesMemory, 'paged': Memory,
+                'flat': functools.partial(Memory, ram=RAM)}
+    for name, factory in backends.items():
+        print(f'{name:10} raw access   {max(raw_access(args.steps, factory()) for _ in range(args.repeat)) / 1e6:6.2f} M/s')
+    for kernel, code in KERNELS.items():
+        for name, factory in backends.items():
+            ips = max(run_kernel(code, args.steps, factory) for _ in range(args.repeat))
+            print(f'{name:10} {kernel:12} {ips / 1e6:6.2f} MIPS')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Kernel benchmarks: assembly time, MIPS and peak memory per ISA extension.
+
+    python3 benchmarks/run.py [kernel ...] [--repeat N] [--json FILE]
+
+Kernels live in benchmarks/kernels/*.s and exit with a0 = 0 when their
+self-check passes. --json writes the results (plus the git commit) so runs
+can be compared across commits.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+from simulator.assembler import assemble
+from simulator.memory import PAGE_SIZE
+from simulator.riscv_sim import RISCVSimulator, STOP_HALTED
+
+KERNEL_DIR = os.path.join(HERE, 'kernels')
+
+# kernel -> extension it exercises
+KERNELS = {
+    'memcpy': 'rv32i',
+    'matmul': 'rv32m',
+    'fp_dot': 'rv32f',
+    'spinlock': 'rv32a',
+    'compressed_loop': 'rv32c',
+}
+
+MAX_STEPS = 100000000 # safety net for a kernel that never exits
+
+def load_kernel(name):
+    with open(os.path.join(KERNEL_DIR, name + '.s')) as f:
+        return f.read()
+
+def run_once(source):
+    sim = RISCVSimulator(trace=False)
+    ok, msg = sim.assemble(source)
+    if not ok:
+        raise RuntimeError(f"assembly failed: {msg}")
+    start = time.perf_counter()
+    reason = sim.run(max_steps=MAX_STEPS)
+    return sim, reason, time.perf_counter() - start
+
+def bench_kernel(name, repeat, memory=True):
+    source = load_kernel(name)
+
+    asm_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        program = assemble(source, cache=False)
+        asm_times.append(time.perf_counter() - start)
+    if program.errors:
+        raise RuntimeError(f"{name}: assembly failed: {program.errors}")
+
+    best = None
+    for _ in range(repeat):
+        sim, reason, elapsed = run_once(source)
+        if best is None or elapsed < best:
+            best = elapsed
+
+    result = {
+        'extension': KERNELS.get(name, '?'),
+        'passed': reason == STOP_HALTED and sim.exit_code == 0,
+        'instructions': sim.instret,
+        'assemble_ms': min(asm_times) * 1000,
+        'run_s': best,
+        'mips': sim.instret / best / 1e6,
+        'sim_memory_bytes': len(sim.memory.pages) * PAGE_SIZE,
+    }
+    if memory:
+        # Separate run: tracing allocations slows execution down
+        tracemalloc.start()
+        try:
+            run_once(source)
+            result['peak_python_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('kernels', nargs='*', help='kernel names (default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='best of N runs')
+    parser.add_argument('--json', metavar='FILE', help="write results as JSON ('-' for stdout)")
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc peak memory run')
+    args = parser.parse_args()
+
+    names = args.kernels or list(KERNELS)
+    results = {}
+    for name in names:
+        results[name] = r = bench_kernel(name, args.repeat, memory=not args.no_memory)
+        if args.json != '-':
+            peak = r.get('peak_python_bytes')
+            print(f"{name:16} {r['extension']:6} {'ok' if r['passed'] else 'FAIL':4} "
+                  f"{r['instructions']:>10} inst  {r['mips']:6.2f} MIPS  "
+                  f"asm {r['assemble_ms']:6.2f} ms"
+                  + (f"  peak {peak / 1024:8.1f} KiB" if peak is not None else ''))
+
+    if args.json:
+        report = {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'timestamp': time.time(),
+            'kernels': results,
+        }
+        if args.json == '-':
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+
+    if not all(r['passed'] for r in results.values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+/* live_bridge.js - Animated runs streamed from the Flask server (/api/live) */
+
+const PAGE_SIZE = 4096;
+
+// Full state kept up to date from the server's deltas
+let liveState = null;
+let source = null;
+
+function applyState(state) {
+    if (state.since === undefined || !liveState) {
+        // Full snapshot
+        liveState = {
+            pc: state.pc,
+            registers: state.registers.slice(),
+            f_registers: state.f_registers.slice(),
+            memory: Object.assign({}, state.memory),
+            pipeline: state.pipeline
+        };
+        return liveState;
+    }
+    for (const [i, v] of Object.entries(state.registers)) liveState.registers[i] = v;
+    for (const [i, v] of Object.entries(state.f_registers)) liveState.f_registers[i] = v;
+    // Dirty pages are replaced as a whole; bytes not sent are zero
+    for (const base of state.dirty_pages) {
+        for (let a = base; a < base + PAGE_SIZE; a++) delete liveState.memory[a];
+    }
+    Object.assign(liveState.memory, state.memory);
+    liveState.pc = state.pc;
+    liveState.pipeline = state.pipeline;
+    return liveState;
+}
+
+// Starts a run at `rate` instructions per second (0: as fast as possible).
+// onState(state, instret) is called at most `fps` times per second with the
+// merged state, onDone(reason, instret, watchHit) once the run stops.
+export function startLive({ server = '', session = null, rate = 0, fps = 30, trace = false,
+                            maxSteps = null, onState, onDone, onError } = {}) {
+    stopLive();
+    liveState = null;
+    const params = new URLSearchParams({ rate, fps, trace: trace ? 1 : 0 });
+    if (session) params.set('session', session);
+    if (maxSteps !== null) params.set('max_steps', maxSteps);
+
+    const es = source = new EventSource(`${server}/api/live?${params}`, { withCredentials: true });
+    es.addEventListener('state', e => {
+        const data = JSON.parse(e.data);
+        if (onState) onState(applyState(data.state), data.instret);
+    });
+    es.addEventListener('done', e => {
+        const data = JSON.parse(e.data);
+        es.close();
+        if (source === es) source = null;
+        if (onDone) onDone(data.reason, data.instret, data.watch_hit);
+    });
+    es.addEventListener('error', e => {
+        // Server-side failures carry a message; a dropped connection does not
+        es.close();
+        if (source === es) source = null;
+        if (onError) onError(e.data ? JSON.parse(e.data).message : 'Connection lost');
+    });
+    return stopLive;
+}
+
+export function stopLive() {
+    if (source) {
+        source.close();
+        source = null;
+    }
+}
@@ -1,75 +1,539 @@
 
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request
 from flask_cors import CORS
+import base64
+import functools
+import json
 import sys
 import os
+import time
 
 # Add the src directory to the python path so we can import simulator
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from simulator.riscv_sim import RISCVSimulator
+from simulator.riscv_sim import STOP_BUDGET
+from simulator.batch import run_batch, DEFAULT_MAX_STEPS
+from simulator.cache import CacheConfigError
+from simulator.predictor import PredictorConfigError
+from simulator.trace import DEFAULT_CHECKPOINT_INTERVAL as DEFAULT_TRACE_CHECKPOINT_INTERVAL
+from sessions import SessionPool, SessionError
 
-app = Flask(__name__, 
+app = Flask(__name__,
             static_folder='../client/static',
             template_folder='../client/templates')
-CORS(app)
+CORS(app, expose_headers=['X-Session-Id'])
 
-simulator = RISCVSimulator()
+# Every client gets its own simulator. The id comes back in the
+# X-Session-Id header (and a cookie); send it with later requests.
+SESSION_HEADER = 'X-Session-Id'
+SESSION_COOKIE = 'rvsim_session'
+sessions = SessionPool(max_sessions=int(os.environ.get('RVSIM_MAX_SESSIONS', 64)),
+                       ttl=float(os.environ.get('RVSIM_SESSION_TTL', 30 * 60)),
+                       memory_budget=int(os.environ.get('RVSIM_SESSION_MEMORY_MB', 64)) << 20,
+                       batch_workers=int(os.environ['RVSIM_BATCH_WORKERS'])
+                       if 'RVSIM_BATCH_WORKERS' in os.environ else None)
+
+# Longest a single /api/run call may execute before returning
+RUN_SLICE_SECONDS = 0.25
+
+# Longest trace /api/trace streams, in steps and in seconds
+MAX_TRACE_STEPS = 2000000
+MAX_TRACE_SECONDS = 10
+
+# /api/live: state events per second by default and at most
+LIVE_FPS = 30
+MAX_LIVE_FPS = 60
+
+# Per-request limits of /api/batch
+MAX_BATCH_JOBS = 256
+MAX_BATCH_STEPS = 100000000
+MAX_BATCH_JOB_SECONDS = 10
+MAX_BATCH_SECONDS = 60 # summed over the jobs of one request
+
+def request_session_id():
+    # EventSource cannot set headers, so /api/live also takes ?session=
+    return request.headers.get(SESSION_HEADER) or request.cookies.get(SESSION_COOKIE) \
+        or request.args.get('session')
+
+def with_session(view):
+    # Passes the caller's Session to the view, holding its lock meanwhile
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        sid = request_session_id()
+        session = sessions.get(sid)
+        with session.lock:
+            response = jsonify(view(session, *args, **kwargs))
+        response.headers[SESSION_HEADER] = session.id
+        if sid != session.id:
+            response.set_cookie(SESSION_COOKIE, session.id, httponly=True, samesite='Lax')
+        return response
+    return wrapper
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/api/assemble', methods=['POST'])
-def assemble():
+@with_session
+def assemble(session):
+    simulator = session.simulator
     data = request.json
     code = data.get('code', '')
     try:
         result = simulator.assemble(code)
+        sessions.check_budget(session)
         # simulator.assemble returns (success, message_or_errors)
         success = result[0]
         payload = result[1]
-        
+
         if success:
-             return jsonify({'success': True, 'message': payload, 'program': simulator.program})
+             return {'success': True, 'message': payload, 'program': simulator.program}
         else:
              # payload is list of errors or string message
              if isinstance(payload, list):
-                 return jsonify({'success': False, 'message': 'Assembly Failed', 'errors': payload})
+                 return {'success': False, 'message': 'Assembly Failed', 'errors': payload}
              else:
-                 return jsonify({'success': False, 'message': payload})
+                 return {'success': False, 'message': payload}
     except Exception as e:
-        return jsonify({'success': False, 'message': str(e)})
+        return {'success': False, 'message': str(e)}
+
+@app.route('/api/load_elf', methods=['POST'])
+@with_session
+def load_elf(session):
+    # ELF32 executable uploaded as the 'file' form field
+    upload = request.files.get('file')
+    if upload is None:
+        return {'success': False, 'message': 'No file uploaded'}
+    try:
+        entry = session.simulator.load_elf(upload.read())
+        sessions.check_budget(session)
+        return {
+            'success': True,
+            'message': f'Loaded ELF, entry {hex(entry)}',
+            'state': session.simulator.get_state()
+        }
+    except Exception as e:
+        return {'success': False, 'message': str(e)}
 
 @app.route('/api/step', methods=['POST'])
-def step():
+@with_session
+def step(session):
+    simulator = session.simulator
+    data = request.get_json(silent=True) or {}
     try:
         simulator.step()
-        return jsonify({
+        sessions.check_budget(session)
+        # With 'since' (the version of the client's last state) only the
+        # registers and memory pages that changed are sent
+        return {
+            'success': True,
+            'state': simulator.get_state(since=data.get('since'))
+        }
+    except Exception as e:
+        return {'success': False, 'message': str(e)}
+
+@app.route('/api/step_back', methods=['POST'])
+@with_session
+def step_back(session):
+    # {'steps': n (default 1), 'since': version}. Undoes fewer steps when
+    # replaying from a checkpoint takes longer than one run slice.
+    simulator = session.simulator
+    data = request.get_json(silent=True) or {}
+    try:
+        undone = simulator.step_back(int(data.get('steps', 1)), max_time=RUN_SLICE_SECONDS)
+        return {
+            'success': True,
+            'undone': undone,
+            'instret': simulator.instret,
+            'state': simulator.get_state(since=data.get('since'))
+        }
+    except Exception as e:
+        return {'success': False, 'message': str(e)}
+
+@app.route('/api/seek', methods=['POST'])
+@with_session
+def seek(session):
+    # ?step=n: the state after n retired instructions, going backwards
+    # through the journal or forwards by executing. Either way this runs
+    # for at most one run slice; check 'instret' and call again.
+    simulator = session.simulator
+    step = request.args.get('step', type=int)
+    if step is None or step < 0:
+        return {'success': False, 'message': 'Expected a non-negative step'}
+    try:
+        reached = simulator.seek(step, max_time=RUN_SLICE_SECONDS)
+        sessions.check_budget(session)
+        return {
             'success': True,
+            'instret': reached,
             'state': simulator.get_state()
-        })
+        }
     except Exception as e:
-        return jsonify({'success': False, 'message': str(e)})
+        return {'success': False, 'message': str(e)}
 
 @app.route('/api/run', methods=['POST'])
-def run():
+@with_session
+def run(session):
+    data = request.get_json(silent=True) or {}
     try:
-        simulator.run()
-        return jsonify({
+        # Runs one bounded time slice. While 'done' is false the client
+        # calls again and execution resumes where it stopped.
+        max_time = min(float(data.get('max_time', RUN_SLICE_SECONDS)), RUN_SLICE_SECONDS)
+        max_steps = data.get('max_steps')
+        # Headless unless the client asks for the datapath of every step
+        reason = sessions.run(session,
+                              max_steps=int(max_steps) if max_steps is not None else None,
+                              max_time=max_time,
+                              trace=bool(data.get('trace', False)))
+        simulator = session.simulator
+        return {
             'success': True,
+            'reason': reason,
+            'done': reason != STOP_BUDGET,
+            'instret': simulator.instret,
+            'watch_hit': simulator.memory.watch_hit,
             'state': simulator.get_state()
-        })
+        }
     except Exception as e:
+        return {'success': False, 'message': str(e)}
+
+def breakpoint_list(simulator):
+    return [{'addr': addr,
+             'conditions': [{'reg': reg, 'op': op, 'value': value}
+                            for reg, op, value in simulator.conditions.get(addr, [])]}
+            for addr in sorted(simulator.breakpoints)]
+
+@app.route('/api/breakpoints', methods=['GET', 'POST', 'DELETE'])
+@with_session
+def breakpoints(session):
+    # POST {'addr': n, 'condition': {'reg': 'a0', 'op': '==', 'value': 5}}
+    # adds a (conditional) breakpoint, DELETE {'addr': n} removes one and
+    # DELETE {} all of them. Registers in the listing are numbers, f
+    # registers as 32 + n.
+    simulator = session.simulator
+    data = request.get_json(silent=True) or {}
+    try:
+        if request.method == 'POST':
+            cond = data.get('condition')
+            simulator.add_breakpoint(int(data['addr']),
+                                     (cond['reg'], cond['op'], cond['value']) if cond else None)
+        elif request.method == 'DELETE':
+            addrs = [int(data['addr'])] if 'addr' in data else list(simulator.breakpoints)
+            for addr in addrs:
+                simulator.remove_breakpoint(addr)
+    except (KeyError, TypeError, ValueError) as e:
+        return {'success': False, 'message': str(e)}
+    return {'success': True, 'breakpoints': breakpoint_list(simulator)}
+
+@app.route('/api/watchpoints', methods=['GET', 'POST', 'DELETE'])
+@with_session
+def watchpoints(session):
+    # POST {'addr': n, 'size': 4, 'read': false, 'write': true} adds a
+    # watchpoint, DELETE {'addr': n, 'size': 4} removes it and DELETE {}
+    # all of them. /api/run reports the access in 'watch_hit'.
+    simulator = session.simulator
+    data = request.get_json(silent=True) or {}
+    try:
+        if request.method == 'POST':
+            simulator.add_watchpoint(int(data['addr']), int(data.get('size', 4)),
+                                     read=bool(data.get('read', False)),
+                                     write=bool(data.get('write', True)))
+        elif request.method == 'DELETE':
+            if 'addr' in data:
+                simulator.remove_watchpoint(int(data['addr']), int(data.get('size', 4)))
+            else:
+                for start, end, _, _ in list(simulator.watchpoints):
+                    simulator.remove_watchpoint(start, end - start)
+    except (KeyError, TypeError, ValueError) as e:
+        return {'success': False, 'message': str(e)}
+    return {
+        'success': True,
+        'watchpoints': [{'addr': start, 'size': end - start, 'read': read, 'write': write}
+                        for start, end, read, write in simulator.watchpoints]
+    }
+
+@app.route('/api/trace', methods=['POST'])
+def trace():
+    # Runs from the current state and streams the binary trace log
+    # (simulator.trace) as application/octet-stream. {'max_steps': n,
+    # 'checkpoint_interval': n}; at most MAX_TRACE_STEPS steps or
+    # MAX_TRACE_SECONDS seconds.
+    sid = request_session_id()
+    session = sessions.get(sid)
+    data = request.get_json(silent=True) or {}
+    try:
+        max_steps = min(int(data.get('max_steps', MAX_TRACE_STEPS)), MAX_TRACE_STEPS)
+        interval = int(data.get('checkpoint_interval', DEFAULT_TRACE_CHECKPOINT_INTERVAL))
+        if interval <= 0:
+            raise ValueError('checkpoint_interval must be positive')
+    except (TypeError, ValueError) as e:
         return jsonify({'success': False, 'message': str(e)})
 
+    def generate():
+        # One chunk at a time under the session lock, so the session's other
+        # requests get in between, with the datapath bookkeeping off. A
+        # request that moves the simulator meanwhile ends the trace.
+        simulator = session.simulator
+        chunks = simulator.export_trace(max_steps=max_steps, max_time=MAX_TRACE_SECONDS,
+                                        checkpoint_interval=interval)
+        position = None
+        while True:
+            with session.lock:
+                if session.simulator is not simulator or \
+                        position not in (None, (simulator.instret, simulator.pc)):
+                    return
+                saved_trace = simulator.trace
+                simulator.trace = False
+                try:
+                    chunk = next(chunks, None)
+                finally:
+                    simulator.trace = saved_trace
+                try:
+                    sessions.check_budget(session)
+                except SessionError:
+                    return
+                position = (simulator.instret, simulator.pc)
+            if chunk is None:
+                return
+            yield chunk
+
+    response = Response(generate(), mimetype='application/octet-stream')
+    response.headers[SESSION_HEADER] = session.id
+    return response
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+@app.route('/api/live', methods=['GET'])
+def live():
+    # Server-sent events for an animated run. ?rate=n instructions per
+    # second (0 or absent: as fast as possible), ?fps=n state events per
+    # second, ?trace=1 for the datapath of the last step, ?max_steps=n.
+    # Each 'state' event is get_state(since=...) of the previous one, so
+    # after the first it only carries changes; frames in which nothing
+    # retired are skipped. A 'done' event with the stop reason ends the
+    # stream. Closing it, DELETE /api/live or starting another live run
+    # stops execution.
+    sid = request_session_id()
+    session = sessions.get(sid)
+    try:
+        rate = float(request.args.get('rate', 0))
+        fps = min(float(request.args.get('fps', LIVE_FPS)), MAX_LIVE_FPS)
+        max_steps = request.args.get('max_steps', type=int)
+        if rate < 0 or fps <= 0:
+            raise ValueError('rate must not be negative and fps must be positive')
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': str(e)})
+    trace = request.args.get('trace', '0') not in ('0', 'false', '')
+    with session.lock:
+        session.live_run += 1
+        run_id = session.live_run
+
+    def generate():
+        frame = 1 / fps
+        start = time.perf_counter()
+        executed = 0
+        version = None
+        while True:
+            with session.lock:
+                if session.live_run != run_id:
+                    return
+                simulator = session.simulator
+                budget = None
+                if rate:
+                    # Catch up with the wall clock, never more than a
+                    # frame's worth at once
+                    budget = min(int(rate * (time.perf_counter() - start)) - executed,
+                                 max(1, int(rate * frame)))
+                if max_steps is not None:
+                    budget = max_steps - executed if budget is None else \
+                        min(budget, max_steps - executed)
+                reason = STOP_BUDGET
+                before = simulator.instret
+                try:
+                    if budget is None or budget > 0:
+                        reason = sessions.run(session, max_steps=budget, max_time=frame,
+                                              trace=trace)
+                    simulator = session.simulator
+                    executed += simulator.instret - before
+                    done = reason != STOP_BUDGET or \
+                        max_steps is not None and executed >= max_steps
+                    event = None
+                    if version is None or simulator.instret != before or done:
+                        state = simulator.get_state(since=version)
+                        version = state['version']
+                        event = sse('state', {'instret': simulator.instret, 'state': state})
+                except Exception as e:
+                    event = sse('error', {'message': str(e)})
+                    done = None
+            if event is not None:
+                yield event
+            if done is None:
+                return
+            if done:
+                yield sse('done', {'reason': reason, 'instret': simulator.instret,
+                                   'watch_hit': simulator.memory.watch_hit})
+                return
+            time.sleep(max(0.0, frame - (time.perf_counter() - start) % frame))
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # no proxy buffering
+    response.headers[SESSION_HEADER] = session.id
+    if sid != session.id:
+        response.set_cookie(SESSION_COOKIE, session.id, httponly=True, samesite='Lax')
+    return response
+
+@app.route('/api/live', methods=['DELETE'])
+@with_session
+def stop_live(session):
+    session.live_run += 1
+    return {'success': True, 'instret': session.simulator.instret}
+
 @app.route('/api/reset', methods=['POST'])
-def reset():
-    simulator.reset()
-    return jsonify({
+@with_session
+def reset(session):
+    session.simulator.reset()
+    return {
         'success': True,
-        'state': simulator.get_state()
-    })
+        'state': session.simulator.get_state()
+    }
+
+@app.route('/api/profile', methods=['GET', 'POST'])
+@with_session
+def profile(session):
+    # GET returns the report. POST {'enabled': bool, 'reset': bool}
+    # attaches/detaches the profiler or clears its counts.
+    simulator = session.simulator
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        if 'enabled' in data:
+            if data['enabled']:
+                simulator.enable_profiling()
+            else:
+                simulator.disable_profiling()
+        if data.get('reset') and simulator.profiler is not None:
+            simulator.profiler.reset()
+    top = request.args.get('top', 10, type=int)
+    return {
+        'success': True,
+        'enabled': simulator.profiler is not None,
+        'profile': simulator.profile_report(top)
+    }
+
+@app.route('/api/pipeline', methods=['GET', 'POST'])
+@with_session
+def pipeline(session):
+    # GET returns cycle counts of the 5-stage timing model. POST
+    # {'enabled': bool, 'forwarding': bool, 'latencies': {op: cycles},
+    # 'reset': bool} attaches (or replaces) / detaches it or clears it.
+    simulator = session.simulator
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            if data.get('enabled'):
+                latencies = {op: int(n) for op, n in (data.get('latencies') or {}).items()}
+                simulator.enable_pipeline(forwarding=bool(data.get('forwarding', True)),
+                                          latencies=latencies)
+            elif 'enabled' in data:
+                simulator.disable_pipeline()
+        except (TypeError, ValueError, AttributeError) as e:
+            return {'success': False, 'message': str(e)}
+        if data.get('reset') and simulator.pipeline is not None:
+            simulator.pipeline.reset()
+    model = simulator.pipeline
+    return {
+        'success': True,
+        'enabled': model is not None,
+        'timing': model.report() if model is not None else None,
+        'stages': model.in_flight() if model is not None else None
+    }
+
+@app.route('/api/caches', methods=['GET', 'POST'])
+@with_session
+def caches(session):
+    # GET returns hit/miss rates and AMAT per level. POST {'enabled': bool,
+    # 'l1i': {...}, 'l1d': {...}, 'l2': {...} or null, 'memory_latency': n,
+    # 'reset': bool}; level dicts take size, line_size, ways, policy
+    # ('lru', 'fifo', 'random') and hit_latency.
+    simulator = session.simulator
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            if data.get('enabled'):
+                simulator.enable_caches(l1i=data.get('l1i'), l1d=data.get('l1d'), l2=data.get('l2'),
+                                        memory_latency=data.get('memory_latency'))
+            elif 'enabled' in data:
+                simulator.disable_caches()
+        except (CacheConfigError, TypeError, ValueError) as e:
+            return {'success': False, 'message': str(e)}
+        if data.get('reset') and simulator.caches is not None:
+            simulator.caches.reset()
+    hierarchy = simulator.caches
+    return {
+        'success': True,
+        'enabled': hierarchy is not None,
+        'caches': hierarchy.report() if hierarchy is not None else None
+    }
+
+@app.route('/api/predictor', methods=['GET', 'POST'])
+@with_session
+def predictor(session):
+    # GET returns prediction accuracy overall and for the worst branches.
+    # POST {'enabled': bool, 'kind': 'not_taken' | 'btfn' | 'bimodal1' |
+    # 'bimodal2' | 'gshare', 'entries': n, 'history_bits': n,
+    # 'btb_entries': n, 'reset': bool}
+    simulator = session.simulator
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            if data.get('enabled'):
+                simulator.enable_predictor(kind=data.get('kind', 'bimodal2'),
+                                           entries=int(data.get('entries', 1024)),
+                                           history_bits=int(data.get('history_bits', 10)),
+                                           btb_entries=int(data.get('btb_entries', 64)))
+            elif 'enabled' in data:
+                simulator.disable_predictor()
+        except (PredictorConfigError, TypeError, ValueError) as e:
+            return {'success': False, 'message': str(e)}
+        if data.get('reset') and simulator.predictor is not None:
+            simulator.predictor.reset()
+    model = simulator.predictor
+    return {
+        'success': True,
+        'enabled': model is not None,
+        'predictor': model.report(simulator, request.args.get('top', 10, type=int))
+        if model is not None else None
+    }
+
+@app.route('/api/batch', methods=['POST'])
+def batch():
+    # {'jobs': [...]} as for simulator.batch.run_job, except that an ELF
+    # image is sent base64 encoded in 'elf'. Results come back in order.
+    data = request.get_json(silent=True) or {}
+    jobs = data.get('jobs')
+    if not isinstance(jobs, list) or not jobs:
+        return jsonify({'success': False, 'message': 'Expected a non-empty jobs list'})
+    if len(jobs) > MAX_BATCH_JOBS:
+        return jsonify({'success': False, 'message': f'At most {MAX_BATCH_JOBS} jobs per batch'})
+    job_seconds = min(MAX_BATCH_JOB_SECONDS, MAX_BATCH_SECONDS / len(jobs))
+    try:
+        for job in jobs:
+            if 'elf' in job:
+                job['elf'] = base64.b64decode(job['elf'])
+            job['max_steps'] = min(int(job.get('max_steps', DEFAULT_MAX_STEPS)), MAX_BATCH_STEPS)
+            job['max_time'] = min(float(job.get('max_time', job_seconds)), job_seconds)
+        results = run_batch(jobs, workers=0) if sessions.batch_executor is None else \
+            run_batch(jobs, executor=sessions.batch_executor)
+        return jsonify({'success': True, 'results': results})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/session', methods=['DELETE'])
+@with_session
+def close_session(session):
+    sessions.drop(session.id)
+    return {'success': True}
 
 if __name__ == '__main__':
     app.run(debug=True, port=3000)
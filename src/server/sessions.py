@@ -0,0 +1,92 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from simulator.memory import PAGE_SIZE
+from simulator.riscv_sim import RISCVSimulator
+
+# Undo entries kept per session for /api/step_back; runs further back
+# are reached through checkpoints
+JOURNAL_SIZE = 1000
+
+class SessionError(Exception):
+    pass
+
+class Session:
+    def __init__(self, sid):
+        self.id = sid
+        self.simulator = RISCVSimulator()
+        self.simulator.enable_journal(size=JOURNAL_SIZE)
+        self.last_used = time.monotonic()
+        # Held for the whole request, so one client's calls never interleave
+        self.lock = threading.Lock()
+        self.live_run = 0 # bumped to stop a running /api/live stream
+
+    def memory_bytes(self):
+        # Live pages plus what the journal holds for reverse execution
+        simulator = self.simulator
+        total = len(simulator.memory.pages) * PAGE_SIZE
+        if simulator.journal is not None:
+            total += simulator.journal.memory_bytes()
+        return total
+
+class SessionPool:
+    # Simulators keyed by session id. Sessions idle for longer than ttl
+    # seconds are dropped, and beyond max_sessions the least recently used
+    # one goes. Session runs execute in the request thread: they come in
+    # bounded slices, and the simulator keeps its decoded instructions and
+    # compiled blocks from one slice to the next. /api/batch jobs go to a
+    # process pool of `batch_workers` processes (0 runs them inline).
+    def __init__(self, max_sessions=64, ttl=30 * 60, memory_budget=64 << 20, batch_workers=None):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.memory_budget = memory_budget
+        self.sessions = OrderedDict() # id -> Session, least recent first
+        self.lock = threading.Lock()
+        self.batch_executor = ProcessPoolExecutor(batch_workers) if batch_workers != 0 else None
+
+    def get(self, sid=None):
+        # The session for sid, or a new one (with a fresh id) when sid is
+        # unknown or expired
+        now = time.monotonic()
+        with self.lock:
+            self._expire(now)
+            session = self.sessions.get(sid) if sid else None
+            if session is None:
+                sid = secrets.token_hex(16)
+                session = self.sessions[sid] = Session(sid)
+                while len(self.sessions) > self.max_sessions:
+                    self.sessions.popitem(last=False)
+            else:
+                self.sessions.move_to_end(sid)
+            session.last_used = now
+            return session
+
+    def drop(self, sid):
+        with self.lock:
+            self.sessions.pop(sid, None)
+
+    def _expire(self, now):
+        while self.sessions:
+            oldest = next(iter(self.sessions.values()))
+            if now - oldest.last_used <= self.ttl:
+                break
+            self.sessions.popitem(last=False)
+
+    def run(self, session, **kwargs):
+        # RISCVSimulator.run() on the session's simulator. Caller holds
+        # session.lock.
+        reason = session.simulator.run(**kwargs)
+        self.check_budget(session)
+        return reason
+
+    def check_budget(self, session):
+        if session.memory_bytes() > self.memory_budget:
+            session.simulator.reset()
+            raise SessionError(f"Session exceeded its memory budget of {self.memory_budget / (1 << 20):g} MiB and was reset")
+
+    def shutdown(self):
+        if self.batch_executor is not None:
+            self.batch_executor.shutdown(wait=False)
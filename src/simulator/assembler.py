@@ -0,0 +1,480 @@
+# Two-pass assembler: source text -> {address: instruction dict} plus the
+# byte images of the .text and .data sections.
+#
+# Pass 1 splits every line into labels and a statement, expands
+# pseudo-instructions and lays out addresses; pass 2 parses operands
+# against the finished label table and encodes. Results are cached by
+# source hash, so resubmitting unchanged text (the editor assembles on
+# every keystroke) costs one lookup.
+
+import hashlib
+import re
+from collections import OrderedDict
+
+from .encoding import ENCODING, C_ENCODING, encode, instruction_length, sext
+
+ABI_NAMES = ['zero', 'ra', 'sp', 'gp', 'tp', 't0', 't1', 't2', 's0', 's1',
+             'a0', 'a1', 'a2', 'a3', 'a4', 'a5', 'a6', 'a7', 's2', 's3',
+             's4', 's5', 's6', 's7', 's8', 's9', 's10', 's11', 't3', 't4', 't5', 't6']
+F_ABI_NAMES = ['ft0', 'ft1', 'ft2', 'ft3', 'ft4', 'ft5', 'ft6', 'ft7', 'fs0', 'fs1',
+               'fa0', 'fa1', 'fa2', 'fa3', 'fa4', 'fa5', 'fa6', 'fa7', 'fs2', 'fs3',
+               'fs4', 'fs5', 'fs6', 'fs7', 'fs8', 'fs9', 'fs10', 'fs11', 'ft8', 'ft9', 'ft10', 'ft11']
+
+# Integer and float registers share one name table; the operand position
+# decides which file is meant.
+REGISTERS = {'fp': 8}
+for _i in range(32):
+    REGISTERS[f'x{_i}'] = REGISTERS[ABI_NAMES[_i]] = _i
+    REGISTERS[f'f{_i}'] = REGISTERS[F_ABI_NAMES[_i]] = _i
+
+# op -> encoding format ('C' for compressed)
+OPCODES = {op: e[0] for op, e in ENCODING.items()}
+OPCODES.update((op, 'C') for op in C_ENCODING)
+LENGTHS = {op: instruction_length(op) for op in OPCODES}
+
+TEXT_BASE = 0
+DATA_BASE = 0x10000 # moved up in steps of DATA_ALIGN when the text is longer
+DATA_ALIGN = 0x10000
+
+# Section names accepted by .section; .rodata and .bss share .data
+SECTIONS = {'.text': 'text', '.data': 'data', '.rodata': 'data', '.bss': 'data'}
+DATA_SIZES = {'.word': 4, '.half': 2, '.byte': 1}
+STRING_DIRECTIVES = {'.string': True, '.asciz': True, '.ascii': False} # -> NUL terminated
+IGNORED_DIRECTIVES = {'.globl', '.global', '.type', '.size', '.file'}
+
+# labels, op, operand text; '#' starts a comment outside string literals
+LINE_RE = re.compile(r'\s*((?:[\w.$]+\s*:\s*)*)(?:([^\s#]+)\s*((?:"(?:[^"\\]|\\.)*"|[^#"])*?))?\s*(?:#.*)?$')
+LABEL_RE = re.compile(r'([\w.$]+)\s*:')
+# Operands are comma or space separated; off(base) is one operand, and
+# the offset may be a %lo() relocation
+OPERAND_RE = re.compile(r'((?:%\w+\([^()]*\))?[^\s,()%]*)\s*\(\s*([^\s,()]+)\s*\)|%\w+\([^()]*\)|[^\s,]+')
+RELOC_RE = re.compile(r'%(hi|lo)\(\s*([^()\s]+)\s*\)$')
+STRING_RE = re.compile(r'"((?:[^"\\]|\\.)*)"')
+ORDERING_RE = re.compile(r'\.(?:aqrl|aq\.rl|aq|rl)$')
+
+CACHE_SIZE = 128
+CACHE_MAX_IMAGE = 1 << 20 # bigger programs are not kept in the cache
+MAX_SECTION_SIZE = 64 << 20
+MAX_ALIGN = 16 # .align 16: 64 KiB, the DATA_ALIGN step
+STATEMENT_CACHE_SIZE = 4096
+
+class AssemblyError(Exception):
+    pass
+
+class Program:
+    # instructions: {address: instruction dict}, shared by every simulator
+    # that assembles the same source, so treat them as read-only.
+    # code/data: section images to load at start/data_start.
+    __slots__ = ('instructions', 'labels', 'errors', 'start', 'code', 'data_start', 'data')
+
+    def __init__(self, instructions, labels, errors, code=b'', data=b'', data_start=DATA_BASE):
+        self.instructions = instructions
+        self.labels = labels
+        self.errors = errors
+        self.start = TEXT_BASE
+        self.code = bytes(code)
+        self.data_start = data_start
+        self.data = bytes(data)
+
+class Section:
+    __slots__ = ('base', 'size', 'image')
+
+    def __init__(self, base):
+        self.base = base
+        self.size = 0
+        self.image = None
+
+_cache = OrderedDict() # source hash -> Program
+# (op, operand text) -> (args, machine code) for statements that do not
+# refer to labels, so an edit only re-encodes the lines it touched
+_statements = {}
+
+def assemble(code, cache=True):
+    # Returns a Program; its errors list is empty on success. cache=False
+    # assembles from scratch (e.g. to time the assembler).
+    if not cache:
+        return _assemble(code, {})
+    key = hashlib.sha1(code.encode()).digest()
+    program = _cache.get(key)
+    if program is not None:
+        _cache.move_to_end(key)
+        return program
+    program = _assemble(code)
+    if len(program.code) + len(program.data) <= CACHE_MAX_IMAGE:
+        _cache[key] = program
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return program
+
+def _assemble(code, statement_cache=None):
+    labels = {}
+    data_labels = set()
+    errors = []
+    sections = {'text': Section(TEXT_BASE), 'data': Section(DATA_BASE)}
+
+    # Pass 1: labels, expansion and layout
+    section = sections['text']
+    statements = [] # (section, offset, op, operands, source, line number)
+    for num, line in expand_macros(code, errors):
+        m = LINE_RE.match(line)
+        if m is None:
+            errors.append({'line': num, 'message': 'Unterminated string literal'})
+            continue
+        if m.group(1):
+            for name in LABEL_RE.findall(m.group(1)):
+                labels[name] = section.base + section.size
+                if section is sections['data']:
+                    data_labels.add(name)
+                else:
+                    data_labels.discard(name)
+        op = m.group(2)
+        if op is None:
+            continue
+        op = op.lower()
+        operands = m.group(3)
+        try:
+            if op[0] == '.':
+                if op in SECTIONS or op == '.section':
+                    name = SECTIONS.get(op if op != '.section' else operands.split(',')[0].strip())
+                    if name is None:
+                        raise AssemblyError(f"Unknown section: {operands}")
+                    section = sections[name]
+                    continue
+                if op in IGNORED_DIRECTIVES:
+                    continue
+                size = directive_size(op, operands, section.base + section.size)
+                if section.size + size > MAX_SECTION_SIZE:
+                    raise AssemblyError(f"Section larger than {MAX_SECTION_SIZE >> 20} MiB")
+                statements.append((section, section.size, op, operands, line[m.start(2):m.end(3)], num))
+                section.size += size
+                continue
+            if op in PSEUDO_OPS:
+                expansion = PSEUDO_OPS[op](split_operands(operands))
+            else:
+                if op not in OPCODES:
+                    op = ORDERING_RE.sub('', op) # amoadd.w.aq -> amoadd.w
+                expansion = [(op, operands)]
+        except Exception as e:
+            errors.append({'line': num, 'message': str(e)})
+            continue
+        for op, operands in expansion:
+            source = line[m.start(2):m.end(3)] if len(expansion) == 1 else f"{op} {operands}"
+            statements.append((section, section.size, op, operands, source, num))
+            section.size += LENGTHS.get(op, 4)
+
+    text, data = sections['text'], sections['data']
+    if data.size and text.base + text.size > data.base:
+        # Shifting by whole DATA_ALIGN steps keeps every .align intact
+        # (see MAX_ALIGN)
+        shift = -(-(text.base + text.size - data.base) // DATA_ALIGN) * DATA_ALIGN
+        data.base += shift
+        for name in data_labels:
+            labels[name] += shift
+    for sec in sections.values():
+        sec.image = bytearray(sec.size)
+
+    # Pass 2: operands and encoding. A label named like a register shadows
+    # it, which the statement cache cannot know about.
+    instructions = {}
+    if statement_cache is None:
+        statement_cache = _statements if not labels.keys() & REGISTERS.keys() else {}
+    for sec, offset, op, operands, source, num in statements:
+        addr = sec.base + offset
+        try:
+            if op[0] == '.':
+                data_bytes = directive_bytes(op, operands, addr, labels)
+                sec.image[offset:offset + len(data_bytes)] = data_bytes
+                continue
+            if op not in OPCODES:
+                raise AssemblyError(f"Unknown instruction: {op}")
+            encoded = statement_cache.get((op, operands))
+            if encoded is None:
+                args, relative = parse_operands(op, operands, addr, labels)
+                encoded = (args, encode(op, args))
+                if not relative:
+                    if len(statement_cache) >= STATEMENT_CACHE_SIZE:
+                        statement_cache.clear()
+                    statement_cache[op, operands] = encoded
+            length = LENGTHS[op]
+            instructions[addr] = {
+                'address': addr,
+                'source': source,
+                'op': op,
+                'args': list(encoded[0]),
+                'machine_code': encoded[1],
+                'length': length,
+                'line': num
+            }
+            sec.image[offset:offset + length] = encoded[1].to_bytes(length, 'little')
+        except Exception as e:
+            errors.append({'line': num, 'message': str(e)})
+
+    if errors:
+        return Program({}, labels, errors)
+    return Program(instructions, labels, [], text.image, data.image, data.base)
+
+def split_operands(operands):
+    return [m.group(0) for m in OPERAND_RE.finditer(operands)]
+
+def parse_strings(operands):
+    # Byte strings of the comma separated literals, with C-style escapes
+    strings = [m.group(1).encode('utf-8').decode('unicode_escape').encode('latin-1')
+               for m in STRING_RE.finditer(operands)]
+    if not strings:
+        raise AssemblyError(f"Expected a string literal: {operands}")
+    return strings
+
+def directive_size(op, operands, addr):
+    if op in DATA_SIZES:
+        return DATA_SIZES[op] * len(split_operands(operands))
+    if op in STRING_DIRECTIVES:
+        return sum(len(b) + STRING_DIRECTIVES[op] for b in parse_strings(operands))
+    if op in ('.space', '.zero'):
+        size = parse_immediate(split_operands(operands)[0], addr, {})
+        if size < 0:
+            raise AssemblyError(f"Negative size for {op}")
+        return size
+    if op == '.align':
+        # Power-of-two alignment, as in GNU as for RISC-V
+        power = parse_immediate(operands.strip(), addr, {})
+        if not 0 <= power <= MAX_ALIGN:
+            raise AssemblyError(f".align takes 0 to {MAX_ALIGN}")
+        return -addr % (1 << power)
+    raise AssemblyError(f"Unknown directive: {op}")
+
+def directive_bytes(op, operands, addr, labels):
+    if op in DATA_SIZES:
+        size = DATA_SIZES[op]
+        out = bytearray()
+        for tok in split_operands(operands):
+            # Labels stand for their absolute address here
+            val = labels[tok] if tok in labels else parse_immediate(tok, addr, labels)
+            if not -(1 << (size * 8 - 1)) <= val < (1 << (size * 8)):
+                raise AssemblyError(f"Value {val} does not fit in {op}")
+            out += (val & ((1 << (size * 8)) - 1)).to_bytes(size, 'little')
+        return out
+    if op in STRING_DIRECTIVES:
+        nul = b'\0' if STRING_DIRECTIVES[op] else b''
+        return b''.join(b + nul for b in parse_strings(operands))
+    if op in ('.space', '.zero'):
+        args = split_operands(operands)
+        size = parse_immediate(args[0], addr, labels)
+        fill = parse_immediate(args[1], addr, labels) & 0xFF if len(args) > 1 else 0
+        return bytes([fill]) * size
+    return b'' # .align: the padding is already zero
+
+def parse_register(s):
+    reg = REGISTERS.get(s)
+    if reg is None:
+        raise AssemblyError(f"Invalid register: {s}")
+    return reg
+
+def parse_immediate(s, addr, labels):
+    # Labels are PC-relative offsets from the instruction at addr;
+    # %hi(sym) / %lo(sym) split an absolute value for lui + addi
+    if s in labels:
+        return labels[s] - addr
+    m = RELOC_RE.match(s)
+    if m:
+        sym = m.group(2)
+        val = labels[sym] if sym in labels else parse_immediate(sym, addr, {})
+        if m.group(1) == 'hi':
+            return ((val + 0x800) >> 12) & 0xFFFFF
+        return sext(val, 12)
+    try:
+        return int(s, 0)
+    except ValueError:
+        raise AssemblyError(f"Invalid immediate: {s}") from None
+
+def parse_operands(op, operands, addr, labels):
+    # Returns (args, whether a label was used)
+    args = []
+    mem = False
+    relative = False
+    for m in OPERAND_RE.finditer(operands):
+        base = m.group(2)
+        if base is None:
+            tok = m.group(0)
+            if tok in labels:
+                relative = True
+                args.append(labels[tok] - addr)
+            elif tok[0] in '0123456789+-%':
+                relative = relative or tok[0] == '%'
+                args.append(parse_immediate(tok, addr, labels))
+            else:
+                args.append(parse_register(tok))
+        else:
+            # off(base); the offset may be omitted, as in lr.w rd, (rs1)
+            mem = True
+            off = m.group(1)
+            relative = relative or off in labels or off.startswith('%')
+            args.append(parse_immediate(off, addr, labels) if off else 0)
+            args.append(parse_register(base))
+
+    fmt = OPCODES[op]
+    if op == 'jal' and len(args) == 1:
+        # jal label -> jal ra, label
+        args = [1, args[0]]
+    elif mem and op == 'jalr' and len(args) == 3:
+        # jalr rd, off(rs1) -> rd, rs1, off
+        args = [args[0], args[2], args[1]]
+    elif mem and fmt in ('LR', 'AMO') and len(args) >= 3:
+        # lr.w rd, (rs1) / amoadd.w rd, rs2, (rs1) -> rd, rs1[, rs2]
+        if args[-2] != 0:
+            raise AssemblyError(f"{op} takes no address offset")
+        args = [args[0], args[-1]] + args[1:-2]
+    return args, relative
+
+# Pseudo-instructions: op -> function of the operand list returning the
+# real (op, operand text) sequence. The length must not depend on label
+# values, which are not known yet in pass 1.
+
+def _expand_li(args):
+    if len(args) != 2:
+        raise AssemblyError("li expects 2 operands")
+    rd, imm = args
+    try:
+        val = int(imm, 0)
+    except ValueError:
+        return _expand_la(args) # symbolic: its absolute value
+    if not -(1 << 31) <= val < (1 << 32):
+        raise AssemblyError(f"Immediate {val} does not fit in 32 bits")
+    if -2048 <= val < 2048:
+        return [('addi', f'{rd}, x0, {val}')]
+    hi = ((val + 0x800) >> 12) & 0xFFFFF
+    lo = sext(val, 12)
+    if lo == 0:
+        return [('lui', f'{rd}, {hi}')]
+    return [('lui', f'{rd}, {hi}'), ('addi', f'{rd}, {rd}, {lo}')]
+
+def _expand_la(args):
+    if len(args) != 2:
+        raise AssemblyError("la expects 2 operands")
+    rd, sym = args
+    return [('lui', f'{rd}, %hi({sym})'), ('addi', f'{rd}, {rd}, %lo({sym})')]
+
+# One-to-one pseudo-instructions: op -> (operand count, real op, operand
+# template). call/tail use a single jal, which reaches +-1 MiB.
+PSEUDO_TEMPLATES = {
+    'nop': (0, 'addi', 'x0, x0, 0'),
+    'mv': (2, 'addi', '{0}, {1}, 0'),
+    'not': (2, 'xori', '{0}, {1}, -1'),
+    'neg': (2, 'sub', '{0}, x0, {1}'),
+    'seqz': (2, 'sltiu', '{0}, {1}, 1'),
+    'snez': (2, 'sltu', '{0}, x0, {1}'),
+    'sltz': (2, 'slt', '{0}, {1}, x0'),
+    'sgtz': (2, 'slt', '{0}, x0, {1}'),
+    'beqz': (2, 'beq', '{0}, x0, {1}'),
+    'bnez': (2, 'bne', '{0}, x0, {1}'),
+    'blez': (2, 'bge', 'x0, {0}, {1}'),
+    'bgez': (2, 'bge', '{0}, x0, {1}'),
+    'bltz': (2, 'blt', '{0}, x0, {1}'),
+    'bgtz': (2, 'blt', 'x0, {0}, {1}'),
+    'bgt': (3, 'blt', '{1}, {0}, {2}'),
+    'ble': (3, 'bge', '{1}, {0}, {2}'),
+    'bgtu': (3, 'bltu', '{1}, {0}, {2}'),
+    'bleu': (3, 'bgeu', '{1}, {0}, {2}'),
+    'j': (1, 'jal', 'x0, {0}'),
+    'jr': (1, 'jalr', 'x0, {0}, 0'),
+    'ret': (0, 'jalr', 'x0, ra, 0'),
+    'call': (1, 'jal', 'ra, {0}'),
+    'tail': (1, 'jal', 'x0, {0}'),
+    'fmv.s': (2, 'fsgnj.s', '{0}, {1}, {1}'),
+    'fabs.s': (2, 'fsgnjx.s', '{0}, {1}, {1}'),
+    'fneg.s': (2, 'fsgnjn.s', '{0}, {1}, {1}'),
+}
+
+def make_pseudo(name, count, op, template):
+    def expand(args):
+        if len(args) != count:
+            raise AssemblyError(f"{name} expects {count} operands, got {len(args)}")
+        return [(op, template.format(*args))]
+    return expand
+
+def _expand_jalr(args):
+    # jalr rs -> jalr ra, rs, 0; other forms are the real instruction
+    if len(args) == 1:
+        return [('jalr', f'ra, {args[0]}, 0')]
+    return [('jalr', ', '.join(args))]
+
+PSEUDO_OPS = {name: make_pseudo(name, *t) for name, t in PSEUDO_TEMPLATES.items()}
+PSEUDO_OPS.update({
+    'li': _expand_li,
+    'la': _expand_la,
+    'jalr': _expand_jalr,
+})
+
+# Macros:
+#     .macro name a, b
+#         addi \a, \a, \b
+#     .endm
+# Invocations are replaced by the body with \param substituted and \@
+# by a counter unique to the invocation (for local labels).
+
+MAX_MACRO_DEPTH = 32
+MACRO_ARG_RE = re.compile(r'\\(\w+|@)')
+
+def expand_macros(code, errors):
+    # -> [(line number, line)] with every invocation expanded in place
+    if '.macro' not in code and '.endm' not in code:
+        return enumerate(code.split('\n'), 1)
+    macros = {} # name -> (params, body lines)
+    lines = []
+    defining = None
+    for num, line in enumerate(code.split('\n'), 1):
+        m = LINE_RE.match(line)
+        op = m.group(2).lower() if m and m.group(2) else None
+        if defining is not None:
+            if op == '.endm':
+                defining = None
+            elif op == '.macro':
+                errors.append({'line': num, 'message': 'Nested .macro definition'})
+            else:
+                defining[1].append(line)
+            continue
+        if op == '.macro':
+            parts = split_operands(m.group(3))
+            if not parts:
+                errors.append({'line': num, 'message': '.macro needs a name'})
+                continue
+            defining = macros[parts[0].lower()] = (parts[1:], [])
+            continue
+        if op == '.endm':
+            errors.append({'line': num, 'message': '.endm without .macro'})
+            continue
+        lines.append((num, line))
+    if defining is not None:
+        errors.append({'line': num, 'message': 'Missing .endm'})
+    if not macros:
+        return lines
+
+    counter = [0]
+
+    def expand(num, line, depth):
+        m = LINE_RE.match(line)
+        op = m.group(2).lower() if m and m.group(2) else None
+        if op not in macros:
+            yield num, line
+            return
+        if depth >= MAX_MACRO_DEPTH:
+            raise AssemblyError(f"Macro {op} nested too deeply")
+        params, body = macros[op]
+        args = split_operands(m.group(3))
+        if len(args) != len(params):
+            raise AssemblyError(f"Macro {op} expects {len(params)} arguments, got {len(args)}")
+        if m.group(1):
+            yield num, m.group(1) # labels of the invocation line
+        values = dict(zip(params, args))
+        values['@'] = str(counter[0])
+        counter[0] += 1
+        for body_line in body:
+            body_line = MACRO_ARG_RE.sub(lambda a: values.get(a.group(1), a.group(0)), body_line)
+            yield from expand(num, body_line, depth + 1)
+
+    out = []
+    for num, line in lines:
+        try:
+            out.extend(expand(num, line, 0))
+        except AssemblyError as e:
+            errors.append({'line': num, 'message': str(e)})
+    return out
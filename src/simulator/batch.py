@@ -0,0 +1,63 @@
+import contextlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from .riscv_sim import RISCVSimulator
+
+DEFAULT_MAX_STEPS = 1000000
+
+# A job is a dict with
+#   'source':      assembly text, or
+#   'elf':         ELF32 image (bytes)
+#   'registers':   {index: value} set before the run (optional)
+#   'f_registers': {index: bits} (optional)
+#   'memory':      {address: bytes or list of byte values} (optional)
+#   'max_steps':   instruction budget (DEFAULT_MAX_STEPS)
+#   'max_time':    seconds (optional)
+
+def run_job(job):
+    sim = RISCVSimulator(trace=False)
+    try:
+        if 'elf' in job:
+            sim.load_elf(job['elf'])
+        else:
+            ok, msg = sim.assemble(job.get('source', ''))
+            if not ok:
+                return {'success': False, 'message': 'Assembly Failed', 'errors': msg}
+        for reg, val in job.get('registers', {}).items():
+            sim.write_reg(int(reg), int(val))
+        for reg, val in job.get('f_registers', {}).items():
+            sim.write_freg(int(reg), int(val))
+        for addr, data in job.get('memory', {}).items():
+            sim.memory.load(int(addr), bytes(data))
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            reason = sim.run(max_steps=job.get('max_steps', DEFAULT_MAX_STEPS),
+                             max_time=job.get('max_time'))
+    except Exception as e:
+        return {'success': False, 'message': str(e)}
+
+    return {
+        'success': True,
+        'reason': reason,
+        'exit_code': sim.exit_code,
+        'instret': sim.instret,
+        'pc': sim.pc,
+        'registers': sim.x,
+        'f_registers': sim.f,
+        'output': output.getvalue()
+    }
+
+def run_batch(jobs, workers=None, executor=None):
+    # Results in job order. Jobs are spread over `executor`, or a process
+    # pool of `workers` processes created for this call.
+    jobs = list(jobs)
+    if executor is not None:
+        return list(executor.map(run_job, jobs))
+    if workers == 0 or len(jobs) <= 1:
+        return [run_job(job) for job in jobs]
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(run_job, jobs, chunksize=max(1, len(jobs) // (4 * workers))))
@@ -0,0 +1,360 @@
+import re
+from .instructions import get_executors, I_OPS, M_OPS, LOAD_OPS, STORE_OPS, BRANCH_OPS, F_ARITH_OPS
+from .instructions.rv32f import to_float, from_float
+from .memory import _unpack_word, _pack_word
+
+MAX_BLOCK = 256 # instructions per compiled block
+
+# Instructions that end a basic block (they write the PC themselves)
+CONTROL_OPS = set(BRANCH_OPS) | {
+    'jal', 'jalr', 'ecall',
+    'c.j', 'c.jal', 'c.jr', 'c.jalr', 'c.beqz', 'c.bnez'
+}
+
+# Inline expressions for ALU ops. a/b are operand expressions, registers are
+# always stored masked to 32 bits so and/or/xor need no extra mask.
+# Signed compares flip the sign bit so that unsigned ordering applies.
+R_EXPR = {
+    'add': '({a} + {b}) & 0xFFFFFFFF',
+    'sub': '({a} - {b}) & 0xFFFFFFFF',
+    'and': '{a} & {b}',
+    'or': '{a} | {b}',
+    'xor': '{a} ^ {b}',
+    'sll': '({a} << ({b} & 31)) & 0xFFFFFFFF',
+    'srl': '{a} >> ({b} & 31)',
+    'sra': '((({a} ^ 0x80000000) - 0x80000000) >> ({b} & 31)) & 0xFFFFFFFF',
+    'slt': '1 if ({a} ^ 0x80000000) < ({b} ^ 0x80000000) else 0',
+    'sltu': '1 if {a} < {b} else 0',
+    'mul': '({a} * {b}) & 0xFFFFFFFF',
+}
+
+BRANCH_EXPR = {
+    'beq': '{a} == {b}',
+    'bne': '{a} != {b}',
+    'blt': '({a} ^ 0x80000000) < ({b} ^ 0x80000000)',
+    'bge': '({a} ^ 0x80000000) >= ({b} ^ 0x80000000)',
+    'bltu': '{a} < {b}',
+    'bgeu': '{a} >= {b}',
+}
+
+KNOWN_OPS = frozenset(get_executors())
+
+# Locals a compiled block may bind on entry, in dependency order
+BLOCK_LOCALS = [
+    ('x', 'x = sim.x'),
+    ('f', 'f = sim.f'),
+    ('mem', 'mem = sim.memory'),
+    ('read', 'read = mem.read'),
+    ('write', 'write = mem.write'),
+    ('read_word', 'read_word = mem.read_word'),
+    ('write_word', 'write_word = mem.write_word'),
+    ('pages_get', 'pages_get = mem.pages.get'),
+    ('versions', 'versions = mem.page_versions'),
+    ('reserved', 'reserved = mem.reserved'),
+    ('code_start', 'code_start = mem.code_start'),
+    ('code_end', 'code_end = mem.code_end'),
+]
+NAME_RE = re.compile(r'\b[a-z_]+\b')
+
+C_ALU = {'c.add': 'add', 'c.sub': 'sub', 'c.and': 'and', 'c.or': 'or', 'c.xor': 'xor'}
+
+def _imm_expr(op, rs1, imm):
+    a = f'x[{rs1}]'
+    u = imm & 0xFFFFFFFF
+    sh = imm & 0x1F
+    if op == 'addi': return f'({a} + {imm}) & 0xFFFFFFFF'
+    if op == 'andi': return f'{a} & {u}'
+    if op == 'ori': return f'{a} | {u}'
+    if op == 'xori': return f'{a} ^ {u}'
+    if op == 'slli': return f'({a} << {sh}) & 0xFFFFFFFF'
+    if op == 'srli': return f'{a} >> {sh}'
+    if op == 'srai': return f'((({a} ^ 0x80000000) - 0x80000000) >> {sh}) & 0xFFFFFFFF'
+    if op == 'slti': return f'1 if ({a} ^ 0x80000000) < {u ^ 0x80000000} else 0'
+    if op == 'sltiu': return f'1 if {a} < {u} else 0'
+    return None
+
+class Block:
+    __slots__ = ('start', 'count', 'run')
+
+    def __init__(self, start, count, run):
+        self.start = start
+        self.count = count
+        self.run = run
+
+def find_block(fetch, start, breakpoints=()):
+    # Straight-line run of instructions from start, ending at the first
+    # control transfer, unknown instruction or the end of the program.
+    # Breakpoints always start a new block so the run loop only has to
+    # check them on block entry.
+    insts = []
+    pc = start
+    while len(insts) < MAX_BLOCK:
+        inst = fetch(pc)
+        if inst is None or (insts and pc in breakpoints):
+            break
+        insts.append(inst)
+        if inst.op in CONTROL_OPS or inst.op not in KNOWN_OPS:
+            break
+        pc += inst.length
+    return insts
+
+def _branch(inst):
+    # (condition, target) of a conditional branch, else None
+    op = inst.op
+    args = inst.args
+    if op in BRANCH_OPS:
+        rs1, rs2, imm = args
+        return BRANCH_EXPR[op].format(a=f'x[{rs1}]', b=f'x[{rs2}]'), inst.address + imm
+    if op == 'c.beqz' or op == 'c.bnez':
+        rs1, imm = args
+        return f'x[{rs1}] {"==" if op == "c.beqz" else "!="} 0', inst.address + imm
+    return None
+
+def _load_word(emit, ea, dst):
+    # Straight from the page when the word does not cross one; pages never
+    # written read as zero through read_word
+    emit(f'a = {ea}')
+    emit('o = a & 0xFFF')
+    emit('p = pages_get(a - o) if o <= 4092 else None')
+    emit(f'{dst} = unpack_word(p, o)[0] if p is not None else read_word(a)')
+
+def _store_word(emit, ea, src, nxt, ret):
+    # Inline unless the word crosses a page, touches the program or another
+    # hart holds a reservation; write_word handles those
+    emit(f'a = {ea}')
+    emit('o = a & 0xFFF')
+    emit('p = pages_get(a - o) if o <= 4092 and not reserved and '
+         '(a >= code_end or a + 4 <= code_start) else None')
+    emit('if p is not None:')
+    emit(f'    pack_word(p, o, {src})')
+    emit('    versions[a - o] = mem.epoch')
+    emit('else:')
+    emit(f'    write_word(a, {src})')
+    # A store into program memory invalidates this very block
+    emit('    if mem.code_written:')
+    emit(f'        sim.pc = {nxt}')
+    emit(f'        return {ret}')
+    emit('sim.reservation = None')
+
+def _translate(inst, k, env, body, watch=False, ret=''):
+    # Emits Python for one instruction. Returns True when the instruction
+    # wrote sim.pc (block terminator). With watch, the block returns right
+    # after an instruction whose memory access hit a watchpoint. Early
+    # returns give the instructions retired as `ret` + count.
+    op = inst.op
+    args = inst.args
+    addr = inst.address
+    nxt = addr + inst.length
+    emit = body.append
+
+    def call_handler():
+        env[f'h{k}'] = inst.handler
+        env[f'i{k}'] = inst
+        emit(f'sim.pc = {addr}')
+        emit(f'h{k}(sim, i{k})')
+        if op not in CONTROL_OPS and op in KNOWN_OPS:
+            emit('if mem.code_written:')
+            emit(f'    return {ret}{k + 1}')
+        if watch and op in KNOWN_OPS:
+            emit('if mem.watch_hit is not None:')
+            emit(f'    mem.watch_hit["pc"] = {addr}')
+            emit(f'    return {ret}{k + 1}')
+
+    def check_watch():
+        if watch:
+            emit('if mem.watch_hit is not None:')
+            emit(f'    mem.watch_hit["pc"] = {addr}')
+            emit(f'    sim.pc = {nxt}')
+            emit(f'    return {ret}{k + 1}')
+
+    if op in R_EXPR:
+        rd, rs1, rs2 = args
+        if rd:
+            emit(f'x[{rd}] = ' + R_EXPR[op].format(a=f'x[{rs1}]', b=f'x[{rs2}]'))
+    elif op in I_OPS:
+        rd, rs1, imm = args
+        if rd:
+            emit(f'x[{rd}] = ' + _imm_expr(op, rs1, imm))
+    elif op in M_OPS:
+        rd, rs1, rs2 = args
+        env[f'f{k}'] = M_OPS[op]
+        if rd:
+            emit(f'x[{rd}] = f{k}(x[{rs1}], x[{rs2}]) & 0xFFFFFFFF')
+    elif op in LOAD_OPS:
+        rd, imm, rs1 = args
+        size, signed = LOAD_OPS[op]
+        ea = f'(x[{rs1}] + {imm}) & 0xFFFFFFFF'
+        if size == 4 and not watch:
+            if rd:
+                _load_word(emit, ea, f'x[{rd}]')
+            return False
+        if size == 4:
+            # Sign does not matter once the result is masked to 32 bits
+            val = f'read_word({ea})'
+        else:
+            val = f'read({ea}, {size}, {signed}) & 0xFFFFFFFF'
+        if rd:
+            emit(f'x[{rd}] = {val}')
+        else:
+            emit(val)
+        check_watch()
+    elif op in STORE_OPS:
+        rs2, imm, rs1 = args
+        ea = f'(x[{rs1}] + {imm}) & 0xFFFFFFFF'
+        if STORE_OPS[op] == 4 and not watch:
+            _store_word(emit, ea, f'x[{rs2}]', nxt, f'{ret}{k + 1}')
+            return False
+        if STORE_OPS[op] == 4:
+            emit(f'write_word({ea}, x[{rs2}])')
+        else:
+            emit(f'write({ea}, x[{rs2}], {STORE_OPS[op]})')
+        emit('sim.reservation = None')
+        # A store into program memory invalidates this very block
+        emit('if mem.code_written:')
+        emit(f'    sim.pc = {nxt}')
+        emit(f'    return {ret}{k + 1}')
+        check_watch()
+    elif op in BRANCH_OPS or op == 'c.beqz' or op == 'c.bnez':
+        cond, target = _branch(inst)
+        emit(f'sim.pc = {target} if {cond} else {nxt}')
+        return True
+    elif op == 'jal':
+        rd, imm = args
+        if rd:
+            emit(f'x[{rd}] = {nxt & 0xFFFFFFFF}')
+        emit(f'sim.pc = {addr + imm}')
+        return True
+    elif op == 'jalr':
+        rd, rs1, imm = args
+        emit(f't = (x[{rs1}] + {imm}) & ~1')
+        if rd:
+            emit(f'x[{rd}] = {nxt & 0xFFFFFFFF}')
+        emit('sim.pc = t')
+        return True
+    elif op == 'flw' and not watch:
+        rd, imm, rs1 = args
+        _load_word(emit, f'(x[{rs1}] + {imm}) & 0xFFFFFFFF', f'f[{rd}]')
+    elif op == 'fsw' and not watch:
+        rs2, imm, rs1 = args
+        _store_word(emit, f'(x[{rs1}] + {imm}) & 0xFFFFFFFF', f'f[{rs2}]', nxt, f'{ret}{k + 1}')
+    elif op in F_ARITH_OPS:
+        rd, rs1, rs2 = args
+        env[f'f{k}'] = F_ARITH_OPS[op]
+        # Results that overflow single precision raise with the PC here
+        emit(f'sim.pc = {addr}')
+        emit(f'f[{rd}] = from_float(f{k}(to_float(f[{rs1}]), to_float(f[{rs2}])))')
+    elif op == 'lui' or op == 'c.lui':
+        rd, imm = args
+        if rd:
+            emit(f'x[{rd}] = {(imm << 12) & 0xFFFFFFFF}')
+    elif op == 'auipc':
+        rd, imm = args
+        if rd:
+            emit(f'x[{rd}] = {(addr + (imm << 12)) & 0xFFFFFFFF}')
+    elif op == 'c.nop':
+        pass
+    elif op == 'c.addi':
+        rd, imm = args
+        if rd:
+            emit(f'x[{rd}] = (x[{rd}] + {imm}) & 0xFFFFFFFF')
+    elif op == 'c.li':
+        rd, imm = args
+        if rd:
+            emit(f'x[{rd}] = {imm & 0xFFFFFFFF}')
+    elif op == 'c.mv':
+        rd, rs2 = args
+        if rd:
+            emit(f'x[{rd}] = x[{rs2}]')
+    elif op in C_ALU:
+        rd, rs2 = args
+        if rd:
+            emit(f'x[{rd}] = ' + R_EXPR[C_ALU[op]].format(a=f'x[{rd}]', b=f'x[{rs2}]'))
+    elif op == 'c.j':
+        emit(f'sim.pc = {addr + args[0]}')
+        return True
+    elif op not in KNOWN_OPS:
+        # Faults without retiring; the run loop reports it
+        call_handler()
+        emit(f'return {ret}{k}')
+        return True
+    else:
+        # Everything else (F, A, CSR-ish, compressed memory ops, ecall...)
+        # runs through its regular handler.
+        call_handler()
+        return op in CONTROL_OPS
+    return False
+
+def compile_block(fetch, start, breakpoints=(), watch=False):
+    insts = find_block(fetch, start, breakpoints)
+    if not insts:
+        return None
+
+    env = {}
+    body = []
+    count = len(insts)
+    last = insts[-1]
+    branch = _branch(last)
+    if branch is not None and branch[1] == start and start not in breakpoints:
+        # A loop onto itself iterates inside the block as long as `budget`
+        # allows another full pass
+        body.append('n = 0')
+        body.append('while True:')
+        loop = []
+        for k, inst in enumerate(insts[:-1]):
+            _translate(inst, k, env, loop, watch, 'n + ')
+        loop.append(f'n += {count}')
+        loop.append(f'if not ({branch[0]}):')
+        loop.append(f'    sim.pc = {last.address + last.length}')
+        loop.append('    return n')
+        loop.append(f'if n + {count} > budget:')
+        loop.append(f'    sim.pc = {start}')
+        loop.append('    return n')
+        body.extend('    ' + line for line in loop)
+    else:
+        ends_with_jump = False
+        for k, inst in enumerate(insts):
+            ends_with_jump = _translate(inst, k, env, body, watch)
+        if not ends_with_jump:
+            body.append(f'sim.pc = {last.address + last.length}')
+        body.append(f'return {count}')
+
+    env['unpack_word'] = _unpack_word
+    env['pack_word'] = _pack_word
+    env['to_float'] = to_float
+    env['from_float'] = from_float
+    # Locals are bound on every call, so only the ones the body uses
+    used = set(NAME_RE.findall('\n'.join(body)))
+    for name, line in reversed(BLOCK_LOCALS):
+        if name in used:
+            used.update(NAME_RE.findall(line))
+    src = ['def block(sim, budget):']
+    src.extend('    ' + line for name, line in BLOCK_LOCALS if name in used)
+    src.extend('    ' + line for line in body)
+    exec(compile('\n'.join(src), f'<block {start:#x}>', 'exec'), env)
+    return Block(start, count, env['block'])
+
+class BlockCache:
+    # Compiled blocks keyed by start PC. fetch(pc) returns the decoded
+    # Instruction at pc or None. Must be cleared whenever the program or the
+    # breakpoint set changes. watch compiles in the watchpoint checks.
+    def __init__(self, fetch, breakpoints=(), watch=False):
+        self.fetch = fetch
+        self.breakpoints = breakpoints
+        self.watch = watch
+        self.blocks = {}
+
+    def set_watch(self, watch):
+        if watch != self.watch:
+            self.watch = watch
+            self.blocks.clear()
+
+    def get(self, pc):
+        blk = self.blocks.get(pc)
+        if blk is None:
+            blk = compile_block(self.fetch, pc, self.breakpoints, self.watch)
+            if blk is not None:
+                self.blocks[pc] = blk
+        return blk
+
+    def clear(self):
+        self.blocks.clear()
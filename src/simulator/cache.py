@@ -0,0 +1,197 @@
+import random
+from array import array
+
+# Set-associative cache model. It tracks tags only (the data always comes
+# from Memory) and counts hits, misses and cycles per level.
+
+POLICIES = ('lru', 'fifo', 'random')
+
+DEFAULT_L1 = {'size': 4096, 'line_size': 32, 'ways': 2, 'policy': 'lru', 'hit_latency': 1}
+DEFAULT_L2 = {'size': 65536, 'line_size': 64, 'ways': 8, 'policy': 'lru', 'hit_latency': 10}
+DEFAULT_MEMORY_LATENCY = 100
+
+class CacheConfigError(Exception):
+    pass
+
+def _log2(n, what):
+    if n <= 0 or n & (n - 1):
+        raise CacheConfigError(f"{what} must be a power of two, got {n}")
+    return n.bit_length() - 1
+
+class Cache:
+    def __init__(self, name, size=4096, line_size=32, ways=2, policy='lru', hit_latency=1,
+                 next_level=None, miss_latency=DEFAULT_MEMORY_LATENCY, seed=0):
+        # A miss costs hit_latency plus the next level's access, or
+        # miss_latency cycles (main memory) for the last level
+        if policy not in POLICIES:
+            raise CacheConfigError(f"Unknown replacement policy: {policy}")
+        self.offset_bits = _log2(line_size, 'line_size')
+        if ways <= 0:
+            raise CacheConfigError(f"{name}: ways must be positive, got {ways}")
+        if size <= 0 or size % (line_size * ways):
+            raise CacheConfigError(f"{name}: size must be a positive multiple of line_size * ways")
+        self.name = name
+        self.size = size
+        self.line_size = line_size
+        self.ways = ways
+        self.policy = policy
+        self.hit_latency = hit_latency
+        self.next_level = next_level
+        self.miss_latency = miss_latency
+        self.sets = size // (line_size * ways)
+        self.set_mask = (1 << _log2(self.sets, 'number of sets')) - 1
+        self.rng = random.Random(seed)
+        n = self.sets * ways
+        # Line number per way (-1 = invalid), last use (LRU) or fill (FIFO)
+        # time per way and dirty flags, all flat arrays indexed set * ways + way
+        self.tags = array('q', [-1]) * n
+        self.stamps = array('q', [0]) * n
+        self.dirty = bytearray(n)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.clock = 0
+        self.accesses = 0
+        self.hits = 0
+        self.misses = 0
+        self.writebacks = 0
+        self.cycles = 0
+
+    def invalidate(self):
+        n = len(self.tags)
+        self.tags = array('q', [-1]) * n
+        self.stamps = array('q', [0]) * n
+        self.dirty = bytearray(n)
+
+    def access(self, addr, size=1, write=False):
+        # Cycles taken by the access; one touching two lines costs both
+        first = addr >> self.offset_bits
+        cycles = self._line(first, write)
+        last = (addr + size - 1) >> self.offset_bits
+        if last != first:
+            cycles += self._line(last, write)
+        return cycles
+
+    def _line(self, line, write):
+        self.accesses += 1
+        self.clock += 1
+        ways = self.ways
+        base = (line & self.set_mask) * ways
+        tags = self.tags
+        seg = tags[base:base + ways]
+        if line in seg:
+            way = base + seg.index(line)
+            self.hits += 1
+            if self.policy == 'lru':
+                self.stamps[way] = self.clock
+            if write:
+                self.dirty[way] = 1
+            self.cycles += self.hit_latency
+            return self.hit_latency
+
+        self.misses += 1
+        if -1 in seg:
+            way = base + seg.index(-1)
+        elif self.policy == 'random':
+            way = base + self.rng.randrange(ways)
+        else:
+            stamps = self.stamps[base:base + ways]
+            way = base + stamps.index(min(stamps))
+        nxt = self.next_level
+        if self.dirty[way]:
+            # Write-back of the victim; buffered, so off the critical path
+            self.writebacks += 1
+            if nxt is not None:
+                nxt.access(tags[way] << self.offset_bits, write=True)
+        tags[way] = line
+        self.stamps[way] = self.clock
+        self.dirty[way] = write
+        # Write-allocate: the line is fetched from below either way
+        below = nxt.access(line << self.offset_bits) if nxt is not None else self.miss_latency
+        cycles = self.hit_latency + below
+        self.cycles += cycles
+        return cycles
+
+    def report(self):
+        accesses = self.accesses
+        return {
+            'size': self.size,
+            'line_size': self.line_size,
+            'ways': self.ways,
+            'policy': self.policy,
+            'accesses': accesses,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / accesses if accesses else None,
+            'miss_rate': self.misses / accesses if accesses else None,
+            'writebacks': self.writebacks,
+            # Average cycles per access, including the levels below
+            'amat': self.cycles / accesses if accesses else None,
+        }
+
+# op -> (write, size): data accesses, address = x[base] + imm
+DATA_OPS = {
+    'lb': (False, 1), 'lbu': (False, 1), 'lh': (False, 2), 'lhu': (False, 2),
+    'lw': (False, 4), 'flw': (False, 4), 'c.lwsp': (False, 4), 'lr.w': (False, 4),
+    'sb': (True, 1), 'sh': (True, 2), 'sw': (True, 4), 'fsw': (True, 4), 'c.swsp': (True, 4),
+}
+
+def data_access(op, args):
+    # (write, size, base register, offset) of a load/store/AMO, else None
+    if op in DATA_OPS:
+        write, size = DATA_OPS[op]
+        if op in ('c.lwsp', 'c.swsp'):
+            return write, size, 2, args[1]
+        if op == 'lr.w':
+            return write, size, args[1], 0
+        return write, size, args[2], args[1]
+    if op == 'sc.w' or op.startswith('amo'):
+        return True, 4, args[1], 0 # read-modify-write, one access
+    return None
+
+class CacheHierarchy:
+    # Split L1 instruction / data caches, optionally backed by a shared L2.
+    # Each level is configured with a dict of Cache keyword arguments.
+    def __init__(self, l1i=None, l1d=None, l2=None, memory_latency=DEFAULT_MEMORY_LATENCY):
+        self.memory_latency = memory_latency
+        self.l2 = Cache('L2', **dict(DEFAULT_L2, **l2), miss_latency=memory_latency) \
+            if l2 is not None else None
+        self.l1i = Cache('L1I', **dict(DEFAULT_L1, **(l1i or {})),
+                         next_level=self.l2, miss_latency=memory_latency)
+        self.l1d = Cache('L1D', **dict(DEFAULT_L1, **(l1d or {})),
+                         next_level=self.l2, miss_latency=memory_latency)
+        self.usage = {} # Instruction -> data_access() result
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['usage'] = {}
+        return state
+
+    @property
+    def levels(self):
+        return [c for c in (self.l1i, self.l1d, self.l2) if c is not None]
+
+    def reset(self):
+        # Cold caches and zeroed statistics
+        for cache in self.levels:
+            cache.invalidate()
+            cache.reset_stats()
+        self.usage = {}
+
+    def access(self, inst, pc, x):
+        # Called before inst executes (x holds its source registers).
+        # Returns (fetch cycles, memory stage cycles).
+        fetch_cycles = self.l1i.access(pc, inst.length)
+        usage = self.usage.get(inst, False)
+        if usage is False:
+            usage = self.usage[inst] = data_access(inst.op, inst.args)
+        if usage is None:
+            return fetch_cycles, 1
+        write, size, base, offset = usage
+        return fetch_cycles, self.l1d.access((x[base] + offset) & 0xFFFFFFFF, size, write)
+
+    def report(self):
+        return {
+            'levels': {c.name: c.report() for c in self.levels},
+            'memory_latency': self.memory_latency,
+        }
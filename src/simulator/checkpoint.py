@@ -0,0 +1,115 @@
+import json
+import mmap
+import os
+import struct
+from .memory import PAGE_SIZE, ZERO_PAGE
+
+# Machine state on disk:
+#
+#   header  '<4sHHQQ'  magic, version, 0, metadata length, data offset
+#   meta    JSON: registers, pc, csrs, reservation, exit code, instret,
+#           program, labels, code range and 'pages', the base address of
+#           each page blob in file order
+#   pages   raw 4 KiB blobs from the page-aligned data offset on; pages
+#           that are all zero are left out
+#
+# Loading maps the file copy-on-write and installs the blobs as pages
+# without copying them, so a checkpoint loads in time independent of its
+# size and the file is never modified.
+
+MAGIC = b'RVCK'
+VERSION = 1
+HEADER = struct.Struct('<4sHHQQ')
+
+# Everything save_checkpoint writes; load_checkpoint checks them all before
+# touching the simulator
+META_KEYS = ('pc', 'x', 'f', 'csrs', 'reservation', 'exit_code', 'instret',
+             'program', 'labels', 'code', 'pages')
+
+class CheckpointFormatError(Exception):
+    pass
+
+def save_checkpoint(sim, path):
+    # Written to a temporary file first, so a crash mid-save leaves the
+    # previous checkpoint intact. Returns the number of pages saved.
+    memory = sim.memory
+    bases = [base for base, page in sorted(memory.pages.items()) if page != ZERO_PAGE]
+    meta = json.dumps({
+        'pc': sim.pc,
+        'x': sim.x,
+        'f': sim.f,
+        'csrs': sim.csrs.csrs,
+        'reservation': sim.reservation,
+        'exit_code': sim.exit_code,
+        'instret': sim.instret,
+        'program': list(sim.program.values()),
+        'labels': sim.labels,
+        'code': [memory.code_start, memory.code_end],
+        'pages': bases,
+    }, separators=(',', ':')).encode()
+    offset = -(-(HEADER.size + len(meta)) // PAGE_SIZE) * PAGE_SIZE
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, len(meta), offset))
+        f.write(meta)
+        f.write(bytes(offset - HEADER.size - len(meta)))
+        f.writelines(memory.pages[base] for base in bases)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return len(bases)
+
+def load_checkpoint(sim, path):
+    # Replaces sim's state with the checkpoint's
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < HEADER.size:
+            raise CheckpointFormatError("Truncated checkpoint header")
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    try:
+        magic, version, _, meta_len, offset = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise CheckpointFormatError("Not a version 1 RVCK checkpoint")
+        try:
+            meta = json.loads(bytes(data[HEADER.size:HEADER.size + meta_len]))
+            missing = [key for key in META_KEYS if key not in meta]
+            if missing:
+                raise CheckpointFormatError(f"Checkpoint metadata lacks {', '.join(missing)}")
+            bases = meta['pages']
+            code_start, code_end = meta['code']
+            program = {inst['address']: inst for inst in meta['program']}
+            csrs = {int(csr): val for csr, val in meta['csrs'].items()}
+            if len(meta['x']) != 32 or len(meta['f']) != 32 or any(base & 0xFFF for base in bases):
+                raise ValueError
+        except (ValueError, KeyError, TypeError, AttributeError):
+            raise CheckpointFormatError("Corrupt checkpoint metadata") from None
+        if offset + len(bases) * PAGE_SIZE > len(data):
+            raise CheckpointFormatError("Truncated checkpoint pages")
+    except Exception:
+        data.close()
+        raise
+
+    sim.reset()
+    memory = sim.memory
+    memory.mappings.append(data)
+    view = memoryview(data)
+    for k, base in enumerate(bases):
+        blob = view[offset + k * PAGE_SIZE:offset + (k + 1) * PAGE_SIZE]
+        if memory.ram_base <= base < memory.ram_end:
+            # Pages of the flat region must stay views of its buffer
+            memory.load(base, blob)
+        else:
+            memory.map_page(base, blob)
+    memory.set_code_range(code_start, code_end)
+
+    sim.program = program
+    sim.labels = meta['labels']
+    sim.decode_program()
+    sim.pc = meta['pc']
+    sim.x = meta['x']
+    sim.f = meta['f']
+    sim.csrs.csrs = csrs
+    sim.reservation = meta['reservation']
+    sim.exit_code = meta['exit_code']
+    sim.instret = meta['instret']
+    return len(bases)
@@ -0,0 +1,23 @@
+class Instruction:
+    # Pre-decoded form of a program entry. The handler is already bound to
+    # the exact operation, so executing it is a single call.
+    __slots__ = ('address', 'op', 'args', 'length', 'machine_code', 'source', 'handler')
+
+    def __init__(self, address, op, args, length, machine_code, source, handler):
+        self.address = address
+        self.op = op
+        self.args = args
+        self.length = length
+        self.machine_code = machine_code
+        self.source = source
+        self.handler = handler
+
+    def __repr__(self):
+        return f"Instruction({self.address:#x}, {self.source!r})"
+
+
+def decode(inst, executors, fallback):
+    # inst is an instruction dict as produced by the assembler
+    handler = executors.get(inst['op'], fallback)
+    return Instruction(inst['address'], inst['op'], tuple(inst['args']),
+                       inst['length'], inst['machine_code'], inst['source'], handler)
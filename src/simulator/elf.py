@@ -0,0 +1,106 @@
+import mmap
+import os
+import struct
+from .memory import PAGE_SIZE
+
+EM_RISCV = 243
+PT_LOAD = 1
+PF_X = 1
+
+STACK_TOP = 0x7FFFFFF0 # initial sp for loaded binaries
+
+# e_ident is checked separately; this is the rest of the ELF32 header
+_EHDR = struct.Struct('<HHIIIIIHHHHHH')
+_PHDR = struct.Struct('<IIIIIIII')
+
+class ELFError(Exception):
+    pass
+
+class Segment:
+    __slots__ = ('offset', 'vaddr', 'filesz', 'memsz', 'flags')
+
+    def __init__(self, offset, vaddr, filesz, memsz, flags):
+        self.offset = offset
+        self.vaddr = vaddr
+        self.filesz = filesz
+        self.memsz = memsz
+        self.flags = flags
+
+def parse_elf(data):
+    # Returns (entry, [Segment]) for the PT_LOAD segments of an RV32
+    # little-endian executable
+    if len(data) < 52 or bytes(data[:4]) != b'\x7fELF':
+        raise ELFError("Not an ELF file")
+    if data[4] != 1 or data[5] != 1:
+        raise ELFError("Only little-endian ELF32 is supported")
+    (e_type, e_machine, _, e_entry, e_phoff, _, _, _,
+     e_phentsize, e_phnum, _, _, _) = _EHDR.unpack_from(data, 16)
+    if e_machine != EM_RISCV:
+        raise ELFError(f"Not a RISC-V binary (e_machine={e_machine})")
+
+    segments = []
+    for i in range(e_phnum):
+        off = e_phoff + i * e_phentsize
+        if off + _PHDR.size > len(data):
+            raise ELFError("Truncated program header table")
+        p_type, p_offset, p_vaddr, _, p_filesz, p_memsz, p_flags, _ = _PHDR.unpack_from(data, off)
+        if p_type != PT_LOAD:
+            continue
+        if p_offset + p_filesz > len(data):
+            raise ELFError("Segment extends past end of file")
+        segments.append(Segment(p_offset, p_vaddr, p_filesz, p_memsz, p_flags))
+    return e_entry, segments
+
+def map_segments(memory, data, segments, share=False):
+    # With share, pages that lie entirely inside a segment's file image and
+    # share the file's page alignment are mapped as views of data (which
+    # simulated stores then write to); the rest is copied. Pages of pure
+    # .bss are left out, unmapped memory reads as zero.
+    view = memoryview(data)
+    share = share and not view.readonly
+    for seg in segments:
+        file_end = seg.vaddr + seg.filesz
+        addr = seg.vaddr
+        aligned = (seg.offset - seg.vaddr) % PAGE_SIZE == 0
+        while addr < file_end:
+            base = addr & ~0xFFF
+            pos = seg.offset + (addr - seg.vaddr)
+            # Pages of the flat region must stay views of its buffer
+            if share and aligned and addr == base and file_end - addr >= PAGE_SIZE \
+                    and base not in memory.pages and not memory.ram_base <= base < memory.ram_end:
+                memory.map_page(base, view[pos:pos + PAGE_SIZE])
+                addr += PAGE_SIZE
+            else:
+                n = min(base + PAGE_SIZE, file_end) - addr
+                memory.load(addr, view[pos:pos + n])
+                addr += n
+
+def load_elf(sim, source):
+    # source is a path (mapped copy-on-write, so writes never reach the
+    # file, and its pages shared) or a bytes-like object holding the image
+    # (copied, so the caller's buffer is never written).
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        entry, segments = parse_elf(source)
+        sim.reset()
+        map_segments(sim.memory, source, segments)
+    else:
+        with open(source, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ELFError("Not an ELF file")
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        try:
+            entry, segments = parse_elf(data)
+        except Exception:
+            data.close()
+            raise
+        sim.reset()
+        sim.memory.mappings.append(data)
+        map_segments(sim.memory, data, segments, share=True)
+    memory = sim.memory
+
+    code = [s for s in segments if s.flags & PF_X]
+    if code:
+        memory.set_code_range(min(s.vaddr for s in code), max(s.vaddr + s.memsz for s in code))
+    sim.pc = entry
+    sim.x[2] = STACK_TOP
+    return entry
@@ -0,0 +1,410 @@
+# RV32IMAFC machine code encoder / decoder.
+#
+# Argument lists use the same order as the assembler and the
+# executors, e.g. loads are [rd, imm, rs1] and branch/jump immediates are
+# byte offsets from the instruction's own address.
+
+# op: (format, opcode, funct3, funct7)
+ENCODING = {
+    'add': ('R', 0x33, 0x0, 0x00), 'sub': ('R', 0x33, 0x0, 0x20),
+    'sll': ('R', 0x33, 0x1, 0x00), 'slt': ('R', 0x33, 0x2, 0x00),
+    'sltu': ('R', 0x33, 0x3, 0x00), 'xor': ('R', 0x33, 0x4, 0x00),
+    'srl': ('R', 0x33, 0x5, 0x00), 'sra': ('R', 0x33, 0x5, 0x20),
+    'or': ('R', 0x33, 0x6, 0x00), 'and': ('R', 0x33, 0x7, 0x00),
+
+    'mul': ('R', 0x33, 0x0, 0x01), 'mulh': ('R', 0x33, 0x1, 0x01),
+    'mulhsu': ('R', 0x33, 0x2, 0x01), 'mulhu': ('R', 0x33, 0x3, 0x01),
+    'div': ('R', 0x33, 0x4, 0x01), 'divu': ('R', 0x33, 0x5, 0x01),
+    'rem': ('R', 0x33, 0x6, 0x01), 'remu': ('R', 0x33, 0x7, 0x01),
+
+    'addi': ('I', 0x13, 0x0, None), 'slti': ('I', 0x13, 0x2, None),
+    'sltiu': ('I', 0x13, 0x3, None), 'xori': ('I', 0x13, 0x4, None),
+    'ori': ('I', 0x13, 0x6, None), 'andi': ('I', 0x13, 0x7, None),
+    'slli': ('SH', 0x13, 0x1, 0x00), 'srli': ('SH', 0x13, 0x5, 0x00),
+    'srai': ('SH', 0x13, 0x5, 0x20),
+
+    'lb': ('L', 0x03, 0x0, None), 'lh': ('L', 0x03, 0x1, None),
+    'lw': ('L', 0x03, 0x2, None), 'lbu': ('L', 0x03, 0x4, None),
+    'lhu': ('L', 0x03, 0x5, None),
+    'sb': ('S', 0x23, 0x0, None), 'sh': ('S', 0x23, 0x1, None),
+    'sw': ('S', 0x23, 0x2, None),
+
+    'beq': ('B', 0x63, 0x0, None), 'bne': ('B', 0x63, 0x1, None),
+    'blt': ('B', 0x63, 0x4, None), 'bge': ('B', 0x63, 0x5, None),
+    'bltu': ('B', 0x63, 0x6, None), 'bgeu': ('B', 0x63, 0x7, None),
+
+    'jal': ('J', 0x6F, None, None), 'jalr': ('I', 0x67, 0x0, None),
+    'lui': ('U', 0x37, None, None), 'auipc': ('U', 0x17, None, None),
+    'ecall': ('SYS', 0x73, 0x0, 0x00),
+
+    # RV32A, funct7 holds funct5 (aq/rl are always encoded as 0)
+    'lr.w': ('LR', 0x2F, 0x2, 0x02), 'sc.w': ('AMO', 0x2F, 0x2, 0x03),
+    'amoswap.w': ('AMO', 0x2F, 0x2, 0x01), 'amoadd.w': ('AMO', 0x2F, 0x2, 0x00),
+    'amoxor.w': ('AMO', 0x2F, 0x2, 0x04), 'amoand.w': ('AMO', 0x2F, 0x2, 0x0C),
+    'amoor.w': ('AMO', 0x2F, 0x2, 0x08), 'amomin.w': ('AMO', 0x2F, 0x2, 0x10),
+    'amomax.w': ('AMO', 0x2F, 0x2, 0x14), 'amominu.w': ('AMO', 0x2F, 0x2, 0x18),
+    'amomaxu.w': ('AMO', 0x2F, 0x2, 0x1C),
+
+    # RV32F. funct3 None means the rounding mode field (encoded as dynamic);
+    # for the 'FR1' forms funct7 is (funct7, rs2) since rs2 selects the op.
+    'flw': ('L', 0x07, 0x2, None), 'fsw': ('S', 0x27, 0x2, None),
+    'fadd.s': ('FR', 0x53, None, 0x00), 'fsub.s': ('FR', 0x53, None, 0x04),
+    'fmul.s': ('FR', 0x53, None, 0x08), 'fdiv.s': ('FR', 0x53, None, 0x0C),
+    'fsgnj.s': ('FR', 0x53, 0x0, 0x10), 'fsgnjn.s': ('FR', 0x53, 0x1, 0x10),
+    'fsgnjx.s': ('FR', 0x53, 0x2, 0x10),
+    'fmin.s': ('FR', 0x53, 0x0, 0x14), 'fmax.s': ('FR', 0x53, 0x1, 0x14),
+    'feq.s': ('FR', 0x53, 0x2, 0x50), 'flt.s': ('FR', 0x53, 0x1, 0x50),
+    'fle.s': ('FR', 0x53, 0x0, 0x50),
+    'fsqrt.s': ('FR1', 0x53, None, (0x2C, 0)),
+    'fcvt.w.s': ('FR1', 0x53, None, (0x60, 0)), 'fcvt.wu.s': ('FR1', 0x53, None, (0x60, 1)),
+    'fcvt.s.w': ('FR1', 0x53, None, (0x68, 0)), 'fcvt.s.wu': ('FR1', 0x53, None, (0x68, 1)),
+    'fmv.x.w': ('FR1', 0x53, 0x0, (0x70, 0)), 'fmv.w.x': ('FR1', 0x53, 0x0, (0x78, 0)),
+}
+
+RM_DYN = 0x7
+
+# Compressed ops: (quadrant, funct3)
+C_ENCODING = {
+    'c.addi': (1, 0b000), 'c.nop': (1, 0b000), 'c.jal': (1, 0b001),
+    'c.li': (1, 0b010), 'c.lui': (1, 0b011),
+    'c.srli': (1, 0b100), 'c.srai': (1, 0b100), 'c.andi': (1, 0b100),
+    'c.sub': (1, 0b100), 'c.xor': (1, 0b100), 'c.or': (1, 0b100), 'c.and': (1, 0b100),
+    'c.j': (1, 0b101), 'c.beqz': (1, 0b110), 'c.bnez': (1, 0b111),
+    'c.lwsp': (2, 0b010), 'c.swsp': (2, 0b110),
+    'c.jr': (2, 0b100), 'c.mv': (2, 0b100), 'c.jalr': (2, 0b100), 'c.add': (2, 0b100),
+}
+
+C_ARITH = {'c.sub': 0b00, 'c.xor': 0b01, 'c.or': 0b10, 'c.and': 0b11}
+C_SHIFT = {'c.srli': 0b00, 'c.srai': 0b01, 'c.andi': 0b10}
+
+class EncodingError(Exception):
+    pass
+
+def instruction_length(op):
+    return 2 if op.startswith('c.') else 4
+
+def sext(v, bits):
+    v &= (1 << bits) - 1
+    return v - (1 << bits) if v & (1 << (bits - 1)) else v
+
+def _bits(v, hi, lo):
+    return (v >> lo) & ((1 << (hi - lo + 1)) - 1)
+
+def _imm(v, bits, signed=True, align=1, name='Immediate'):
+    lo, hi = (-(1 << (bits - 1)), (1 << (bits - 1)) - 1) if signed else (0, (1 << bits) - 1)
+    if not lo <= v <= hi or v % align:
+        extra = f", multiple of {align}" if align > 1 else ""
+        raise EncodingError(f"{name} {v} out of range [{lo}, {hi}{extra}]")
+    return v & ((1 << bits) - 1)
+
+def _reg(r):
+    if not 0 <= r < 32:
+        raise EncodingError(f"Invalid register: x{r}")
+    return r
+
+def _creg(r):
+    # Compressed 3-bit register field (x8..x15)
+    if not 8 <= r <= 15:
+        raise EncodingError(f"Register x{r} not encodable here (needs x8-x15)")
+    return r - 8
+
+def _args(op, args, n):
+    if len(args) != n:
+        raise EncodingError(f"{op} expects {n} operands, got {len(args)}")
+    return args
+
+def encode(op, args):
+    # Returns the instruction word (16-bit for compressed ops)
+    if op.startswith('c.'):
+        return _encode_c(op, args)
+    if op not in ENCODING:
+        raise EncodingError(f"Unknown instruction: {op}")
+    fmt, opc, f3, f7 = ENCODING[op]
+
+    if fmt == 'R':
+        rd, rs1, rs2 = _args(op, args, 3)
+        return f7 << 25 | _reg(rs2) << 20 | _reg(rs1) << 15 | f3 << 12 | _reg(rd) << 7 | opc
+    if fmt == 'I':
+        rd, rs1, imm = _args(op, args, 3)
+        return _imm(imm, 12) << 20 | _reg(rs1) << 15 | f3 << 12 | _reg(rd) << 7 | opc
+    if fmt == 'SH':
+        rd, rs1, shamt = _args(op, args, 3)
+        return f7 << 25 | _imm(shamt, 5, False, name='Shift amount') << 20 | _reg(rs1) << 15 | f3 << 12 | _reg(rd) << 7 | opc
+    if fmt == 'L':
+        rd, imm, rs1 = _args(op, args, 3)
+        return _imm(imm, 12) << 20 | _reg(rs1) << 15 | f3 << 12 | _reg(rd) << 7 | opc
+    if fmt == 'S':
+        rs2, imm, rs1 = _args(op, args, 3)
+        imm = _imm(imm, 12)
+        return _bits(imm, 11, 5) << 25 | _reg(rs2) << 20 | _reg(rs1) << 15 | f3 << 12 | _bits(imm, 4, 0) << 7 | opc
+    if fmt == 'B':
+        rs1, rs2, imm = _args(op, args, 3)
+        imm = _imm(imm, 13, align=2, name='Branch offset')
+        return (_bits(imm, 12, 12) << 31 | _bits(imm, 10, 5) << 25 | _reg(rs2) << 20 | _reg(rs1) << 15 |
+                f3 << 12 | _bits(imm, 4, 1) << 8 | _bits(imm, 11, 11) << 7 | opc)
+    if fmt == 'J':
+        rd, imm = _args(op, args, 2)
+        imm = _imm(imm, 21, align=2, name='Jump offset')
+        return (_bits(imm, 20, 20) << 31 | _bits(imm, 10, 1) << 21 | _bits(imm, 11, 11) << 20 |
+                _bits(imm, 19, 12) << 12 | _reg(rd) << 7 | opc)
+    if fmt == 'U':
+        rd, imm = _args(op, args, 2)
+        if not -(1 << 19) <= imm < (1 << 20):
+            raise EncodingError(f"Immediate {imm} out of range for {op}")
+        return (imm & 0xFFFFF) << 12 | _reg(rd) << 7 | opc
+    if fmt == 'SYS':
+        _args(op, args, 0)
+        return opc
+    if fmt == 'LR':
+        rd, rs1 = _args(op, args, 2)
+        return f7 << 27 | _reg(rs1) << 15 | f3 << 12 | _reg(rd) << 7 | opc
+    if fmt == 'AMO':
+        rd, rs1, rs2 = _args(op, args, 3)
+        return f7 << 27 | _reg(rs2) << 20 | _reg(rs1) << 15 | f3 << 12 | _reg(rd) << 7 | opc
+    if fmt == 'FR':
+        rd, rs1, rs2 = _args(op, args, 3)
+        f3 = RM_DYN if f3 is None else f3
+        return f7 << 25 | _reg(rs2) << 20 | _reg(rs1) << 15 | f3 << 12 | _reg(rd) << 7 | opc
+    if fmt == 'FR1':
+        rd, rs1 = _args(op, args, 2)
+        f7, rs2 = f7
+        f3 = RM_DYN if f3 is None else f3
+        return f7 << 25 | rs2 << 20 | _reg(rs1) << 15 | f3 << 12 | _reg(rd) << 7 | opc
+    raise EncodingError(f"Unknown instruction: {op}")
+
+def _cj(imm):
+    # CJ-format offset: imm[11|4|9:8|10|6|7|3:1|5]
+    imm = _imm(imm, 12, align=2, name='Jump offset')
+    return (_bits(imm, 11, 11) << 12 | _bits(imm, 4, 4) << 11 | _bits(imm, 9, 8) << 9 |
+            _bits(imm, 10, 10) << 8 | _bits(imm, 6, 6) << 7 | _bits(imm, 7, 7) << 6 |
+            _bits(imm, 3, 1) << 3 | _bits(imm, 5, 5) << 2)
+
+def _cb(imm):
+    # CB-format branch offset: imm[8|4:3] ... imm[7:6|2:1|5]
+    imm = _imm(imm, 9, align=2, name='Branch offset')
+    return (_bits(imm, 8, 8) << 12 | _bits(imm, 4, 3) << 10 | _bits(imm, 7, 6) << 5 |
+            _bits(imm, 2, 1) << 3 | _bits(imm, 5, 5) << 2)
+
+def _ci(imm):
+    # 6-bit immediate split as imm[5] at bit 12, imm[4:0] at bits 6:2
+    return _bits(imm, 5, 5) << 12 | _bits(imm, 4, 0) << 2
+
+def _encode_c(op, args):
+    if op not in C_ENCODING:
+        raise EncodingError(f"Unknown instruction: {op}")
+    quad, f3 = C_ENCODING[op]
+    base = f3 << 13 | quad
+
+    if op == 'c.nop':
+        _args(op, args, 0)
+        return base
+    if op in ('c.addi', 'c.li'):
+        rd, imm = _args(op, args, 2)
+        if op == 'c.addi' and rd == 0:
+            raise EncodingError("c.addi needs rd != x0")
+        return base | _reg(rd) << 7 | _ci(_imm(imm, 6))
+    if op == 'c.lui':
+        rd, imm = _args(op, args, 2)
+        if rd in (0, 2) or imm == 0:
+            raise EncodingError("c.lui needs rd != x0/x2 and a non-zero immediate")
+        if imm >= 0xFFFE0: # upper-immediate spelling of a negative value
+            imm = sext(imm, 20)
+        return base | _reg(rd) << 7 | _ci(_imm(imm, 6))
+    if op in C_SHIFT:
+        rd, imm = _args(op, args, 2)
+        imm = _imm(imm, 6) if op == 'c.andi' else _imm(imm, 5, signed=False, name='Shift amount')
+        return base | C_SHIFT[op] << 10 | _creg(rd) << 7 | _ci(imm)
+    if op in C_ARITH:
+        rd, rs2 = _args(op, args, 2)
+        return base | 0b011 << 10 | _creg(rd) << 7 | C_ARITH[op] << 5 | _creg(rs2) << 2
+    if op in ('c.j', 'c.jal'):
+        (imm,) = _args(op, args, 1)
+        return base | _cj(imm)
+    if op in ('c.beqz', 'c.bnez'):
+        rs1, imm = _args(op, args, 2)
+        return base | _creg(rs1) << 7 | _cb(imm)
+    if op == 'c.lwsp':
+        rd, imm = _args(op, args, 2)
+        if rd == 0:
+            raise EncodingError("c.lwsp needs rd != x0")
+        imm = _imm(imm, 8, signed=False, align=4, name='Offset')
+        return base | _bits(imm, 5, 5) << 12 | _reg(rd) << 7 | _bits(imm, 4, 2) << 4 | _bits(imm, 7, 6) << 2
+    if op == 'c.swsp':
+        rs2, imm = _args(op, args, 2)
+        imm = _imm(imm, 8, signed=False, align=4, name='Offset')
+        return base | _bits(imm, 5, 2) << 9 | _bits(imm, 7, 6) << 7 | _reg(rs2) << 2
+    if op in ('c.jr', 'c.jalr'):
+        (rs1,) = _args(op, args, 1)
+        if rs1 == 0:
+            raise EncodingError(f"{op} needs rs1 != x0")
+        return base | (op == 'c.jalr') << 12 | _reg(rs1) << 7
+    if op in ('c.mv', 'c.add'):
+        rd, rs2 = _args(op, args, 2)
+        if rs2 == 0:
+            raise EncodingError(f"{op} needs rs2 != x0")
+        return base | (op == 'c.add') << 12 | _reg(rd) << 7 | _reg(rs2) << 2
+    raise EncodingError(f"Unknown instruction: {op}")
+
+
+# Decoding
+
+_R_DECODE = {(e[1], e[2], e[3]): op for op, e in ENCODING.items() if e[0] == 'R'}
+_I_DECODE = {(e[1], e[2]): op for op, e in ENCODING.items() if e[0] in ('I', 'L')}
+_SH_DECODE = {(e[2], e[3]): op for op, e in ENCODING.items() if e[0] == 'SH'}
+_S_DECODE = {(e[1], e[2]): op for op, e in ENCODING.items() if e[0] == 'S'}
+_B_DECODE = {e[2]: op for op, e in ENCODING.items() if e[0] == 'B'}
+_AMO_DECODE = {e[3]: op for op, e in ENCODING.items() if e[0] in ('AMO', 'LR')}
+_FR_DECODE = {(e[3], e[2]): op for op, e in ENCODING.items() if e[0] == 'FR'}
+_FR1_DECODE = {e[3]: op for op, e in ENCODING.items() if e[0] == 'FR1'}
+
+def decode_word(word):
+    # Returns (op, args, length) or None for an illegal/unsupported encoding.
+    # Compressed instructions are recognised from the low two bits, so
+    # word may hold just the 16-bit parcel for those.
+    if word & 0x3 != 0x3:
+        return _decode_c(word & 0xFFFF)
+
+    opc = word & 0x7F
+    rd = (word >> 7) & 0x1F
+    f3 = (word >> 12) & 0x7
+    rs1 = (word >> 15) & 0x1F
+    rs2 = (word >> 20) & 0x1F
+    f7 = word >> 25
+    imm_i = sext(word >> 20, 12)
+
+    if opc == 0x33:
+        op = _R_DECODE.get((opc, f3, f7))
+        return (op, [rd, rs1, rs2], 4) if op else None
+    if opc == 0x13:
+        if f3 in (0x1, 0x5):
+            op = _SH_DECODE.get((f3, f7))
+            return (op, [rd, rs1, rs2], 4) if op else None
+        op = _I_DECODE.get((opc, f3))
+        return (op, [rd, rs1, imm_i], 4) if op else None
+    if opc in (0x03, 0x07):
+        op = _I_DECODE.get((opc, f3))
+        return (op, [rd, imm_i, rs1], 4) if op else None
+    if opc == 0x67 and f3 == 0:
+        return ('jalr', [rd, rs1, imm_i], 4)
+    if opc in (0x23, 0x27):
+        op = _S_DECODE.get((opc, f3))
+        imm = sext((f7 << 5) | rd, 12)
+        return (op, [rs2, imm, rs1], 4) if op else None
+    if opc == 0x63:
+        op = _B_DECODE.get(f3)
+        imm = sext(_bits(word, 31, 31) << 12 | _bits(word, 7, 7) << 11 |
+                   _bits(word, 30, 25) << 5 | _bits(word, 11, 8) << 1, 13)
+        return (op, [rs1, rs2, imm], 4) if op else None
+    if opc == 0x6F:
+        imm = sext(_bits(word, 31, 31) << 20 | _bits(word, 19, 12) << 12 |
+                   _bits(word, 20, 20) << 11 | _bits(word, 30, 21) << 1, 21)
+        return ('jal', [rd, imm], 4)
+    if opc == 0x37:
+        return ('lui', [rd, word >> 12], 4)
+    if opc == 0x17:
+        return ('auipc', [rd, word >> 12], 4)
+    if word == 0x73:
+        return ('ecall', [], 4)
+    if opc == 0x2F and f3 == 0x2:
+        op = _AMO_DECODE.get(word >> 27)
+        if op == 'lr.w':
+            return (op, [rd, rs1], 4)
+        return (op, [rd, rs1, rs2], 4) if op else None
+    if opc == 0x53:
+        op = _FR1_DECODE.get((f7, rs2))
+        if op:
+            return (op, [rd, rs1], 4)
+        op = _FR_DECODE.get((f7, f3)) or _FR_DECODE.get((f7, None))
+        return (op, [rd, rs1, rs2], 4) if op else None
+    return None
+
+def _decode_c(h):
+    quad = h & 0x3
+    f3 = h >> 13
+    rd = (h >> 7) & 0x1F
+    rs2 = (h >> 2) & 0x1F
+    rd_c = ((h >> 7) & 0x7) + 8
+    rs2_c = ((h >> 2) & 0x7) + 8
+    imm6 = sext(_bits(h, 12, 12) << 5 | _bits(h, 6, 2), 6)
+
+    if quad == 1:
+        if f3 == 0b000:
+            if rd == 0:
+                return ('c.nop', [], 2)
+            return ('c.addi', [rd, imm6], 2)
+        if f3 in (0b001, 0b101):
+            imm = sext(_bits(h, 12, 12) << 11 | _bits(h, 11, 11) << 4 | _bits(h, 10, 9) << 8 |
+                       _bits(h, 8, 8) << 10 | _bits(h, 7, 7) << 6 | _bits(h, 6, 6) << 7 |
+                       _bits(h, 5, 3) << 1 | _bits(h, 2, 2) << 5, 12)
+            return ('c.jal' if f3 == 0b001 else 'c.j', [imm], 2)
+        if f3 == 0b010:
+            return ('c.li', [rd, imm6], 2)
+        if f3 == 0b011:
+            if rd in (0, 2) or imm6 == 0:
+                return None
+            return ('c.lui', [rd, imm6], 2)
+        if f3 == 0b100:
+            kind = _bits(h, 11, 10)
+            if kind == 0b11:
+                if _bits(h, 12, 12):
+                    return None
+                op = {v: k for k, v in C_ARITH.items()}[_bits(h, 6, 5)]
+                return (op, [rd_c, rs2_c], 2)
+            op = {v: k for k, v in C_SHIFT.items()}[kind]
+            if op != 'c.andi' and _bits(h, 12, 12):
+                return None # shamt[5] is reserved on RV32
+            imm = imm6 if op == 'c.andi' else imm6 & 0x3F
+            return (op, [rd_c, imm], 2)
+        if f3 in (0b110, 0b111):
+            imm = sext(_bits(h, 12, 12) << 8 | _bits(h, 11, 10) << 3 | _bits(h, 6, 5) << 6 |
+                       _bits(h, 4, 3) << 1 | _bits(h, 2, 2) << 5, 9)
+            return ('c.beqz' if f3 == 0b110 else 'c.bnez', [rd_c, imm], 2)
+    elif quad == 2:
+        if f3 == 0b010 and rd:
+            imm = _bits(h, 12, 12) << 5 | _bits(h, 6, 4) << 2 | _bits(h, 3, 2) << 6
+            return ('c.lwsp', [rd, imm], 2)
+        if f3 == 0b110:
+            imm = _bits(h, 12, 9) << 2 | _bits(h, 8, 7) << 6
+            return ('c.swsp', [rs2, imm], 2)
+        if f3 == 0b100:
+            bit12 = _bits(h, 12, 12)
+            if rs2 == 0:
+                if rd == 0:
+                    return None
+                return ('c.jalr' if bit12 else 'c.jr', [rd], 2)
+            return ('c.add' if bit12 else 'c.mv', [rd, rs2], 2)
+    return None
+
+
+# Disassembly (used for instructions that only exist in memory)
+
+# Operand kinds in argument order: x = integer reg, f = float reg, i = imm,
+# m = offset(base) pair
+_FORMAT_OPERANDS = {'R': 'xxx', 'I': 'xxi', 'SH': 'xxi', 'L': 'xm', 'S': 'xm',
+                    'B': 'xxi', 'J': 'xi', 'U': 'xi', 'SYS': '', 'LR': 'xx', 'AMO': 'xxx',
+                    'FR': 'fff', 'FR1': 'ff'}
+
+_OPERANDS = {
+    'flw': 'fm', 'fsw': 'fm',
+    'feq.s': 'xff', 'flt.s': 'xff', 'fle.s': 'xff',
+    'fcvt.w.s': 'xf', 'fcvt.wu.s': 'xf', 'fmv.x.w': 'xf',
+    'fcvt.s.w': 'fx', 'fcvt.s.wu': 'fx', 'fmv.w.x': 'fx',
+    'c.nop': '', 'c.j': 'i', 'c.jal': 'i', 'c.jr': 'x', 'c.jalr': 'x',
+    'c.mv': 'xx', 'c.add': 'xx', 'c.sub': 'xx', 'c.xor': 'xx', 'c.or': 'xx', 'c.and': 'xx',
+}
+
+def disassemble(op, args):
+    kinds = _OPERANDS.get(op)
+    if kinds is None:
+        kinds = _FORMAT_OPERANDS[ENCODING[op][0]] if op in ENCODING else 'xi'
+    parts = []
+    args = list(args)
+    for kind in kinds:
+        if kind == 'm':
+            imm, base = args.pop(0), args.pop(0)
+            parts.append(f"{imm}(x{base})")
+        elif kind == 'i':
+            parts.append(str(args.pop(0)))
+        else:
+            parts.append(f"{kind}{args.pop(0)}")
+    return f"{op} {', '.join(parts)}".rstrip()
@@ -0,0 +1,180 @@
+import random
+import time
+from .riscv_sim import RISCVSimulator, STOP_HALTED, STOP_BUDGET, STOP_UNKNOWN
+from .instructions.rv32a import exec_lr, exec_sc, AMO_OPS, make_atomic
+
+# Several harts sharing one Memory. Each hart is a RISCVSimulator with
+# its own registers, PC and LR reservation; a scheduler runs them one
+# quantum of instructions at a time, round-robin or in a seeded random
+# order. While a hart runs, the reservations of all the others are
+# registered with the memory, so any store, SC or AMO it makes to a
+# reserved word makes the other hart's SC fail.
+#
+# Hart i starts with a0 = i (and mhartid = i), the rest of the state
+# copied from hart 0. Stores into the program text are not supported.
+
+POLICIES = ('round_robin', 'random')
+
+MHARTID = 0xF14
+
+class HartConfigError(Exception):
+    pass
+
+class MultiHartSimulator:
+    def __init__(self, harts=2, quantum=100, policy='round_robin', seed=0):
+        if harts < 1:
+            raise HartConfigError("Need at least one hart")
+        if quantum < 1:
+            raise HartConfigError("quantum must be at least one instruction")
+        if policy not in POLICIES:
+            raise HartConfigError(f"Unknown scheduling policy: {policy}")
+        self.quantum = quantum
+        self.policy = policy
+        self.seed = seed
+        self.harts = [RISCVSimulator(trace=False) for _ in range(harts)]
+        for hart in self.harts:
+            self._count_atomics(hart)
+        self.reset()
+
+    def reset(self):
+        for hart in self.harts:
+            hart.reset()
+        self.share()
+        self.rng = random.Random(self.seed)
+        self.next_hart = 0
+        self.slices = [0] * len(self.harts)
+        self.contention = {} # addr -> [lr, sc, sc failed, amo]
+
+    def _count_atomics(self, hart):
+        # Handlers for LR/SC/AMOs that also count them per address
+        def stats(addr):
+            entry = self.contention.get(addr)
+            if entry is None:
+                entry = self.contention[addr] = [0, 0, 0, 0]
+            return entry
+
+        def lr(sim, inst):
+            stats(sim.x[inst.args[1]])[0] += 1
+            exec_lr(sim, inst)
+
+        def sc(sim, inst):
+            addr = sim.x[inst.args[1]]
+            entry = stats(addr)
+            entry[1] += 1
+            if sim.reservation != addr:
+                entry[2] += 1
+            exec_sc(sim, inst)
+
+        def counted(handler):
+            def amo(sim, inst):
+                stats(sim.x[inst.args[1]])[3] += 1
+                handler(sim, inst)
+            return amo
+
+        hart.executors['lr.w'] = lr
+        hart.executors['sc.w'] = sc
+        hart.executors.update({op: counted(make_atomic(op)) for op in AMO_OPS})
+
+    def share(self):
+        # Points harts 1.. at hart 0's memory and program, with hart 0's
+        # registers and PC
+        first = self.harts[0]
+        for i, hart in enumerate(self.harts):
+            if i:
+                hart.memory = first.memory
+                hart.program = first.program
+                hart.labels = first.labels
+                hart.pc = first.pc
+                hart.x = first.x[:]
+                hart.f = first.f[:]
+                hart.decoded = {}
+                hart.blocks.clear()
+                hart.decode_program()
+            hart.write_reg(10, i)
+            hart.csrs.write(MHARTID, i)
+
+    def assemble(self, code):
+        self.reset()
+        result = self.harts[0].assemble(code)
+        if result[0]:
+            self.share()
+        return result
+
+    def load_elf(self, source):
+        self.reset()
+        entry = self.harts[0].load_elf(source)
+        self.share()
+        return entry
+
+    @property
+    def memory(self):
+        return self.harts[0].memory
+
+    def running(self):
+        return [i for i, hart in enumerate(self.harts) if hart.fetch(hart.pc) is not None]
+
+    def _pick(self, runnable):
+        if self.policy == 'random':
+            return self.rng.choice(runnable)
+        n = len(self.harts)
+        for k in range(n):
+            i = (self.next_hart + k) % n
+            if i in runnable:
+                self.next_hart = i + 1
+                return i
+
+    def run(self, max_steps=None, max_time=None):
+        # Runs until every hart halted or one hit an unknown instruction,
+        # or max_steps instructions (over all harts) / max_time seconds are
+        # used up. Returns one of the STOP_* reasons.
+        deadline = None if max_time is None else time.perf_counter() + max_time
+        memory = self.memory
+        executed = 0
+        try:
+            while True:
+                runnable = self.running()
+                if not runnable:
+                    return STOP_HALTED
+                if max_steps is not None and executed >= max_steps:
+                    return STOP_BUDGET
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return STOP_BUDGET
+                i = self._pick(runnable)
+                hart = self.harts[i]
+                memory.set_reservations([(h.reservation, h) for h in self.harts
+                                         if h is not hart and h.reservation is not None])
+                quantum = self.quantum if max_steps is None else min(self.quantum, max_steps - executed)
+                before = hart.instret
+                reason = hart.run(max_steps=quantum)
+                executed += hart.instret - before
+                self.slices[i] += 1
+                if reason == STOP_UNKNOWN:
+                    return reason
+        finally:
+            memory.set_reservations([])
+
+    def report(self):
+        lr = sc = failed = amo = 0
+        addresses = []
+        for addr, (n_lr, n_sc, n_failed, n_amo) in sorted(self.contention.items()):
+            lr += n_lr
+            sc += n_sc
+            failed += n_failed
+            amo += n_amo
+            addresses.append({'addr': addr, 'lr': n_lr, 'sc': n_sc, 'sc_failed': n_failed,
+                              'sc_failure_rate': n_failed / n_sc if n_sc else None,
+                              'amo': n_amo})
+        return {
+            'harts': [{'hart': i, 'pc': hart.pc, 'instret': hart.instret,
+                       'exit_code': hart.exit_code, 'slices': self.slices[i]}
+                      for i, hart in enumerate(self.harts)],
+            'quantum': self.quantum,
+            'policy': self.policy,
+            'lr': lr,
+            'sc': sc,
+            'sc_failed': failed,
+            'sc_failure_rate': failed / sc if sc else None,
+            'amo': amo,
+            'reservations_broken': self.memory.reservations_broken,
+            'addresses': addresses,
+        }
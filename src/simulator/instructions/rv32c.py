@@ -1,179 +1,145 @@
+from .rv32i import to_signed
 
-def exec_c_type(sim, inst):
-    op = inst['op']
-    args = inst['args']
-    
-    # helper
-    def sext(v, bits):
-        shift = 32 - bits
-        if v & (1 << (bits - 1)):
-            return v - (1 << bits)
-        return v
-        
-    if op == 'c.nop':
-        sim.pc += 2
-        pass 
-        
-    elif op == 'c.addi':
-        rd, imm = args
-        v1 = sim.x[rd]
-        res = (v1 + imm) & 0xFFFFFFFF
-        sim.write_reg(rd, res)
+def exec_c_nop(sim, inst):
+    sim.pc += 2
+
+def exec_c_addi(sim, inst):
+    rd, imm = inst.args
+    res = (sim.x[rd] + imm) & 0xFFFFFFFF
+    sim.write_reg(rd, res)
+    if sim.trace:
         sim.update_pipe(rd=rd, rs1=rd, imm=imm, alu_out=res)
-        sim.pc += 2
-        
-    elif op == 'c.mv':
-        rd, rs2 = args
-        val = sim.x[rs2]
-        sim.write_reg(rd, val)
+    sim.pc += 2
+
+def exec_c_mv(sim, inst):
+    rd, rs2 = inst.args
+    val = sim.x[rs2]
+    sim.write_reg(rd, val)
+    if sim.trace:
         sim.update_pipe(rd=rd, rs1=0, rs2=rs2, alu_out=val)
-        sim.pc += 2
-        
-    elif op == 'c.add':
-        rd, rs2 = args
-        v1 = sim.x[rd]
-        v2 = sim.x[rs2]
-        res = (v1 + v2) & 0xFFFFFFFF
-        sim.write_reg(rd, res)
-        sim.update_pipe(rd=rd, rs1=rd, rs2=rs2, alu_out=res)
-        sim.pc += 2
-        
-    elif op == 'c.sub':
-        rd, rs2 = args
-        v1 = sim.x[rd]
-        v2 = sim.x[rs2]
-        res = (v1 - v2) & 0xFFFFFFFF
-        sim.write_reg(rd, res)
-        sim.update_pipe(rd=rd, rs1=rd, rs2=rs2, alu_out=res)
-        sim.pc += 2
-        
-    elif op == 'c.and':
-        rd, rs2 = args
-        v1 = sim.x[rd]
-        v2 = sim.x[rs2]
-        res = v1 & v2
-        sim.write_reg(rd, res)
-        sim.update_pipe(rd=rd, rs1=rd, rs2=rs2, alu_out=res)
-        sim.pc += 2
-        
-    elif op == 'c.or':
-        rd, rs2 = args
-        v1 = sim.x[rd]
-        v2 = sim.x[rs2]
-        res = v1 | v2
-        sim.write_reg(rd, res)
-        sim.update_pipe(rd=rd, rs1=rd, rs2=rs2, alu_out=res)
-        sim.pc += 2
-        
-    elif op == 'c.xor':
-        rd, rs2 = args
-        v1 = sim.x[rd]
-        v2 = sim.x[rs2]
-        res = v1 ^ v2
+    sim.pc += 2
+
+# Two-register forms: rd = rd <op> rs2
+C_ALU_OPS = {
+    'c.add': lambda a, b: (a + b) & 0xFFFFFFFF,
+    'c.sub': lambda a, b: (a - b) & 0xFFFFFFFF,
+    'c.and': lambda a, b: a & b,
+    'c.or': lambda a, b: a | b,
+    'c.xor': lambda a, b: a ^ b,
+}
+
+def make_c_alu(op):
+    alu = C_ALU_OPS[op]
+
+    def exec_c_alu(sim, inst):
+        rd, rs2 = inst.args
+        res = alu(sim.x[rd], sim.x[rs2])
         sim.write_reg(rd, res)
-        sim.update_pipe(rd=rd, rs1=rd, rs2=rs2, alu_out=res)
+        if sim.trace:
+            sim.update_pipe(rd=rd, rs1=rd, rs2=rs2, alu_out=res)
         sim.pc += 2
+    return exec_c_alu
 
-    elif op == 'c.li':
-        rd, imm = args
-        sim.write_reg(rd, imm)
+def exec_c_li(sim, inst):
+    rd, imm = inst.args
+    sim.write_reg(rd, imm)
+    if sim.trace:
         sim.update_pipe(rd=rd, imm=imm, alu_out=imm)
-        sim.pc += 2
-        
-    elif op == 'c.lui':
-        rd, imm = args
-        val = (imm << 12) & 0xFFFFFFFF
-        sim.write_reg(rd, val)
+    sim.pc += 2
+
+def exec_c_lui(sim, inst):
+    rd, imm = inst.args
+    val = (imm << 12) & 0xFFFFFFFF
+    sim.write_reg(rd, val)
+    if sim.trace:
         sim.update_pipe(rd=rd, imm=imm, alu_out=val)
-        sim.pc += 2
-        
-    elif op == 'c.srli':
-        rd, shamt = args
-        v1 = sim.x[rd]
-        res = (v1 & 0xFFFFFFFF) >> shamt
-        sim.write_reg(rd, res)
-        sim.update_pipe(rd=rd, rs1=rd, imm=shamt, alu_out=res)
-        sim.pc += 2
-        
-    elif op == 'c.srai':
-        rd, shamt = args
-        v1 = sim.x[rd]
-        import struct
-        val_s = struct.unpack('i', struct.pack('I', v1 & 0xFFFFFFFF))[0]
-        res = val_s >> shamt
-        sim.write_reg(rd, res)
-        sim.update_pipe(rd=rd, rs1=rd, imm=shamt, alu_out=res)
-        sim.pc += 2
-        
-    elif op == 'c.andi':
-        rd, imm = args
-        v1 = sim.x[rd]
-        res = v1 & imm
+    sim.pc += 2
+
+# Register-immediate forms: rd = rd <op> imm
+C_IMM_OPS = {
+    'c.srli': lambda a, shamt: a >> shamt,
+    'c.srai': lambda a, shamt: to_signed(a) >> shamt,
+    'c.andi': lambda a, imm: a & imm,
+}
+
+def make_c_imm(op):
+    alu = C_IMM_OPS[op]
+
+    def exec_c_imm(sim, inst):
+        rd, imm = inst.args
+        res = alu(sim.x[rd], imm)
         sim.write_reg(rd, res)
-        sim.update_pipe(rd=rd, rs1=rd, imm=imm, alu_out=res)
+        if sim.trace:
+            sim.update_pipe(rd=rd, rs1=rd, imm=imm, alu_out=res)
         sim.pc += 2
-        
-    elif op == 'c.j':
-        imm = args[0]
-        sim.pc += imm # jump
+    return exec_c_imm
+
+def exec_c_j(sim, inst):
+    imm = inst.args[0]
+    sim.pc += imm # jump
+    if sim.trace:
         sim.update_pipe(imm=imm, jump=True, branch_taken=True)
-        return 
-        
-    elif op == 'c.jal':
-        imm = args[0]
-        next_inst = sim.pc + 2
-        sim.write_reg(1, next_inst) 
-        sim.pc = (sim.pc + imm) & 0xFFFFFFFF # jump from current PC?
-        # Warning: if sim.pc was not updated blindly, this is correct.
+
+def exec_c_jal(sim, inst):
+    imm = inst.args[0]
+    next_inst = sim.pc + 2
+    sim.write_reg(1, next_inst)
+    sim.pc = (sim.pc + imm) & 0xFFFFFFFF
+    if sim.trace:
         sim.update_pipe(rd=1, imm=imm, jump=True, branch_taken=True)
-        return
-        
-    elif op == 'c.jr':
-        rs1 = args[0]
-        target = sim.x[rs1]
-        sim.pc = target & ~1
+
+def exec_c_jr(sim, inst):
+    rs1 = inst.args[0]
+    sim.pc = sim.x[rs1] & ~1
+    if sim.trace:
         sim.update_pipe(rs1=rs1, jump=True, branch_taken=True)
-        return
-        
-    elif op == 'c.jalr':
-        rs1 = args[0]
-        next_inst = sim.pc + 2
-        target = sim.x[rs1]
-        sim.write_reg(1, next_inst)
-        sim.pc = target & ~1
+
+def exec_c_jalr(sim, inst):
+    rs1 = inst.args[0]
+    next_inst = sim.pc + 2
+    target = sim.x[rs1]
+    sim.write_reg(1, next_inst)
+    sim.pc = target & ~1
+    if sim.trace:
         sim.update_pipe(rd=1, rs1=rs1, jump=True, branch_taken=True)
-        return
-        
-    elif op == 'c.lwsp':
-        rd, imm = args
-        addr = (sim.x[2] + imm) & 0xFFFFFFFF 
-        val = sim.memory.read(addr, 4)
-        sim.write_reg(rd, val)
+
+def exec_c_lwsp(sim, inst):
+    rd, imm = inst.args
+    addr = (sim.x[2] + imm) & 0xFFFFFFFF
+    val = sim.memory.read_word(addr)
+    sim.write_reg(rd, val)
+    if sim.trace:
         sim.update_pipe(rd=rd, rs1=2, imm=imm, alu_out=addr, mem_out=val, mem_read=True)
-        sim.pc += 2
-        
-    elif op == 'c.swsp':
-        rs2, imm = args
-        addr = (sim.x[2] + imm) & 0xFFFFFFFF
-        val = sim.x[rs2]
-        sim.memory.write(addr, val, 4)
+    sim.pc += 2
+
+def exec_c_swsp(sim, inst):
+    rs2, imm = inst.args
+    addr = (sim.x[2] + imm) & 0xFFFFFFFF
+    sim.memory.write_word(addr, sim.x[rs2])
+    if sim.trace:
         sim.update_pipe(rs1=2, rs2=rs2, imm=imm, alu_out=addr, mem_write=True)
-        sim.pc += 2 
+    sim.pc += 2
 
-    elif op == 'c.beqz':
-        rs1, imm = args
-        v1 = sim.x[rs1]
-        take = (v1 == 0)
+def exec_c_beqz(sim, inst):
+    rs1, imm = inst.args
+    take = (sim.x[rs1] == 0)
+    if sim.trace:
         sim.update_pipe(rs1=rs1, imm=imm, branch=True, branch_taken=take)
-        if take: sim.pc += imm
-        else: sim.pc += 2
-        return
-
-    elif op == 'c.bnez':
-        rs1, imm = args
-        v1 = sim.x[rs1]
-        take = (v1 != 0)
+    if take: sim.pc += imm
+    else: sim.pc += 2
+
+def exec_c_bnez(sim, inst):
+    rs1, imm = inst.args
+    take = (sim.x[rs1] != 0)
+    if sim.trace:
         sim.update_pipe(rs1=rs1, imm=imm, branch=True, branch_taken=take)
-        if take: sim.pc += imm
-        else: sim.pc += 2
-        return
+    if take: sim.pc += imm
+    else: sim.pc += 2
+
+C_EXECUTORS = {
+    'c.nop': exec_c_nop, 'c.addi': exec_c_addi, 'c.mv': exec_c_mv,
+    'c.li': exec_c_li, 'c.lui': exec_c_lui,
+    'c.j': exec_c_j, 'c.jal': exec_c_jal, 'c.jr': exec_c_jr, 'c.jalr': exec_c_jalr,
+    'c.lwsp': exec_c_lwsp, 'c.swsp': exec_c_swsp,
+    'c.beqz': exec_c_beqz, 'c.bnez': exec_c_bnez,
+}
@@ -1,6 +1,6 @@
-
 import struct
 import math
+from .rv32i import to_signed
 
 def to_float(v):
     return struct.unpack('f', struct.pack('I', v & 0xFFFFFFFF))[0]
@@ -9,122 +9,114 @@ def from_float(f):
     return struct.unpack('I', struct.pack('f', f))[0]
 
 def exec_flw(sim, inst):
-    rd, imm, rs1 = inst['args']
+    rd, imm, rs1 = inst.args
     addr = (sim.x[rs1] + imm) & 0xFFFFFFFF
-    val = sim.memory.read(addr, 4) 
+    val = sim.memory.read_word(addr)
     sim.write_freg(rd, val)
-    sim.update_pipe(rd=rd, rs1=rs1, imm=imm, alu_out=addr, mem_out=val, mem_read=True, mem_to_reg='mem')
+    if sim.trace:
+        sim.update_pipe(rd=rd, rs1=rs1, imm=imm, alu_out=addr, mem_out=val, mem_read=True, mem_to_reg='mem')
     sim.pc += 4
 
 def exec_fsw(sim, inst):
-    rs2, imm, rs1 = inst['args']
+    rs2, imm, rs1 = inst.args
     addr = (sim.x[rs1] + imm) & 0xFFFFFFFF
-    val = sim.f[rs2] 
-    sim.memory.write(addr, val, 4)
+    val = sim.f[rs2]
+    sim.memory.write_word(addr, val)
     sim.reservation = None
-    sim.update_pipe(rs1=rs1, rs2=rs2, imm=imm, alu_out=addr, mem_write=True)
+    if sim.trace:
+        sim.update_pipe(rs1=rs1, rs2=rs2, imm=imm, alu_out=addr, mem_write=True)
     sim.pc += 4
 
-def exec_f_arith(sim, inst):
-    rd, rs1, rs2 = inst['args']
-    v1_bits = sim.f[rs1]
-    v2_bits = sim.f[rs2]
-    
-    f1 = to_float(v1_bits)
-    f2 = to_float(v2_bits)
-    op = inst['op']
-    res_f = 0.0
-    res_bits = 0
-    
-    if op == 'fadd.s': res_f = f1 + f2
-    elif op == 'fsub.s': res_f = f1 - f2
-    elif op == 'fmul.s': res_f = f1 * f2
-    elif op == 'fdiv.s': res_f = f1 / f2 if f2 != 0 else float('inf') 
-    elif op == 'fsgnj.s':
-        s = v2_bits & 0x80000000
-        res_bits = (v1_bits & 0x7FFFFFFF) | s
-        sim.write_freg(rd, res_bits)
-        sim.update_pipe(rd=rd, rs1=rs1, rs2=rs2, alu_out=res_bits)
-        sim.pc += 4
-        return
-    elif op == 'fsgnjn.s':
-        s = ~(v2_bits) & 0x80000000
-        res_bits = (v1_bits & 0x7FFFFFFF) | s
+# Arithmetic on decoded floats
+F_ARITH_OPS = {
+    'fadd.s': lambda a, b: a + b,
+    'fsub.s': lambda a, b: a - b,
+    'fmul.s': lambda a, b: a * b,
+    'fdiv.s': lambda a, b: a / b if b != 0 else float('inf'),
+    'fmin.s': min,
+    'fmax.s': max,
+}
+
+# Sign injection works on the raw bits
+F_SGNJ_OPS = {
+    'fsgnj.s': lambda a, b: (a & 0x7FFFFFFF) | (b & 0x80000000),
+    'fsgnjn.s': lambda a, b: (a & 0x7FFFFFFF) | (~b & 0x80000000),
+    'fsgnjx.s': lambda a, b: (a & 0x7FFFFFFF) | ((a ^ b) & 0x80000000),
+}
+
+F_CMP_OPS = {
+    'feq.s': lambda a, b: 1 if a == b else 0,
+    'flt.s': lambda a, b: 1 if a < b else 0,
+    'fle.s': lambda a, b: 1 if a <= b else 0,
+}
+
+# op: (function of the source bits, source is f-reg, dest is f-reg)
+F_CONV_OPS = {
+    'fcvt.w.s': (lambda v: int(to_float(v)) & 0xFFFFFFFF, True, False),
+    'fcvt.wu.s': (lambda v: int(to_float(v)) & 0xFFFFFFFF, True, False),
+    'fcvt.s.w': (lambda v: from_float(float(to_signed(v))), False, True),
+    'fcvt.s.wu': (lambda v: from_float(float(v)), False, True),
+    'fmv.x.w': (lambda v: v, True, False),
+    'fmv.w.x': (lambda v: v, False, True),
+}
+
+def make_f_arith(op):
+    if op in F_SGNJ_OPS:
+        sgnj = F_SGNJ_OPS[op]
+
+        def exec_f_sgnj(sim, inst):
+            rd, rs1, rs2 = inst.args
+            res_bits = sgnj(sim.f[rs1], sim.f[rs2])
+            sim.write_freg(rd, res_bits)
+            if sim.trace:
+                sim.update_pipe(rd=rd, rs1=rs1, rs2=rs2, alu_out=res_bits)
+            sim.pc += 4
+        return exec_f_sgnj
+
+    alu = F_ARITH_OPS[op]
+
+    def exec_f_arith(sim, inst):
+        rd, rs1, rs2 = inst.args
+        res_bits = from_float(alu(to_float(sim.f[rs1]), to_float(sim.f[rs2])))
         sim.write_freg(rd, res_bits)
-        sim.update_pipe(rd=rd, rs1=rs1, rs2=rs2, alu_out=res_bits)
+        if sim.trace:
+            sim.update_pipe(rd=rd, rs1=rs1, rs2=rs2, alu_out=res_bits)
         sim.pc += 4
-        return
-    elif op == 'fsgnjx.s':
-        s = (v1_bits ^ v2_bits) & 0x80000000
-        res_bits = (v1_bits & 0x7FFFFFFF) | s
-        sim.write_freg(rd, res_bits)
-        sim.update_pipe(rd=rd, rs1=rs1, rs2=rs2, alu_out=res_bits)
+    return exec_f_arith
+
+def make_f_conv(op):
+    conv, src_f, dst_f = F_CONV_OPS[op]
+
+    def exec_f_conv(sim, inst):
+        rd, rs1 = inst.args[:2]
+        res = conv(sim.f[rs1] if src_f else sim.x[rs1])
+        if dst_f:
+            sim.write_freg(rd, res)
+        else:
+            sim.write_reg(rd, res)
+        if sim.trace:
+            sim.update_pipe(rd=rd, rs1=rs1, alu_out=res)
         sim.pc += 4
-        return
-    elif op == 'fmin.s': res_f = min(f1, f2)
-    elif op == 'fmax.s': res_f = max(f1, f2)
-    # else logic?
+    return exec_f_conv
 
-    res_bits = from_float(res_f)
-    sim.write_freg(rd, res_bits)
-    sim.update_pipe(rd=rd, rs1=rs1, rs2=rs2, alu_out=res_bits)
-    sim.pc += 4
+def make_f_cmp(op):
+    cmp = F_CMP_OPS[op]
 
-def exec_f_conv(sim, inst):
-    rd, rs1 = inst['args'][:2] 
-    op = inst['op']
-    
-    if op == 'fcvt.w.s': # F -> X
-        f1 = to_float(sim.f[rs1])
-        res = int(f1) & 0xFFFFFFFF
-        sim.write_reg(rd, res)
-        sim.update_pipe(rd=rd, rs1=rs1, alu_out=res)
-    elif op == 'fcvt.wu.s': # F -> X unsigned
-        f1 = to_float(sim.f[rs1])
-        res = int(f1) & 0xFFFFFFFF
-        sim.write_reg(rd, res)
-        sim.update_pipe(rd=rd, rs1=rs1, alu_out=res)
-    elif op == 'fcvt.s.w': # X -> F
-        v1 = struct.unpack('i', struct.pack('I', sim.x[rs1]))[0]
-        res_bits = from_float(float(v1))
-        sim.write_freg(rd, res_bits)
-        sim.update_pipe(rd=rd, rs1=rs1, alu_out=res_bits)
-    elif op == 'fcvt.s.wu': # X (unsigned) -> F
-        v1 = sim.x[rs1]
-        res_bits = from_float(float(v1))
-        sim.write_freg(rd, res_bits)
-        sim.update_pipe(rd=rd, rs1=rs1, alu_out=res_bits)
-    elif op == 'fmv.x.w': # F -> X bits
-        res = sim.f[rs1]
+    def exec_f_cmp(sim, inst):
+        rd, rs1, rs2 = inst.args
+        res = cmp(to_float(sim.f[rs1]), to_float(sim.f[rs2]))
         sim.write_reg(rd, res)
-        sim.update_pipe(rd=rd, rs1=rs1, alu_out=res)
-    elif op == 'fmv.w.x': # X -> F bits
-        res = sim.x[rs1]
-        sim.write_freg(rd, res)
-        sim.update_pipe(rd=rd, rs1=rs1, alu_out=res)
-    
-    sim.pc += 4
-
-def exec_f_cmp(sim, inst):
-    rd, rs1, rs2 = inst['args']
-    f1 = to_float(sim.f[rs1])
-    f2 = to_float(sim.f[rs2])
-    op = inst['op']
-    res = 0
-    
-    if op == 'feq.s': res = 1 if f1 == f2 else 0
-    elif op == 'flt.s': res = 1 if f1 < f2 else 0
-    elif op == 'fle.s': res = 1 if f1 <= f2 else 0
-    
-    sim.write_reg(rd, res)
-    sim.update_pipe(rd=rd, rs1=rs1, rs2=rs2, alu_out=res)
-    sim.pc += 4
+        if sim.trace:
+            sim.update_pipe(rd=rd, rs1=rs1, rs2=rs2, alu_out=res)
+        sim.pc += 4
+    return exec_f_cmp
 
 def exec_sqrt(sim, inst):
-    rd, rs1 = inst['args'][:2]
+    rd, rs1 = inst.args[:2]
     f1 = to_float(sim.f[rs1])
     res_f = math.sqrt(f1) if f1 >= 0 else float('nan')
     res_bits = from_float(res_f)
     sim.write_freg(rd, res_bits)
-    sim.update_pipe(rd=rd, rs1=rs1, alu_out=res_bits)
+    if sim.trace:
+        sim.update_pipe(rd=rd, rs1=rs1, alu_out=res_bits)
     sim.pc += 4
@@ -1,132 +1,155 @@
+import operator
 
-import struct
-
-def exec_r_type(sim, inst):
-    rd, rs1, rs2 = inst['args']
-    v1 = sim.x[rs1]
-    v2 = sim.x[rs2]
-    op = inst['op']
-    res = 0
-    
-    if op == 'add': res = v1 + v2
-    elif op == 'sub': res = v1 - v2
-    elif op == 'and': res = v1 & v2
-    elif op == 'or': res = v1 | v2
-    elif op == 'xor': res = v1 ^ v2
-    elif op == 'sll': res = v1 << (v2 & 0x1F)
-    elif op == 'srl': res = (v1 & 0xFFFFFFFF) >> (v2 & 0x1F)
-    elif op == 'sra': 
-        val_s = struct.unpack('i', struct.pack('I', v1 & 0xFFFFFFFF))[0]
-        res = val_s >> (v2 & 0x1F)
-    elif op == 'slt': res = 1 if (struct.unpack('i', struct.pack('I', v1 & 0xFFFFFFFF))[0] < struct.unpack('i', struct.pack('I', v2 & 0xFFFFFFFF))[0]) else 0
-    elif op == 'sltu': res = 1 if (v1 & 0xFFFFFFFF) < (v2 & 0xFFFFFFFF) else 0
-
-    sim.write_reg(rd, res)
-    sim.update_pipe(rd=rd, rs1=rs1, rs2=rs2, alu_out=res, alu_src_b='reg')
-    sim.pc += 4
+def to_signed(v):
+    v &= 0xFFFFFFFF
+    return v - 0x100000000 if v & 0x80000000 else v
 
-def exec_i_type(sim, inst):
-    rd, rs1, imm = inst['args']
-    v1 = sim.x[rs1]
-    op = inst['op']
-    res = 0
-    
-    if op == 'addi': res = v1 + imm
-    elif op == 'andi': res = v1 & imm
-    elif op == 'ori': res = v1 | imm
-    elif op == 'xori': res = v1 ^ imm
-    elif op == 'slli': res = v1 << (imm & 0x1F)
-    elif op == 'srli': res = (v1 & 0xFFFFFFFF) >> (imm & 0x1F)
-    elif op == 'srai':
-        val_s = struct.unpack('i', struct.pack('I', v1 & 0xFFFFFFFF))[0]
-        res = val_s >> (imm & 0x1F)
-    elif op == 'slti': res = 1 if (struct.unpack('i', struct.pack('I', v1 & 0xFFFFFFFF))[0] < imm) else 0
-    elif op == 'sltiu': res = 1 if (v1 & 0xFFFFFFFF) < (imm & 0xFFFFFFFF) else 0
-
-    sim.write_reg(rd, res)
-    sim.update_pipe(rd=rd, rs1=rs1, imm=imm, alu_out=res, alu_src_b='imm')
-    sim.pc += 4
+# Register values are kept masked to 32 bits by write_reg, so the unsigned
+# forms can use the raw values directly.
+R_OPS = {
+    'add': operator.add,
+    'sub': operator.sub,
+    'and': operator.and_,
+    'or': operator.or_,
+    'xor': operator.xor,
+    'sll': lambda a, b: a << (b & 0x1F),
+    'srl': lambda a, b: a >> (b & 0x1F),
+    'sra': lambda a, b: to_signed(a) >> (b & 0x1F),
+    'slt': lambda a, b: 1 if to_signed(a) < to_signed(b) else 0,
+    'sltu': lambda a, b: 1 if a < b else 0,
+}
 
-def exec_load(sim, inst):
-    rd, imm, rs1 = inst['args']
-    addr = (sim.x[rs1] + imm) & 0xFFFFFFFF
-    op = inst['op']
-    
-    signed = op in ['lb', 'lh', 'lw']
-    size = 4 if 'w' in op else (2 if 'h' in op else 1)
-    
-    val = sim.memory.read(addr, size, signed)
-    sim.write_reg(rd, val)
-    sim.update_pipe(rd=rd, rs1=rs1, imm=imm, alu_out=addr, mem_out=val, mem_read=True, mem_to_reg='mem', alu_src_b='imm')
-    sim.pc += 4
+# Immediates are sign-extended Python ints
+I_OPS = {
+    'addi': operator.add,
+    'andi': operator.and_,
+    'ori': operator.or_,
+    'xori': operator.xor,
+    'slli': lambda a, imm: a << (imm & 0x1F),
+    'srli': lambda a, imm: a >> (imm & 0x1F),
+    'srai': lambda a, imm: to_signed(a) >> (imm & 0x1F),
+    'slti': lambda a, imm: 1 if to_signed(a) < imm else 0,
+    'sltiu': lambda a, imm: 1 if a < (imm & 0xFFFFFFFF) else 0,
+}
 
-def exec_store(sim, inst):
-    rs2, imm, rs1 = inst['args']
-    addr = (sim.x[rs1] + imm) & 0xFFFFFFFF
-    val = sim.x[rs2]
-    size = 4 if 'w' in inst['op'] else (2 if 'h' in inst['op'] else 1)
-    
-    sim.memory.write(addr, val, size)
-    sim.reservation = None
-    
-    sim.update_pipe(rs1=rs1, rs2=rs2, imm=imm, alu_out=addr, mem_write=True, alu_src_b='imm')
-    sim.pc += 4
+LOAD_OPS = {
+    # op: (size, signed)
+    'lb': (1, True), 'lh': (2, True), 'lw': (4, True),
+    'lbu': (1, False), 'lhu': (2, False),
+}
 
-def exec_branch(sim, inst):
-    rs1, rs2, imm = inst['args']
-    v1 = sim.x[rs1]
-    v2 = sim.x[rs2]
-    op = inst['op']
-    take = False
-    
-    s1 = struct.unpack('i', struct.pack('I', v1 & 0xFFFFFFFF))[0]
-    s2 = struct.unpack('i', struct.pack('I', v2 & 0xFFFFFFFF))[0]
-    
-    if op == 'beq': take = (v1 == v2)
-    elif op == 'bne': take = (v1 != v2)
-    elif op == 'blt': take = (s1 < s2)
-    elif op == 'bge': take = (s1 >= s2)
-    elif op == 'bltu': take = (v1 < v2)
-    elif op == 'bgeu': take = (v1 >= v2)
-
-    sim.update_pipe(rs1=rs1, rs2=rs2, imm=imm, branch=True, branch_taken=take)
-    if take:
-        sim.pc += imm
-    else:
+STORE_OPS = {'sb': 1, 'sh': 2, 'sw': 4}
+
+BRANCH_OPS = {
+    'beq': operator.eq,
+    'bne': operator.ne,
+    'blt': lambda a, b: to_signed(a) < to_signed(b),
+    'bge': lambda a, b: to_signed(a) >= to_signed(b),
+    'bltu': operator.lt,
+    'bgeu': operator.ge,
+}
+
+def make_r_type(op):
+    alu = R_OPS[op]
+
+    def exec_r_type(sim, inst):
+        rd, rs1, rs2 = inst.args
+        res = alu(sim.x[rs1], sim.x[rs2])
+        sim.write_reg(rd, res)
+        if sim.trace:
+            sim.update_pipe(rd=rd, rs1=rs1, rs2=rs2, alu_out=res, alu_src_b='reg')
         sim.pc += 4
+    return exec_r_type
+
+def make_i_type(op):
+    alu = I_OPS[op]
+
+    def exec_i_type(sim, inst):
+        rd, rs1, imm = inst.args
+        res = alu(sim.x[rs1], imm)
+        sim.write_reg(rd, res)
+        if sim.trace:
+            sim.update_pipe(rd=rd, rs1=rs1, imm=imm, alu_out=res, alu_src_b='imm')
+        sim.pc += 4
+    return exec_i_type
+
+def make_load(op):
+    size, signed = LOAD_OPS[op]
+
+    def exec_load(sim, inst):
+        rd, imm, rs1 = inst.args
+        addr = (sim.x[rs1] + imm) & 0xFFFFFFFF
+        val = sim.memory.read(addr, size, signed)
+        sim.write_reg(rd, val)
+        if sim.trace:
+            sim.update_pipe(rd=rd, rs1=rs1, imm=imm, alu_out=addr, mem_out=val, mem_read=True, mem_to_reg='mem', alu_src_b='imm')
+        sim.pc += 4
+    return exec_load
+
+def make_store(op):
+    size = STORE_OPS[op]
+
+    def exec_store(sim, inst):
+        rs2, imm, rs1 = inst.args
+        addr = (sim.x[rs1] + imm) & 0xFFFFFFFF
+        sim.memory.write(addr, sim.x[rs2], size)
+        sim.reservation = None
+        if sim.trace:
+            sim.update_pipe(rs1=rs1, rs2=rs2, imm=imm, alu_out=addr, mem_write=True, alu_src_b='imm')
+        sim.pc += 4
+    return exec_store
+
+def make_branch(op):
+    cond = BRANCH_OPS[op]
+
+    def exec_branch(sim, inst):
+        rs1, rs2, imm = inst.args
+        take = cond(sim.x[rs1], sim.x[rs2])
+        if sim.trace:
+            sim.update_pipe(rs1=rs1, rs2=rs2, imm=imm, branch=True, branch_taken=take)
+        if take:
+            sim.pc += imm
+        else:
+            sim.pc += 4
+    return exec_branch
 
 def exec_jal(sim, inst):
-    rd, imm = inst['args']
+    rd, imm = inst.args
     next_inst = sim.pc + 4
     sim.write_reg(rd, next_inst)
-    sim.update_pipe(rd=rd, imm=imm, jump=True, branch_taken=True)
+    if sim.trace:
+        sim.update_pipe(rd=rd, imm=imm, jump=True, branch_taken=True)
     sim.pc += imm # jal offset is from current PC
 
 def exec_jalr(sim, inst):
-    rd, rs1, imm = inst['args']
+    rd, rs1, imm = inst.args
     next_inst = sim.pc + 4
     target = (sim.x[rs1] + imm) & ~1
     sim.write_reg(rd, next_inst)
-    sim.update_pipe(rd=rd, rs1=rs1, imm=imm, jump=True, branch_taken=True)
+    if sim.trace:
+        sim.update_pipe(rd=rd, rs1=rs1, imm=imm, jump=True, branch_taken=True)
     sim.pc = target
 
 def exec_lui(sim, inst):
-    rd, imm = inst['args']
+    rd, imm = inst.args
     val = (imm << 12) & 0xFFFFFFFF
     sim.write_reg(rd, val)
-    sim.update_pipe(rd=rd, imm=imm, alu_out=val, alu_src_a='x', alu_src_b='imm')
+    if sim.trace:
+        sim.update_pipe(rd=rd, imm=imm, alu_out=val, alu_src_a='x', alu_src_b='imm')
     sim.pc += 4
 
 def exec_auipc(sim, inst):
-    rd, imm = inst['args']
-    val = (sim.pc + imm) & 0xFFFFFFFF
+    rd, imm = inst.args
+    val = (sim.pc + (imm << 12)) & 0xFFFFFFFF
     sim.write_reg(rd, val)
-    sim.update_pipe(rd=rd, imm=imm, alu_out=val, alu_src_a='pc', alu_src_b='imm')
+    if sim.trace:
+        sim.update_pipe(rd=rd, imm=imm, alu_out=val, alu_src_a='pc', alu_src_b='imm')
     sim.pc += 4
-    
+
 def exec_ecall(sim, inst):
     syscall = sim.x[17]
     if syscall == 93: # exit
+        sim.exit_code = to_signed(sim.x[10])
         sim.pc = 0xFFFFFFFF # Trap to end
     elif syscall == 1: # print char
         print(chr(sim.x[10] & 0xFF), end='')
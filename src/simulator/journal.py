@@ -0,0 +1,174 @@
+from collections import deque
+from .pipeline import register_usage
+from .cache import data_access
+
+# Undo journal for reverse execution. Every instruction retired by step()
+# leaves one entry with what it is about to overwrite: the PC, the old
+# value of its destination register, the old bytes of a store target and
+# the LR reservation / exit code. Entries live in a bounded ring.
+#
+# Runs through compiled blocks are not journaled; instead a checkpoint is
+# taken every checkpoint_interval instructions. A checkpoint shares the
+# page copies of the one before for pages nobody wrote since, so only
+# dirty pages are copied. Going further back than the ring reaches means
+# restoring the nearest earlier checkpoint and replaying from there.
+
+DEFAULT_SIZE = 10000
+DEFAULT_CHECKPOINT_INTERVAL = 10000
+DEFAULT_MAX_CHECKPOINTS = 32
+RING_ENTRY_BYTES = 300 # rough size of one undo entry tuple and its ints
+
+class Checkpoint:
+    __slots__ = ('instret', 'pc', 'x', 'f', 'csrs', 'reservation', 'exit_code', 'pages', 'epoch')
+
+    def __init__(self, sim, previous):
+        memory = sim.memory
+        self.instret = sim.instret
+        self.pc = sim.pc
+        self.x = sim.x[:]
+        self.f = sim.f[:]
+        self.csrs = dict(sim.csrs.csrs)
+        self.reservation = sim.reservation
+        self.exit_code = sim.exit_code
+        # Writes from here on are tagged with a later epoch than ours
+        self.epoch = memory.epoch
+        memory.epoch += 1
+        old = previous.pages if previous is not None else {}
+        since = previous.epoch if previous is not None else -1
+        versions = memory.page_versions
+        self.pages = {}
+        for base, page in memory.pages.items():
+            kept = old.get(base)
+            if kept is None or versions.get(base, 0) > since:
+                kept = bytes(page)
+            self.pages[base] = kept
+
+    def restore(self, sim):
+        memory = sim.memory
+        for base, page in memory.pages.items():
+            saved = self.pages.get(base)
+            if saved is None:
+                if any(page):
+                    memory.load(base, bytes(len(page)))
+            elif page != saved:
+                memory.load(base, saved)
+        for base, saved in self.pages.items():
+            if base not in memory.pages:
+                memory.load(base, saved)
+        sim.pc = self.pc
+        sim.x = self.x[:]
+        sim.f = self.f[:]
+        sim.csrs.csrs = dict(self.csrs)
+        sim.reservation = self.reservation
+        sim.exit_code = self.exit_code
+        sim.instret = self.instret
+
+class Journal:
+    def __init__(self, size=DEFAULT_SIZE, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+                 max_checkpoints=DEFAULT_MAX_CHECKPOINTS):
+        if size < 0 or checkpoint_interval <= 0 or max_checkpoints < 2:
+            raise ValueError("Journal needs size >= 0, checkpoint_interval > 0 and max_checkpoints >= 2")
+        self.size = size
+        self.checkpoint_interval = checkpoint_interval
+        self.max_checkpoints = max_checkpoints
+        self.usage = {} # Instruction -> (destination register, store access)
+        self.reset()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['usage'] = {}
+        return state
+
+    def reset(self):
+        self.ring = deque(maxlen=self.size)
+        self.ring_end = None # instret the newest entry leads to
+        self.checkpoints = [] # by instret
+
+    def memory_bytes(self):
+        # Estimate: each page copy once however many checkpoints share it,
+        # plus the undo ring
+        copies = {id(page): len(page) for cp in self.checkpoints for page in cp.pages.values()}
+        return sum(copies.values()) + len(self.ring) * RING_ENTRY_BYTES
+
+    def undoable(self, sim):
+        # Steps step_back() can undo straight from the ring
+        return len(self.ring) if self.ring_end == sim.instret else 0
+
+    def before(self, sim, inst):
+        # Entry for inst, taken before it executes
+        usage = self.usage.get(inst)
+        if usage is None:
+            dst = register_usage(inst.op, inst.args)[0]
+            access = data_access(inst.op, inst.args)
+            usage = self.usage[inst] = (dst, access if access is not None and access[0] else None)
+        dst, store = usage
+        old = None
+        if dst is not None:
+            old = sim.x[dst] if dst < 32 else sim.f[dst - 32]
+        addr = old_bytes = size = None
+        if store is not None:
+            _, size, base, offset = store
+            addr = (sim.x[base] + offset) & 0xFFFFFFFF
+            old_bytes = sim.memory.peek(addr, size)
+        return (sim.pc, dst, old, addr, size, old_bytes, sim.reservation, sim.exit_code)
+
+    def push(self, sim, entry):
+        # After the instruction retired
+        if self.ring_end != sim.instret - 1:
+            self.ring.clear()
+        self.ring.append(entry)
+        self.ring_end = sim.instret
+        self.checkpoint_if_due(sim)
+
+    def undo(self, sim):
+        pc, dst, old, addr, size, old_bytes, reservation, exit_code = self.ring.pop()
+        if addr is not None:
+            sim.memory.poke(addr, old_bytes, size)
+        if dst is not None:
+            if dst < 32:
+                sim.x[dst] = old
+            else:
+                sim.f[dst - 32] = old
+        sim.pc = pc
+        sim.reservation = reservation
+        sim.exit_code = exit_code
+        sim.instret -= 1
+        self.ring_end = sim.instret
+
+    def until_checkpoint(self, sim):
+        # Instructions left before the next checkpoint is due
+        if not self.checkpoints:
+            return 0
+        return max(0, self.checkpoints[-1].instret + self.checkpoint_interval - sim.instret)
+
+    def checkpoint_if_due(self, sim):
+        if self.until_checkpoint(sim) == 0:
+            self.checkpoint(sim)
+
+    def checkpoint(self, sim):
+        cps = self.checkpoints
+        while cps and cps[-1].instret >= sim.instret:
+            cps.pop()
+        cps.append(Checkpoint(sim, cps[-1] if cps else None))
+        if len(cps) > self.max_checkpoints:
+            # Thin out: keep the first and last, every other one in between,
+            # so older history is covered at a coarser spacing
+            self.checkpoints = [cps[0]] + cps[2:-1:2] + [cps[-1]]
+
+    def nearest(self, step):
+        # Latest checkpoint at or before step (else the earliest one)
+        best = None
+        for cp in self.checkpoints:
+            if cp.instret <= step or best is None:
+                best = cp
+            if cp.instret > step:
+                break
+        return best
+
+    def rewind(self, sim, cp):
+        # Back to checkpoint cp; later checkpoints and the ring no longer
+        # describe where execution goes from here
+        cp.restore(sim)
+        self.checkpoints = [c for c in self.checkpoints if c.instret <= cp.instret]
+        self.ring.clear()
+        self.ring_end = sim.instret
@@ -1,48 +1,365 @@
+import struct
+
+PAGE_SIZE = 4096
+ZERO_PAGE = bytes(PAGE_SIZE)
+
+# (size, signed) -> unpack_from, size -> pack_into; little-endian and
+# without alignment requirements
+_UNPACK = {
+    (1, False): struct.Struct('<B').unpack_from,
+    (2, False): struct.Struct('<H').unpack_from,
+    (4, False): struct.Struct('<I').unpack_from,
+    (1, True): struct.Struct('<b').unpack_from,
+    (2, True): struct.Struct('<h').unpack_from,
+    (4, True): struct.Struct('<i').unpack_from,
+}
+_PACK = {
+    1: struct.Struct('<B').pack_into,
+    2: struct.Struct('<H').pack_into,
+    4: struct.Struct('<I').pack_into,
+}
+_MASK = {1: 0xFF, 2: 0xFFFF, 4: 0xFFFFFFFF}
+_unpack_word = _UNPACK[4, False]
+_pack_word = _PACK[4]
+
+# Access methods replaced on an instance that has watchpoints
+WATCHED_METHODS = ('read', 'write', 'read_word', 'write_word')
+
 class Memory:
-    def __init__(self):
-        self.pages = {} # page_base -> bytearray(4096)
+    def __init__(self, ram=None):
+        # page_base -> bytearray(4096), or a writable memoryview of the same
+        # size for pages mapped straight from a file (see map_page) or
+        # carved out of the flat RAM region
+        self.pages = {}
+        self.mappings = [] # buffers backing mapped pages, kept alive here
+        # One-entry page cache: most accesses hit the page of the previous one
+        self._last_base = -1
+        self._last_page = None
+        # Optional flat region (base, size), page aligned. Its pages are views
+        # of one contiguous buffer, allocated up front, and accesses that
+        # cross a page boundary inside it are a single struct call.
+        self.ram = None
+        self.ram_base = self.ram_end = 0
+        if ram is not None:
+            base, size = ram
+            if base & 0xFFF or size & 0xFFF:
+                raise ValueError("RAM region must be page aligned")
+            self.ram = bytearray(size)
+            self.ram_base = base
+            self.ram_end = base + size
+            view = memoryview(self.ram)
+            for off in range(0, size, PAGE_SIZE):
+                self.pages[base + off] = view[off:off + PAGE_SIZE]
+        # Address range holding the program. Writes into it set code_written
+        # and are logged in code_writes so decoded instructions and compiled
+        # blocks can be dropped.
+        self.code_start = 0
+        self.code_end = 0
+        self.code_written = False
+        self.code_writes = [] # (addr, size)
+        # Dirty tracking for incremental snapshots: every write tags its page
+        # with the current epoch, the simulator bumps the epoch per snapshot.
+        self.epoch = 1
+        self.page_versions = {} # page_base -> epoch of the last write
+        # Watchpoints as (start, end, read, write), indexed by page. While
+        # any is set read/write/read_word/write_word are replaced on the
+        # instance by checking versions; peek/poke never check.
+        self.watchpoints = []
+        self.watch_pages = {}
+        self.watch_hit = None # first access that hit a watchpoint
+        # LR reservations of the harts not currently running, word address
+        # -> [hart]. While any is set write/write_word are replaced on the
+        # instance and a write overlapping the word drops them.
+        self.reserved = {}
+        self.reservations_broken = 0
+        self._bind_access()
+
+    def __getstate__(self):
+        # Views into the RAM buffer or a file mapping cannot be pickled:
+        # mapped pages are copied out and RAM pages rebuilt from the buffer.
+        state = self.__dict__.copy()
+        state['pages'] = {base: page for base, page in self.pages.items()
+                          if not self.ram_base <= base < self.ram_end}
+        for base, page in state['pages'].items():
+            if isinstance(page, memoryview):
+                state['pages'][base] = bytearray(page)
+        state['mappings'] = []
+        state['_last_base'] = -1
+        state['_last_page'] = None
+        for name in WATCHED_METHODS:
+            state.pop(name, None)
+        state['reserved'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.ram is not None:
+            view = memoryview(self.ram)
+            for off in range(0, len(self.ram), PAGE_SIZE):
+                self.pages[self.ram_base + off] = view[off:off + PAGE_SIZE]
+        self.set_watchpoints(self.watchpoints)
+
+    def _bind_access(self):
+        # Instance overrides of the access methods for watchpoints and
+        # reservations, else for the flat RAM region; none when there is
+        # nothing of the sort
+        for name in WATCHED_METHODS:
+            if self.watch_pages:
+                setattr(self, name, getattr(self, '_watched_' + name))
+            elif self.ram is not None:
+                setattr(self, name, getattr(self, '_ram_' + name))
+            else:
+                self.__dict__.pop(name, None)
+        if self.reserved:
+            self.write = self._reserved_write
+            self.write_word = self._reserved_write_word
+
+    def set_watchpoints(self, watchpoints):
+        # watchpoints: list of (start, end, read, write), end exclusive
+        self.watchpoints = watchpoints
+        self.watch_pages = {}
+        for wp in watchpoints:
+            start, end = wp[0], wp[1]
+            for base in range(start & ~0xFFF, end, PAGE_SIZE):
+                self.watch_pages.setdefault(base, []).append(wp)
+        self._bind_access()
+
+    def set_reservations(self, reservations):
+        # reservations: (address, hart) pairs, hart being anything with a
+        # reservation attribute that is reset to None once another hart
+        # writes the reserved word
+        self.reserved = {}
+        for addr, hart in reservations:
+            self.reserved.setdefault(addr, []).append(hart)
+        self._bind_access()
+
+    def _break_reservations(self, addr, size):
+        reserved = self.reserved
+        for r in [r for r in reserved if addr < r + 4 and addr + size > r]:
+            for hart in reserved.pop(r):
+                hart.reservation = None
+                self.reservations_broken += 1
+        if not reserved:
+            self._bind_access()
+
+    def _reserved_write(self, addr, val, size):
+        self._break_reservations(addr, size)
+        if self.watch_pages:
+            self._watched_write(addr, val, size)
+        else:
+            Memory.write(self, addr, val, size)
+
+    def _reserved_write_word(self, addr, val):
+        self._break_reservations(addr, 4)
+        if self.watch_pages:
+            self._watched_write_word(addr, val)
+        else:
+            Memory.write_word(self, addr, val)
+
+    def _check_watch(self, addr, size, write, val):
+        pages = self.watch_pages
+        base = addr & ~0xFFF
+        wps = pages.get(base, [])
+        if (addr + size - 1) & ~0xFFF != base:
+            wps = wps + pages.get(base + PAGE_SIZE, [])
+        for start, end, read, written in wps:
+            if (written if write else read) and addr < end and addr + size > start:
+                if self.watch_hit is None:
+                    self.watch_hit = {'addr': addr, 'size': size, 'value': val,
+                                      'access': 'write' if write else 'read',
+                                      'start': start, 'end': end}
+                return
+
+    def _watched_read(self, addr, size, signed=False):
+        val = Memory.read(self, addr, size, signed)
+        self._check_watch(addr, size, False, val)
+        return val
+
+    def _watched_read_word(self, addr):
+        val = Memory.read_word(self, addr)
+        self._check_watch(addr, 4, False, val)
+        return val
+
+    def _watched_write(self, addr, val, size):
+        self._check_watch(addr, size, True, val & _MASK[size])
+        Memory.write(self, addr, val, size)
+
+    def _watched_write_word(self, addr, val):
+        self._check_watch(addr, 4, True, val & 0xFFFFFFFF)
+        Memory.write_word(self, addr, val)
+
+    # Flat region first: one bounds check and a struct call on the buffer,
+    # everything else through the paged methods
+    def _ram_read(self, addr, size, signed=False):
+        if self.ram_base <= addr and addr + size <= self.ram_end:
+            return _UNPACK[size, signed](self.ram, addr - self.ram_base)[0]
+        return Memory.read(self, addr, size, signed)
+
+    def _ram_read_word(self, addr):
+        if self.ram_base <= addr and addr + 4 <= self.ram_end:
+            return _unpack_word(self.ram, addr - self.ram_base)[0]
+        return Memory.read(self, addr, 4)
+
+    def _ram_write(self, addr, val, size):
+        if self.ram_base <= addr and addr + size <= self.ram_end and \
+                (addr >= self.code_end or addr + size <= self.code_start):
+            _PACK[size](self.ram, addr - self.ram_base, val & _MASK[size])
+            versions = self.page_versions
+            versions[addr & ~0xFFF] = versions[(addr + size - 1) & ~0xFFF] = self.epoch
+            return
+        Memory.write(self, addr, val, size)
+
+    def _ram_write_word(self, addr, val):
+        if self.ram_base <= addr and addr + 4 <= self.ram_end and \
+                (addr >= self.code_end or addr + 4 <= self.code_start):
+            _pack_word(self.ram, addr - self.ram_base, val & 0xFFFFFFFF)
+            versions = self.page_versions
+            versions[addr & ~0xFFF] = versions[(addr + 3) & ~0xFFF] = self.epoch
+            return
+        Memory.write(self, addr, val, 4)
+
+    def set_code_range(self, start, end):
+        self.code_start = start
+        self.code_end = end
+        self.code_written = False
+        self.code_writes = []
 
     def _get_page(self, addr, create=True):
         page_base = addr & ~0xFFF
-        if page_base not in self.pages:
-            if create:
-                self.pages[page_base] = bytearray(4096)
-            else:
+        if page_base == self._last_base:
+            return self._last_page
+        page = self.pages.get(page_base)
+        if page is None:
+            if not create:
                 return None
-        return self.pages[page_base]
+            page = self.pages[page_base] = bytearray(PAGE_SIZE)
+        self._last_base = page_base
+        self._last_page = page
+        return page
 
     def read(self, addr, size, signed=False):
-        page = self._get_page(addr, create=False)
-        offset = addr & 0xFFF
-        
-        if page and offset + size <= 4096:
-            val = int.from_bytes(page[offset:offset+size], 'little', signed=signed)
-        else:
-            # Slow path: page crossing or uninit page
-            val = 0
-            for i in range(size):
-                b = 0
-                p = self._get_page(addr + i, create=False)
-                if p:
-                    b = p[(addr + i) & 0xFFF]
-                val |= (b << (i * 8))
-            
-            if signed:
-                bits = size * 8
-                if val & (1 << (bits - 1)):
-                    val -= 1 << bits
+        base = addr & ~0xFFF
+        offset = addr - base
+        if offset + size <= PAGE_SIZE:
+            if base == self._last_base:
+                return _UNPACK[size, signed](self._last_page, offset)[0]
+            page = self._get_page(addr, create=False)
+            if page is None:
+                return 0 # never written
+            return _UNPACK[size, signed](page, offset)[0]
+        elif self.ram_base <= addr and addr + size <= self.ram_end:
+            return _UNPACK[size, signed](self.ram, addr - self.ram_base)[0]
+        # Slow path: access crossing into another page
+        val = 0
+        for i in range(size):
+            p = self._get_page(addr + i, create=False)
+            if p is not None:
+                val |= p[(addr + i) & 0xFFF] << (i * 8)
+        if signed:
+            bits = size * 8
+            if val & (1 << (bits - 1)):
+                val -= 1 << bits
         return val
 
     def write(self, addr, val, size):
-        page = self._get_page(addr, create=True)
-        offset = addr & 0xFFF
-        # Mask val to size
-        mask = (1 << (size * 8)) - 1
-        val &= mask
-
-        if offset + size <= 4096:
-            page[offset:offset+size] = val.to_bytes(size, 'little')
+        if addr < self.code_end and addr + size > self.code_start:
+            self.code_written = True
+            self.code_writes.append((addr, size))
+
+        val &= _MASK[size]
+        base = addr & ~0xFFF
+        offset = addr - base
+        if offset + size <= PAGE_SIZE:
+            page = self._last_page if base == self._last_base else self._get_page(addr)
+            _PACK[size](page, offset, val)
+            self.page_versions[base] = self.epoch
+        elif self.ram_base <= addr and addr + size <= self.ram_end:
+            # Page crossing inside the flat region is still one copy
+            _PACK[size](self.ram, addr - self.ram_base, val)
+            self.page_versions[base] = self.epoch
+            self.page_versions[base + PAGE_SIZE] = self.epoch
         else:
             for i in range(size):
                 p = self._get_page(addr + i, create=True)
                 p[(addr + i) & 0xFFF] = (val >> (i * 8)) & 0xFF
+                self.page_versions[(addr + i) & ~0xFFF] = self.epoch
+
+    # Unwatched access for the simulator's own reads and writes (decoding,
+    # undo), which must not trigger watchpoints
+    peek = read
+    poke = write
+
+    # Word-sized shortcuts for the hot paths (lw/sw, flw/fsw, atomics)
+    def read_word(self, addr):
+        base = addr & ~0xFFF
+        offset = addr - base
+        if offset <= PAGE_SIZE - 4:
+            if base == self._last_base:
+                return _unpack_word(self._last_page, offset)[0]
+            page = self.pages.get(base)
+            if page is not None:
+                self._last_base = base
+                self._last_page = page
+                return _unpack_word(page, offset)[0]
+        return self.read(addr, 4)
+
+    def write_word(self, addr, val):
+        base = addr & ~0xFFF
+        offset = addr - base
+        if offset <= PAGE_SIZE - 4 and not (addr < self.code_end and addr + 4 > self.code_start):
+            if base == self._last_base:
+                page = self._last_page
+            else:
+                page = self.pages.get(base)
+            if page is not None:
+                self._last_base = base
+                self._last_page = page
+                _pack_word(page, offset, val & 0xFFFFFFFF)
+                self.page_versions[base] = self.epoch
+                return
+        self.write(addr, val, 4)
+
+    def load(self, addr, data):
+        # Bulk copy of a bytes-like object into memory, page by page
+        data = memoryview(data).cast('B')
+        pos = 0
+        end = len(data)
+        while pos < end:
+            a = addr + pos
+            offset = a & 0xFFF
+            n = min(PAGE_SIZE - offset, end - pos)
+            page = self._get_page(a, create=True)
+            page[offset:offset+n] = data[pos:pos+n]
+            self.page_versions[a - offset] = self.epoch
+            pos += n
+        if addr < self.code_end and addr + end > self.code_start:
+            self.code_written = True
+            self.code_writes.append((addr, end))
+
+    def map_page(self, base, buf):
+        # Installs a writable 4 KiB buffer (e.g. a memoryview slice of a
+        # copy-on-write mmap) as the page at base without copying it
+        if base & 0xFFF or len(buf) != PAGE_SIZE:
+            raise ValueError("map_page needs a page-aligned 4 KiB buffer")
+        self.pages[base] = buf
+        self.page_versions[base] = self.epoch
+        if base == self._last_base:
+            self._last_page = buf
+
+    def dirty_pages(self, since):
+        # Pages written after the snapshot taken at epoch `since`
+        return [base for base, v in self.page_versions.items() if v > since]
+
+    def flatten(self, bases=None):
+        # {address: byte} of the non-zero bytes in the given pages (all pages
+        # by default)
+        if bases is None:
+            bases = self.pages.keys()
+        flat = {}
+        for base in bases:
+            page = self.pages.get(base)
+            if page is None or page == ZERO_PAGE:
+                continue
+            for i, b in enumerate(page):
+                if b != 0: flat[base + i] = b
+        return flat
@@ -0,0 +1,237 @@
+from collections import deque
+from .encoding import ENCODING
+
+# Timing model of the classic in-order 5-stage pipeline. It runs beside the
+# functional simulation: step() reports every retired instruction and the
+# model works out the cycle each one enters each stage.
+
+STAGES = ('IF', 'ID', 'EX', 'MEM', 'WB')
+
+# Instructions whose result is only known after MEM
+MEM_RESULT_OPS = {'lb', 'lh', 'lw', 'lbu', 'lhu', 'flw', 'c.lwsp', 'lr.w', 'sc.w'} | \
+    {op for op, e in ENCODING.items() if e[0] == 'AMO'}
+
+# Jumps whose target is known in ID; everything else redirects from EX
+ID_RESOLVED_OPS = {'jal', 'c.j', 'c.jal'}
+
+# Stall causes, in the order a stalled cycle is charged to them
+STALL_CAUSES = ('control', 'load_use', 'data', 'fetch', 'memory', 'execute', 'structural')
+
+F = 32 # float registers are numbered F + n in the hazard tables
+
+# op -> (dst kind, source kinds) by position in inst.args. Kinds:
+# 'x' integer reg, 'f' float reg, None not a register.
+_FORMAT_REGS = {
+    'R': ('x', 'xx'), 'I': ('x', 'x'), 'SH': ('x', 'x'),
+    'L': ('x', ' x'), 'S': (None, 'x x'), 'B': (None, 'xx'),
+    'J': ('x', ''), 'U': ('x', ''), 'LR': ('x', 'x'), 'AMO': ('x', 'xx'),
+    'FR': ('f', 'ff'), 'FR1': ('f', 'f'),
+}
+_OP_REGS = {
+    'flw': ('f', ' x'), 'fsw': (None, 'f x'),
+    'feq.s': ('x', 'ff'), 'flt.s': ('x', 'ff'), 'fle.s': ('x', 'ff'),
+    'fcvt.w.s': ('x', 'f'), 'fcvt.wu.s': ('x', 'f'), 'fmv.x.w': ('x', 'f'),
+    'fcvt.s.w': ('f', 'x'), 'fcvt.s.wu': ('f', 'x'), 'fmv.w.x': ('f', 'x'),
+}
+
+def register_usage(op, args):
+    # (destination, sources) as register numbers; x0 and missing operands
+    # are left out.
+    if op.startswith('c.'):
+        dst, srcs = _compressed_usage(op, args)
+    elif op == 'ecall':
+        dst, srcs = None, (17, 10, 11, 12) # a7 selects the call, a0-a2 arguments
+    else:
+        dst_kind, src_kinds = _OP_REGS.get(op) or _FORMAT_REGS[ENCODING[op][0]]
+        dst = None
+        if dst_kind is not None:
+            dst = _reg(dst_kind, args[0])
+            args = args[1:]
+        srcs = [_reg(kind, arg) for kind, arg in zip(src_kinds, args) if kind != ' ']
+    return dst or None, tuple(r for r in srcs if r)
+
+def _reg(kind, n):
+    return F + n if kind == 'f' else n
+
+def _compressed_usage(op, args):
+    if op in ('c.nop', 'c.j'):
+        return None, ()
+    if op == 'c.jal':
+        return 1, ()
+    if op in ('c.li', 'c.lui'):
+        return args[0], ()
+    if op in ('c.jr', 'c.beqz', 'c.bnez'):
+        return None, (args[0],)
+    if op == 'c.jalr':
+        return 1, (args[0],)
+    if op == 'c.mv':
+        return args[0], (args[1],)
+    if op == 'c.lwsp':
+        return args[0], (2,)
+    if op == 'c.swsp':
+        return None, (args[0], 2)
+    if op in ('c.add', 'c.sub', 'c.and', 'c.or', 'c.xor'):
+        return args[0], (args[0], args[1])
+    return args[0], (args[0],) # c.addi and the shift/andi forms
+
+class PipelineModel:
+    # forwarding: EX/MEM and MEM/WB bypasses. Without them a result can be
+    # read in ID once its producer is in WB (write first, read second half).
+    # latencies: {op: EX cycles} for multi-cycle units, e.g. {'div': 34}.
+    def __init__(self, forwarding=True, latencies=None):
+        self.forwarding = forwarding
+        self.latencies = dict(latencies or {})
+        self.reset()
+
+    def reset(self):
+        self.instructions = 0
+        self.flushes = 0
+        self.load_use = 0
+        self.stalls = dict.fromkeys(STALL_CAUSES, 0)
+        self.usage = {} # Instruction -> (dst, srcs, ex cycles, mem result, resolve stage)
+        self.ready = {} # reg -> earliest EX (forwarding) / ID cycle of a reader
+        self.loads = set() # regs last written by a MEM_RESULT_OPS instruction
+        self.fetch_at = 0 # first cycle the next fetch may start (redirects)
+        self.last = (-1, -1, -1, -1, 3) # stage start cycles of the previous instruction
+        self.history = deque(maxlen=len(STAGES))
+
+    def __getstate__(self):
+        # usage is keyed by decoded instructions (which hold handlers) and
+        # is rebuilt as they run again
+        state = self.__dict__.copy()
+        state['usage'] = {}
+        return state
+
+    @property
+    def cycles(self):
+        return self.last[4] + 1 if self.instructions else 0
+
+    def _usage(self, inst):
+        op = inst.op
+        dst, srcs = register_usage(op, inst.args)
+        info = (dst, srcs, self.latencies.get(op, 1), op in MEM_RESULT_OPS,
+                1 if op in ID_RESOLVED_OPS else 2)
+        self.usage[inst] = info
+        return info
+
+    def record(self, inst, pc, next_pc, fetch_cycles=1, mem_cycles=1, redirect=None):
+        # fetch_cycles / mem_cycles: time spent in IF and MEM (more than one
+        # on a cache miss). redirect: whether the front end fetched the wrong
+        # path; by default any taken branch or jump (predict not-taken).
+        info = self.usage.get(inst)
+        if info is None:
+            info = self._usage(inst)
+        dst, srcs, ex_cycles, mem_result, resolve = info
+        p_if, p_id, p_ex, p_mem, p_wb = self.last
+        ready = self.ready
+        bumps = {}
+
+        base = p_if + 1 if p_if + 1 > p_id else p_id
+        s_if = base
+        if self.fetch_at > base:
+            s_if = self.fetch_at
+            bumps['control'] = s_if - base
+
+        s_id = s_if + fetch_cycles
+        if p_ex > s_id:
+            s_id = p_ex
+        s_ex = s_id + 1
+        if p_mem > s_ex:
+            s_ex = p_mem
+
+        # RAW hazards: wait until every source can be forwarded (or read)
+        need = s_ex if self.forwarding else s_id
+        wait = need
+        cause = None
+        for r in srcs:
+            t = ready.get(r, 0)
+            if t > wait:
+                wait = t
+                cause = 'load_use' if r in self.loads else 'data'
+        if cause is not None:
+            bumps[cause] = wait - need
+            if cause == 'load_use':
+                self.load_use += 1
+            if self.forwarding:
+                s_ex = wait
+            else:
+                s_id = wait
+                if s_id + 1 > s_ex:
+                    s_ex = s_id + 1
+
+        s_mem = s_ex + ex_cycles
+        if p_wb > s_mem:
+            s_mem = p_wb
+        s_wb = s_mem + mem_cycles
+        if s_wb <= p_wb:
+            s_wb = p_wb + 1
+
+        if dst is not None:
+            if self.forwarding:
+                ready[dst] = s_wb if mem_result else s_mem
+            else:
+                ready[dst] = s_wb
+            if mem_result:
+                self.loads.add(dst)
+            else:
+                self.loads.discard(dst)
+
+        if redirect is None:
+            redirect = next_pc != pc + inst.length
+        if redirect:
+            self.flushes += 1
+            self.fetch_at = (s_id + 1) if resolve == 1 else (s_ex + ex_cycles)
+
+        if fetch_cycles > 1:
+            bumps['fetch'] = fetch_cycles - 1
+        if mem_cycles > 1:
+            bumps['memory'] = mem_cycles - 1
+        if ex_cycles > 1:
+            bumps['execute'] = ex_cycles - 1
+
+        # Charge the cycles between this and the previous retirement
+        lost = s_wb - p_wb - 1
+        if lost:
+            stalls = self.stalls
+            for c in STALL_CAUSES:
+                n = bumps.get(c)
+                if n:
+                    n = min(n, lost)
+                    stalls[c] += n
+                    lost -= n
+                    if not lost:
+                        break
+            else:
+                stalls['structural'] += lost
+
+        self.last = (s_if, s_id, s_ex, s_mem, s_wb)
+        self.history.append((pc, inst.machine_code, inst.source, self.last))
+        self.instructions += 1
+
+    def in_flight(self):
+        # What each stage holds in the cycle the newest instruction was
+        # fetched; None is a bubble.
+        now = self.last[0]
+        stages = []
+        for k, name in enumerate(STAGES):
+            slot = {'stage': name, 'pc': None, 'inst': None, 'source': None}
+            for pc, word, source, times in self.history:
+                end = times[k + 1] if k + 1 < len(STAGES) else times[k] + 1
+                if times[k] <= now < end:
+                    slot.update(pc=pc, inst=word, source=source)
+                    break
+            stages.append(slot)
+        return stages
+
+    def report(self):
+        cycles = self.cycles
+        return {
+            'cycles': cycles,
+            'instructions': self.instructions,
+            'cpi': cycles / self.instructions if self.instructions else None,
+            'stall_cycles': sum(self.stalls.values()),
+            'stalls': dict(self.stalls),
+            'flushes': self.flushes,
+            'load_use_hazards': self.load_use,
+            'forwarding': self.forwarding,
+        }
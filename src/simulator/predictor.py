@@ -0,0 +1,144 @@
+from array import array
+from .instructions import BRANCH_OPS
+
+# Branch prediction models. The predictor sees every retired control
+# transfer after it executed, compares what it would have predicted at
+# fetch with the actual outcome and trains on it.
+
+PREDICTORS = ('not_taken', 'btfn', 'bimodal1', 'bimodal2', 'gshare')
+TABLE_PREDICTORS = ('bimodal1', 'bimodal2', 'gshare') # indexed by a pattern table
+
+CONDITIONAL_OPS = set(BRANCH_OPS) | {'c.beqz', 'c.bnez'}
+DIRECT_JUMP_OPS = {'jal', 'c.j', 'c.jal'}
+INDIRECT_JUMP_OPS = {'jalr', 'c.jr', 'c.jalr'}
+
+class PredictorConfigError(Exception):
+    pass
+
+class BranchPredictor:
+    # entries: pattern table size (bimodal/gshare), history_bits: global
+    # history length (gshare), btb_entries: direct-mapped branch target
+    # buffer size.
+    def __init__(self, kind='bimodal2', entries=1024, history_bits=10, btb_entries=64):
+        if kind not in PREDICTORS:
+            raise PredictorConfigError(f"Unknown predictor: {kind}")
+        sizes = [('btb_entries', btb_entries)]
+        if kind in TABLE_PREDICTORS:
+            sizes.append(('entries', entries))
+        for name, n in sizes:
+            if n <= 0 or n & (n - 1):
+                raise PredictorConfigError(f"{name} must be a positive power of two, got {n}")
+        if history_bits < 0:
+            raise PredictorConfigError(f"history_bits must not be negative, got {history_bits}")
+        self.kind = kind
+        self.entries = entries
+        self.history_bits = history_bits
+        self.btb_entries = btb_entries
+        self.reset()
+
+    def reset(self):
+        # 2-bit counters start weakly not-taken, 1-bit ones not-taken
+        self.counters = bytearray([1 if self.kind in ('bimodal2', 'gshare') else 0]) * self.entries
+        self.history = 0
+        self.btb_tags = array('q', [-1]) * self.btb_entries
+        self.btb_targets = array('q', [0]) * self.btb_entries
+        self.predictions = 0
+        self.mispredictions = 0
+        self.btb_hits = 0
+        self.btb_lookups = 0
+        self.branches = {} # pc -> [executed, mispredicted, taken]
+        self.last = None # predicted direction of the last conditional branch
+
+    def _index(self, pc):
+        if self.kind == 'gshare':
+            return ((pc >> 1) ^ self.history) & (self.entries - 1)
+        return (pc >> 1) & (self.entries - 1)
+
+    def _direction(self, inst, pc):
+        kind = self.kind
+        if kind == 'not_taken':
+            return False
+        if kind == 'btfn':
+            return inst.args[-1] < 0 # backward branch
+        counter = self.counters[self._index(pc)]
+        return counter >= 2 if kind != 'bimodal1' else counter == 1
+
+    def _train(self, pc, taken):
+        kind = self.kind
+        if kind in ('not_taken', 'btfn'):
+            return
+        i = self._index(pc)
+        c = self.counters[i]
+        if kind == 'bimodal1':
+            self.counters[i] = 1 if taken else 0
+        elif taken:
+            if c < 3:
+                self.counters[i] = c + 1
+        elif c > 0:
+            self.counters[i] = c - 1
+        if kind == 'gshare':
+            self.history = ((self.history << 1) | taken) & ((1 << self.history_bits) - 1)
+
+    def _btb_hit(self, pc, target):
+        # Whether the BTB would have supplied target at fetch
+        self.btb_lookups += 1
+        i = (pc >> 1) & (self.btb_entries - 1)
+        hit = self.btb_tags[i] == pc and self.btb_targets[i] == target
+        if hit:
+            self.btb_hits += 1
+        return hit
+
+    def _btb_update(self, pc, target):
+        i = (pc >> 1) & (self.btb_entries - 1)
+        self.btb_tags[i] = pc
+        self.btb_targets[i] = target
+
+    def record(self, inst, pc, next_pc):
+        # True when the front end would have fetched the wrong path after
+        # inst, False otherwise (also for non-control instructions)
+        op = inst.op
+        taken = next_pc != pc + inst.length
+        if op in CONDITIONAL_OPS:
+            predicted = self._direction(inst, pc)
+            self._train(pc, taken)
+            self.last = predicted
+            miss = predicted != taken
+            if taken and not miss:
+                miss = not self._btb_hit(pc, next_pc)
+        elif op in DIRECT_JUMP_OPS:
+            miss = not self._btb_hit(pc, next_pc)
+        elif op in INDIRECT_JUMP_OPS:
+            miss = not self._btb_hit(pc, next_pc)
+        else:
+            return False
+        if taken:
+            self._btb_update(pc, next_pc)
+
+        self.predictions += 1
+        stats = self.branches.get(pc)
+        if stats is None:
+            stats = self.branches[pc] = [0, 0, 0]
+        stats[0] += 1
+        stats[2] += taken
+        if miss:
+            self.mispredictions += 1
+            stats[1] += 1
+        return miss
+
+    def report(self, sim=None, top=10):
+        def entry(pc, stats):
+            executed, missed, taken = stats
+            inst = sim.fetch(pc) if sim is not None else None
+            return {'pc': pc, 'source': inst.source if inst is not None else None,
+                    'executed': executed, 'mispredicted': missed, 'taken': taken,
+                    'accuracy': 1 - missed / executed}
+
+        worst = sorted(self.branches.items(), key=lambda b: -b[1][1])[:top]
+        return {
+            'kind': self.kind,
+            'predictions': self.predictions,
+            'mispredictions': self.mispredictions,
+            'accuracy': 1 - self.mispredictions / self.predictions if self.predictions else None,
+            'btb_hit_rate': self.btb_hits / self.btb_lookups if self.btb_lookups else None,
+            'branches': [entry(pc, stats) for pc, stats in worst],
+        }
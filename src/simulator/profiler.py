@@ -0,0 +1,97 @@
+from .blocks import CONTROL_OPS
+from .instructions import BRANCH_OPS
+
+# Conditional branches, counted as taken / not taken
+CONDITIONAL_OPS = set(BRANCH_OPS) | {'c.beqz', 'c.bnez'}
+
+class Profiler:
+    # Execution counts gathered by RISCVSimulator.step() while attached
+    # (sim.profiler). Plain dicts, so a profiled simulator still pickles.
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.instructions = 0
+        self.op_counts = {}    # op -> executions
+        self.pc_counts = {}    # pc -> executions
+        self.branches = {}     # pc -> [taken, not taken]
+        self.targets = {}      # pc reached by a jump or taken branch -> count
+
+    def record(self, inst, pc, next_pc):
+        self.instructions += 1
+        op = inst.op
+        self.op_counts[op] = self.op_counts.get(op, 0) + 1
+        self.pc_counts[pc] = self.pc_counts.get(pc, 0) + 1
+        jumped = next_pc != pc + inst.length
+        if op in CONDITIONAL_OPS:
+            counts = self.branches.get(pc)
+            if counts is None:
+                counts = self.branches[pc] = [0, 0]
+            counts[0 if jumped else 1] += 1
+        if jumped:
+            self.targets[next_pc] = self.targets.get(next_pc, 0) + 1
+
+    def hot_blocks(self, fetch, top=10):
+        # Basic blocks of the executed code, hottest (most instructions
+        # retired inside) first. Blocks start at jump targets, after
+        # control transfers and at the first executed PC.
+        pc_counts = self.pc_counts
+        leaders = {pc for pc in self.targets if pc in pc_counts}
+        if pc_counts:
+            leaders.add(next(iter(pc_counts)))
+        for pc in pc_counts:
+            inst = fetch(pc)
+            if inst is not None and inst.op in CONTROL_OPS:
+                leaders.add(pc + inst.length)
+
+        blocks = []
+        for start in leaders:
+            if start not in pc_counts:
+                continue
+            pcs = []
+            pc = start
+            while pc in pc_counts and (not pcs or pc not in leaders):
+                inst = fetch(pc)
+                if inst is None:
+                    break
+                pcs.append(pc)
+                if inst.op in CONTROL_OPS:
+                    break
+                pc += inst.length
+            if pcs:
+                blocks.append((sum(pc_counts[p] for p in pcs), pcs))
+        blocks.sort(key=lambda b: -b[0])
+        return blocks[:top]
+
+    def report(self, sim, top=10):
+        # JSON-able summary; instructions are mapped back to their source
+        # line through the assembled program where there is one.
+        def where(pc):
+            entry = {'pc': pc, 'count': self.pc_counts.get(pc, 0)}
+            src = sim.program.get(pc)
+            if src is not None:
+                entry['source'] = src['source']
+                if 'line' in src:
+                    entry['line'] = src['line']
+            else:
+                inst = sim.fetch(pc)
+                entry['source'] = inst.source if inst is not None else None
+            return entry
+
+        total = self.instructions or 1
+        hot_pcs = sorted(self.pc_counts, key=lambda pc: -self.pc_counts[pc])[:top]
+        branches = sorted(self.branches.items(), key=lambda b: -sum(b[1]))[:top]
+        return {
+            'instructions': self.instructions,
+            'ops': dict(sorted(self.op_counts.items(), key=lambda o: -o[1])),
+            'hot_pcs': [dict(where(pc), share=self.pc_counts[pc] / total) for pc in hot_pcs],
+            'branches': [dict(where(pc), taken=t, not_taken=n) for pc, (t, n) in branches],
+            'hot_blocks': [{
+                'start': pcs[0],
+                'end': pcs[-1],
+                'instructions': count,
+                'share': count / total,
+                'entries': self.pc_counts[pcs[0]],
+                'lines': [where(pc) for pc in pcs],
+            } for count, pcs in self.hot_blocks(sim.fetch, top)],
+        }
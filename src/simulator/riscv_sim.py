@@ -1,12 +1,72 @@
-
-import re
+import contextlib
+import io
+import operator
 import struct
+import time
 from .memory import Memory
 from .csr import CSRFile
 from .instructions import get_executors
+from .instructions.rv32i import to_signed
+from .decoder import decode, Instruction
+from .blocks import BlockCache
+from .encoding import decode_word, disassemble
+from .elf import load_elf
+from .assembler import assemble, REGISTERS, F_ABI_NAMES
+from .profiler import Profiler
+from .pipeline import PipelineModel
+from .cache import CacheHierarchy
+from .predictor import BranchPredictor
+from .journal import Journal
+from .trace import trace as trace_log
+from . import checkpoint
+
+# Reasons returned by RISCVSimulator.run()
+STOP_HALTED = 'halted'         # PC left the program (or exit ecall)
+STOP_BUDGET = 'budget'         # max_steps or max_time used up
+STOP_BREAKPOINT = 'breakpoint' # about to execute a breakpoint PC
+STOP_UNKNOWN = 'unknown'       # unknown instruction at PC
+STOP_WATCHPOINT = 'watchpoint' # an instruction accessed watched memory
+
+# Comparisons for conditional breakpoints, on signed register values
+CONDITION_OPS = {
+    '==': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+}
+
+TIME_CHECK_INTERVAL = 4096 # instructions between deadline checks
+MAX_SNAPSHOTS = 8 # register snapshots kept for get_state(since=...)
+
+def parse_condition_register(reg):
+    # x/f register number or name; f registers come back as 32 + n
+    if isinstance(reg, int):
+        if not 0 <= reg < 64:
+            raise ValueError(f"Invalid register: {reg}")
+        return reg
+    n = REGISTERS.get(reg)
+    if n is None:
+        raise ValueError(f"Invalid register: {reg}")
+    return 32 + n if reg in F_ABI_NAMES or reg.startswith('f') and reg[1:].isdigit() else n
 
 class RISCVSimulator:
-    def __init__(self):
+    def __init__(self, trace=True, memory_factory=Memory):
+        # trace: maintain pipeline_state for the datapath view on every step
+        self.trace = trace
+        # Called with no arguments on every reset, e.g.
+        # functools.partial(Memory, ram=(0, 1 << 24)) for a flat RAM region
+        self.memory_factory = memory_factory
+        self.breakpoints = set()
+        # pc -> [(register, op, value)]: a breakpoint at pc only stops when
+        # one of its conditions holds. Registers >= 32 are f registers.
+        self.conditions = {}
+        self.watchpoints = [] # (start, end, read, write), see Memory
+        # get_state() versions keep increasing across resets so a client's
+        # old version can never match a new snapshot
+        self.state_version = 0
+        self.profiler = None # Profiler fed by step() while attached
+        self.pipeline = None # PipelineModel timed by step() while attached
+        self.caches = None # CacheHierarchy seeing step()'s fetches and data accesses
+        self.predictor = None # BranchPredictor trained by step()
+        self.journal = None # Journal for step_back() / seek()
         self.reset()
         # Dispatch table
         self.executors = get_executors()
@@ -15,13 +75,31 @@ class RISCVSimulator:
         self.x = [0] * 32
         self.f = [0] * 32 # Float registers (integers representing bits)
         self.pc = 0
-        self.memory = Memory()
+        self.memory = self.memory_factory()
+        self.memory.epoch = self.state_version + 1
+        self.memory.set_watchpoints(self.watchpoints)
+        self.snapshots = {} # version -> (x, f) as of that get_state()
         self.csrs = CSRFile()
         self.program = {} # Address -> Inst
+        self.decoded = {} # Address -> decoder.Instruction, filled on fetch
+        self.blocks = BlockCache(self.fetch, self.breakpoints, bool(self.watchpoints))
         self.labels = {}
         self.pipeline_state = self.empty_pipeline_state()
         self.reservation = None
         self.current_inst = None
+        self.fault = None # Instruction that could not be executed
+        self.instret = 0  # Instructions retired
+        if self.profiler is not None:
+            self.profiler.reset()
+        if self.pipeline is not None:
+            self.pipeline.reset()
+        if self.caches is not None:
+            self.caches.reset()
+        if self.predictor is not None:
+            self.predictor.reset()
+        if self.journal is not None:
+            self.journal.reset()
+        self.exit_code = None # a0 of the exit ecall, once it ran
 
     def empty_pipeline_state(self):
         return {
@@ -36,166 +114,490 @@ class RISCVSimulator:
 
     def assemble(self, code):
         self.program = {}
-        self.labels = {}
-        lines = code.split('\n')
-        errors = []
-        
-        # Pass 1: Labels and Lines
-        current = 0
-        clean = [] # (addr, line_content, original_line_index_1_based)
-        
-        # We need to map labels first.
-        # But to map labels we need to know addresses.
-        # To know addresses we need to know instruction lengths.
-        # So we iterate valid lines.
-        
-        for i, line in enumerate(lines):
-            raw = line
-            line = line.split('#')[0].strip()
-            if not line: continue
-            
-            if line.endswith(':'):
-                self.labels[line[:-1]] = current
-            else:
-                # Guess length
-                parts = line.replace(',', ' ').split()
-                try: 
-                    op = parts[0].lower()
-                    length = 2 if op.startswith('c.') else 4
-                except:
-                    length = 4 # Default to 4 if parse fail, will fail in Pass 2
-                
-                clean.append((current, line, i + 1))
-                current += length
-        
-        # Pass 2: Parse
-        for addr, line, line_num in clean:
-            try:
-                inst = self.parse_line(line, addr)
-                self.program[addr] = inst
-            except Exception as e:
-                errors.append({'line': line_num, 'message': str(e)})
-                
-        if errors:
-            return False, errors
-            
+        self.decoded = {}
+        self.blocks.clear()
+        program = assemble(code)
+        if self.journal is not None:
+            self.journal.reset()
+        self.labels = program.labels
+        if program.errors:
+            # Nothing left to fetch, not even the previous program's bytes
+            self.memory.set_code_range(0, 0)
+            return False, program.errors
+
+        # Load the machine code into memory; execution fetches from there
+        self.program = program.instructions
+        self.memory.load(program.start, program.code)
+        self.memory.load(program.data_start, program.data)
+        self.memory.set_code_range(program.start, program.start + len(program.code))
+        self.decode_program()
         return True, "Assembled successfully"
 
-    def parse_line(self, line, addr):
-        parts = line.replace(',', ' ').split()
-        if not parts: raise Exception("Empty line")
-        op = parts[0].lower()
-        args = parts[1:]
-
-        # Stripping atomic suffixes for standard atomic ops if needed, 
-        # but our executors map 'lr.w', 'sc.w' etc directly.
-        # However, for 'amoadd.w.aq' we might need stripping.
-        # The executors in rv32a.py key on 'amoadd.w' etc.
-        # So we should strip .aq, .rl, .aqrl.
-        
-        original_op = op
-        for suffix in ['.aqrl', '.aq', '.rl']:
-            if op.endswith(suffix) and op not in ['lr.w', 'sc.w']: # lr.w is exact match usually, but lr.w.aq is possible? Yes.
-                 # Actually standard is lr.w.aq. 
-                 # My executors use 'lr.w'.
-                 # So I should strip from ANY atomic op.
-                 op = op[:-len(suffix)]
-                 break
-        
-        # Re-check if valid op
-        if op not in self.executors and original_op not in self.executors:
-             # Try stripping from atomic again if missed?
-             pass
-
-        inst = {
-            'address': addr,
-            'source': line,
-            'op': op,
-            'args': [],
-            'machine_code': 0, # Placeholder
-            'length': 2 if op.startswith('c.') else 4
-        }
-        
-        def get_reg(s):
-            if s in ['zero', 'x0']: return 0
-            if s.startswith('x'): return int(s[1:])
-            abis = ['zero','ra','sp','gp','tp','t0','t1','t2','s0','s1','a0','a1','a2',
-                    'a3','a4','a5','a6','a7','s2','s3','s4','s5','s6','s7','s8','s9',
-                    's10','s11','t3','t4','t5','t6']
-            if s in abis: return abis.index(s)
-            
-            if s.startswith('f'):
-                try: return int(s[1:])
-                except: pass
-            
-            f_abis = ['ft0','ft1','ft2','ft3','ft4','ft5','ft6','ft7','fs0','fs1','fa0','fa1',
-                      'fa2','fa3','fa4','fa5','fa6','fa7','fs2','fs3','fs4','fs5','fs6','fs7',
-                      'fs8','fs9','fs10','fs11','ft8','ft9','ft10','ft11']
-            if s in f_abis: return f_abis.index(s)
-            
-            if s == 'fp': return 8
-            raise Exception(f"Invalid register: {s}")
-
-        def get_imm(s):
-            if s in self.labels: return self.labels[s] - addr
-            try: return int(s, 0)
-            except: raise Exception(f"Invalid immediate: {s}")
-
-        parsed_args = []
-        for a in args:
-            if '(' in a:
-                # offset(base)
-                off_str, base_str = a.replace(')', '').split('(')
-                parsed_args.append(get_imm(off_str))
-                parsed_args.append(get_reg(base_str))
-            else:
-                if a in self.labels: parsed_args.append(get_imm(a))
-                elif (a[0].isdigit() or a[0] == '-' or a.startswith('0x')): parsed_args.append(get_imm(a))
-                else: parsed_args.append(get_reg(a))
-        
-        inst['args'] = parsed_args
-        
-        # Fix JAL args
-        # jal label -> [imm] -> [1, imm]
-        if op == 'jal' and len(parsed_args) == 1:
-            inst['args'] = [1, parsed_args[0]]
-            
+    def decode_program(self):
+        # Decode stage: bind every instruction to its handler once. These
+        # match what fetch() would decode from memory, but keep the source.
+        # Instructions overwritten since assembly are left to fetch().
+        read = self.memory.peek
+        for addr, inst in self.program.items():
+            if read(addr, inst['length']) == inst['machine_code']:
+                self.decoded[addr] = decode(inst, self.executors, self.exec_unknown)
+
+    def __getstate__(self):
+        # Handlers and compiled blocks are closures, so pickles (e.g. for a
+        # process pool) carry only the architectural state; the caches are
+        # rebuilt on load.
+        state = self.__dict__.copy()
+        for key in ('executors', 'decoded', 'blocks'):
+            del state[key]
+        state['current_inst'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.executors = get_executors()
+        self.decoded = {}
+        self.blocks = BlockCache(self.fetch, self.breakpoints, bool(self.watchpoints))
+        self.decode_program()
+
+    def load_elf(self, source):
+        # Replaces the machine state with an ELF32 executable (path or
+        # bytes). Returns the entry point.
+        return load_elf(self, source)
+
+    def fetch(self, pc):
+        # Decoded instruction at pc, decoding it from memory on first use.
+        # None once pc leaves the program's code range (halted).
+        inst = self.decoded.get(pc)
+        if inst is None:
+            memory = self.memory
+            if memory.code_start <= pc < memory.code_end:
+                inst = self.decoded[pc] = self.decode_at(pc)
         return inst
 
+    def decode_at(self, addr):
+        word = self.memory.peek(addr, 4)
+        fields = decode_word(word)
+        if fields is None:
+            length = 4 if word & 0x3 == 0x3 else 2
+            word &= (1 << (length * 8)) - 1
+            return Instruction(addr, 'illegal', (), length, word, f".word {word:#x}", self.exec_unknown)
+        op, args, length = fields
+        if length == 2:
+            word &= 0xFFFF
+        inst = {'address': addr, 'op': op, 'args': args, 'length': length,
+                'machine_code': word, 'source': disassemble(op, args)}
+        return decode(inst, self.executors, self.exec_unknown)
+
     def step(self):
-        inst = self.program.get(self.pc)
+        if self.memory.code_written:
+            self.invalidate_blocks()
+        inst = self.fetch(self.pc)
         if not inst: return
 
         self.current_inst = inst
-        self.pipeline_state = self.empty_pipeline_state()
-        self.pipeline_state['pc'] = self.pc
-        self.pipeline_state['inst'] = inst['machine_code']
-        
-        handler = self.executors.get(inst['op'], self.exec_unknown)
-        handler(self, inst) 
-        
+        self.fault = None
+        if self.trace:
+            self.pipeline_state = self.empty_pipeline_state()
+            self.pipeline_state['pc'] = self.pc
+            self.pipeline_state['inst'] = inst.machine_code
+        else:
+            self.pipeline_state = None
+
+        pc = self.pc
+        timing = None
+        if self.caches is not None:
+            # Before executing: the address registers may be overwritten
+            timing = self.caches.access(inst, pc, self.x)
+        journal = self.journal
+        if journal is not None:
+            if not journal.checkpoints:
+                journal.checkpoint(self)
+            undo = journal.before(self, inst)
+        inst.handler(self, inst)
+
         self.x[0] = 0 
+        if self.fault is None:
+            self.instret += 1
+            if journal is not None:
+                journal.push(self, undo)
+            if self.profiler is not None:
+                self.profiler.record(inst, pc, self.pc)
+            if self.predictor is not None or self.pipeline is not None:
+                self._time(inst, pc, timing)
+
+    def _time(self, inst, pc, timing):
+        # Feeds the predictor and pipeline model with a retired instruction;
+        # timing is (fetch cycles, memory cycles) from the caches
+        redirect = None
+        predictor = self.predictor
+        if predictor is not None:
+            redirect = predictor.record(inst, pc, self.pc)
+            state = self.pipeline_state
+            if self.trace and (state['branch'] or state['jump']):
+                # Prediction next to the branch_taken the executor recorded
+                self.update_pipe(predicted_taken=predictor.last if state['branch'] else True,
+                                 mispredicted=redirect)
+        if self.pipeline is not None:
+            fetch_cycles, mem_cycles = timing or (1, 1)
+            self.pipeline.record(inst, pc, self.pc, fetch_cycles, mem_cycles, redirect)
 
-    def run(self):
+    def run(self, max_steps=None, max_time=None, trace=False):
+        # Runs until the program halts, hits a breakpoint or unknown
+        # instruction, or uses up max_steps instructions / max_time seconds.
+        # Calling run() again resumes where the previous call stopped.
+        # Returns one of the STOP_* reasons.
+        saved_trace = self.trace
+        self.trace = trace
+        self.fault = None
+        self.memory.watch_hit = None
+        try:
+            if trace or self.instrumented:
+                # Datapath bookkeeping or models fed on every instruction
+                return self._run_steps(max_steps, max_time)
+            if self.journal is not None:
+                reason = self._run_checkpointed(max_steps, max_time)
+            else:
+                reason = self._run_blocks(max_steps, max_time)
+            self.pipeline_state = None # rebuilt by get_state() if needed
+            return reason
+        finally:
+            self.trace = saved_trace
+
+    def _run_steps(self, max_steps, max_time):
+        deadline = None if max_time is None else time.perf_counter() + max_time
         counter = 0
-        while self.program.get(self.pc) and counter < 5000:
+        while True:
+            pc = self.pc
+            if self.fetch(pc) is None:
+                return STOP_HALTED
+            if max_steps is not None and counter >= max_steps:
+                return STOP_BUDGET
+            if counter and pc in self.breakpoints and self.break_at(pc):
+                return STOP_BREAKPOINT
+            if deadline is not None and counter % TIME_CHECK_INTERVAL == 0 \
+                    and counter and time.perf_counter() >= deadline:
+                return STOP_BUDGET
             self.step()
+            if self.fault is not None:
+                return STOP_UNKNOWN
             counter += 1
+            hit = self.memory.watch_hit
+            if hit is not None:
+                hit['pc'] = pc
+                return STOP_WATCHPOINT
+
+    def _run_blocks(self, max_steps, max_time):
+        # Executes whole compiled basic blocks; falls back to single
+        # instructions when a block would overshoot max_steps.
+        limit = max_steps if max_steps is not None else float('inf')
+        deadline = None if max_time is None else time.perf_counter() + max_time
+        next_check = TIME_CHECK_INTERVAL
+        counter = 0
+        blocks = self.blocks
+        compiled = blocks.blocks
+        memory = self.memory
+        breakpoints = self.breakpoints
+        try:
+            while True:
+                if memory.code_written:
+                    self.invalidate_blocks()
+                pc = self.pc
+                blk = compiled.get(pc) or blocks.get(pc)
+                if blk is None:
+                    return STOP_HALTED
+                if counter >= limit:
+                    return STOP_BUDGET
+                if counter and pc in breakpoints and self.break_at(pc):
+                    return STOP_BREAKPOINT
+                if deadline is not None and counter >= next_check:
+                    if time.perf_counter() >= deadline:
+                        return STOP_BUDGET
+                    next_check = counter + TIME_CHECK_INTERVAL
+                if counter + blk.count > limit:
+                    inst = self.fetch(pc)
+                    inst.handler(self, inst)
+                    # A faulting instruction does not retire
+                    counter += 1 if self.fault is None else 0
+                    if memory.watch_hit is not None:
+                        memory.watch_hit['pc'] = pc
+                else:
+                    # Blocks that loop onto themselves stop within the budget
+                    budget = limit if deadline is None else min(limit, next_check)
+                    counter += blk.run(self, budget - counter)
+                if self.fault is not None:
+                    return STOP_UNKNOWN
+                if memory.watch_hit is not None:
+                    return STOP_WATCHPOINT
+        finally:
+            self.instret += counter
+
+    def _run_checkpointed(self, max_steps, max_time):
+        # _run_blocks() in slices that end where the journal wants its
+        # next checkpoint
+        journal = self.journal
+        deadline = None if max_time is None else time.perf_counter() + max_time
+        start = self.instret
+        while True:
+            journal.checkpoint_if_due(self)
+            chunk = journal.until_checkpoint(self)
+            if max_steps is not None:
+                chunk = min(chunk, max_steps - (self.instret - start))
+            if self.instret != start and self.pc in self.breakpoints and self.break_at(self.pc):
+                return STOP_BREAKPOINT
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return STOP_BUDGET
+            reason = self._run_blocks(chunk, remaining)
+            if reason != STOP_BUDGET or self.instret - start == max_steps:
+                return reason
+            if deadline is not None and time.perf_counter() >= deadline:
+                return STOP_BUDGET
+
+    def step_back(self, steps=1, max_time=None):
+        # Undoes up to `steps` retired instructions, returns how many
+        if self.journal is None:
+            raise RuntimeError("Reverse execution needs enable_journal()")
+        target = max(0, self.instret - steps)
+        return self.instret - self.seek(target, max_time)
+
+    def seek(self, step, max_time=None):
+        # Moves to the state after `step` retired instructions (since the
+        # last reset/assemble) and returns the step reached: forward by
+        # running (break/watchpoints ignored, stops early on halt), backward
+        # through the journal: undo entries, or replay from the nearest
+        # earlier checkpoint. Either direction stops early once max_time
+        # seconds have passed; call again with the same step to continue.
+        # Profiling and timing models do not see replayed instructions and
+        # are not rewound.
+        journal = self.journal
+        if journal is None:
+            raise RuntimeError("Reverse execution needs enable_journal()")
+        self.pipeline_state = None
+        deadline = None if max_time is None else time.perf_counter() + max_time
+        if step >= self.instret:
+            while self.instret < step:
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                reason = self.run(max_steps=step - self.instret, max_time=remaining)
+                if reason not in (STOP_BREAKPOINT, STOP_WATCHPOINT):
+                    break
+            return self.instret
+
+        if self.instret - step <= journal.undoable(self):
+            while self.instret > step:
+                journal.undo(self)
+            return self.instret
+
+        cp = journal.nearest(step)
+        if cp is None:
+            return self.instret
+        journal.rewind(self, cp)
+        models = (self.profiler, self.pipeline, self.caches, self.predictor)
+        self.profiler = self.pipeline = self.caches = self.predictor = None
+        try:
+            with contextlib.redirect_stdout(io.StringIO()): # already printed once
+                replayed = 0
+                while self.instret < step:
+                    if deadline is not None and replayed % TIME_CHECK_INTERVAL == 0 \
+                            and replayed and time.perf_counter() >= deadline:
+                        break
+                    self.step()
+                    replayed += 1
+                    if self.fault is not None:
+                        break
+        finally:
+            self.profiler, self.pipeline, self.caches, self.predictor = models
+        return self.instret
+
+    def export_trace(self, **kwargs):
+        # Generator of the binary execution trace (see simulator.trace)
+        # while stepping from the current state
+        return trace_log(self, **kwargs)
+
+    def save_checkpoint(self, path):
+        # Registers, program and non-empty memory pages to a file (see
+        # simulator.checkpoint); returns the number of pages written
+        return checkpoint.save_checkpoint(self, path)
+
+    def load_checkpoint(self, path):
+        # Resets and restores a save_checkpoint() file, its pages mapped
+        # copy-on-write
+        return checkpoint.load_checkpoint(self, path)
+
+    def enable_journal(self, size=None, checkpoint_interval=None, max_checkpoints=None):
+        # Journaling starts from the current state; earlier steps cannot be
+        # undone
+        options = {k: v for k, v in (('size', size), ('checkpoint_interval', checkpoint_interval),
+                                     ('max_checkpoints', max_checkpoints)) if v is not None}
+        self.journal = Journal(**options)
+        return self.journal
+
+    def disable_journal(self):
+        journal, self.journal = self.journal, None
+        return journal
+
+    @property
+    def instrumented(self):
+        # Models that have to see every instruction; compiled blocks are
+        # not instrumented, so run() steps one at a time while any is on.
+        return (self.profiler is not None or self.pipeline is not None or
+                self.caches is not None or self.predictor is not None)
+
+    def enable_profiling(self):
+        # Counts from here on
+        if self.profiler is None:
+            self.profiler = Profiler()
+        return self.profiler
 
-    def get_state(self):
-        flat_mem = {}
-        for base, page in self.memory.pages.items():
-            for i, b in enumerate(page):
-                if b != 0: flat_mem[base + i] = b
+    def disable_profiling(self):
+        profiler, self.profiler = self.profiler, None
+        return profiler
 
+    def profile_report(self, top=10):
+        return self.profiler.report(self, top) if self.profiler is not None else None
+
+    def enable_pipeline(self, forwarding=True, latencies=None):
+        # Cycle timing of the 5-stage pipeline from here on
+        self.pipeline = PipelineModel(forwarding, latencies)
+        return self.pipeline
+
+    def disable_pipeline(self):
+        pipeline, self.pipeline = self.pipeline, None
+        return pipeline
+
+    def enable_caches(self, l1i=None, l1d=None, l2=None, memory_latency=None):
+        # Cold L1I/L1D (and L2 if configured) from here on. With the pipeline
+        # model attached, misses lengthen its IF and MEM stages.
+        kwargs = {} if memory_latency is None else {'memory_latency': memory_latency}
+        self.caches = CacheHierarchy(l1i, l1d, l2, **kwargs)
+        return self.caches
+
+    def disable_caches(self):
+        caches, self.caches = self.caches, None
+        return caches
+
+    def enable_predictor(self, kind='bimodal2', entries=1024, history_bits=10, btb_entries=64):
+        # With the pipeline model attached only mispredictions flush,
+        # instead of every taken branch
+        self.predictor = BranchPredictor(kind, entries, history_bits, btb_entries)
+        return self.predictor
+
+    def disable_predictor(self):
+        predictor, self.predictor = self.predictor, None
+        return predictor
+
+    def add_breakpoint(self, addr, condition=None):
+        # condition: (register, op, value), e.g. ('a0', '==', 5); several
+        # conditions at one address stop when any holds
+        if condition is not None:
+            reg, op, value = condition
+            if op not in CONDITION_OPS:
+                raise ValueError(f"Unknown comparison: {op}")
+            self.conditions.setdefault(addr, []).append((parse_condition_register(reg), op, int(value)))
+        else:
+            self.conditions.pop(addr, None)
+        self.breakpoints.add(addr)
+        self.blocks.clear()
+
+    def remove_breakpoint(self, addr):
+        self.breakpoints.discard(addr)
+        self.conditions.pop(addr, None)
+        self.blocks.clear()
+
+    def break_at(self, pc):
+        # Whether the breakpoint at pc stops execution now
+        conditions = self.conditions.get(pc)
+        if not conditions:
+            return True
+        for reg, op, value in conditions:
+            bits = self.x[reg] if reg < 32 else self.f[reg - 32]
+            if CONDITION_OPS[op](to_signed(bits), value):
+                return True
+        return False
+
+    def add_watchpoint(self, addr, size=4, read=False, write=True):
+        # Stops run() after an instruction reads/writes any byte of
+        # [addr, addr + size); memory.watch_hit describes the access
+        if size <= 0 or not (read or write):
+            raise ValueError("A watchpoint needs a size > 0 and read and/or write")
+        self.watchpoints.append((addr, addr + size, bool(read), bool(write)))
+        self.memory.set_watchpoints(self.watchpoints)
+        self.blocks.set_watch(True)
+
+    def remove_watchpoint(self, addr, size=4):
+        self.watchpoints[:] = [wp for wp in self.watchpoints if wp[:2] != (addr, addr + size)]
+        self.memory.set_watchpoints(self.watchpoints)
+        self.blocks.set_watch(bool(self.watchpoints))
+
+    def invalidate_blocks(self):
+        # Code was overwritten: drop every decoded instruction overlapping
+        # the written bytes, they are decoded again from memory on fetch.
+        memory = self.memory
+        for addr, size in memory.code_writes:
+            for a in range(addr - 3, addr + size):
+                self.decoded.pop(a, None)
+        memory.code_writes.clear()
+        memory.code_written = False
+        self.blocks.clear()
+
+    def get_state(self, since=None):
+        # Full state, or only what changed after version `since` when that
+        # version is still known. Either way the result carries a new
+        # 'version' to pass back next time.
+        memory = self.memory
+        version = self.state_version = memory.epoch
+        memory.epoch += 1
+        prev = self.snapshots.get(since) if since is not None else None
+        self.snapshots[version] = (self.x[:], self.f[:])
+        while len(self.snapshots) > MAX_SNAPSHOTS:
+            del self.snapshots[min(self.snapshots)]
+
+        if prev is None:
+            return {
+                'version': version,
+                'registers': self.x,
+                'f_registers': self.f,
+                'pc': self.pc,
+                'memory': memory.flatten(),
+                'pipeline': self.get_pipeline_state()
+            }
+
+        # Registers as {index: value}; dirty_pages lists every page whose
+        # contents the client should replace with the bytes in 'memory'
+        # (missing addresses are zero).
+        prev_x, prev_f = prev
+        dirty = memory.dirty_pages(since)
         return {
-            'registers': self.x,
-            'f_registers': self.f,
+            'version': version,
+            'since': since,
+            'registers': {i: v for i, v in enumerate(self.x) if v != prev_x[i]},
+            'f_registers': {i: v for i, v in enumerate(self.f) if v != prev_f[i]},
             'pc': self.pc,
-            'memory': flat_mem,
-            'pipeline': self.pipeline_state
+            'memory': memory.flatten(dirty),
+            'dirty_pages': dirty,
+            'pipeline': self.get_pipeline_state()
         }
+
+    def get_pipeline_state(self):
+        if self.pipeline_state is None:
+            # Nothing was traced (headless run/step): show the instruction
+            # about to be fetched.
+            state = self.empty_pipeline_state()
+            state['pc'] = self.pc
+            inst = self.fetch(self.pc)
+            if inst:
+                state['inst'] = inst.machine_code
+            self.pipeline_state = state
+        if self.pipeline is not None:
+            # Instructions in flight according to the timing model
+            self.pipeline_state['stages'] = self.pipeline.in_flight()
+            self.pipeline_state['timing'] = self.pipeline.report()
+        return self.pipeline_state
     
+    def update_pipe(self, **fields):
+        self.pipeline_state.update(fields)
+
     def write_reg(self, rd, val):
         if rd != 0:
             self.x[rd] = val & 0xFFFFFFFF
@@ -205,6 +607,6 @@ class RISCVSimulator:
         self.f[rd] = val 
         
     def exec_unknown(self, sim, inst):
-        print(f"Unknown instruction: {inst['op']}")
-        self.pc += inst.get('length', 4)
+        # Leaves the PC on the instruction; run() reports STOP_UNKNOWN
+        self.fault = inst
 
@@ -0,0 +1,130 @@
+import struct
+import time
+from .pipeline import register_usage
+from .cache import data_access
+
+# Binary execution trace. A header is followed by fixed-width records:
+#
+#   header      '<4sHHI'  magic, version, step record size, checkpoint interval
+#   step        '<BBBBIIIII' (24 bytes)
+#               tag=1, rd (NO_REG if none, 32+n for f registers),
+#               mem (MEM_NONE/MEM_READ/MEM_WRITE), mem size,
+#               pc, instruction word, value written to rd,
+#               memory address, memory data (after the access)
+#   checkpoint  '<B3xQI32I32I' (272 bytes)
+#               tag=2, instret, pc, x0-x31, f0-f31; the state before the
+#               next step record. One starts the trace and one follows
+#               every checkpoint_interval steps.
+#
+# trace() runs the simulator and yields the log in chunks, so nothing but
+# the current chunk is held in memory.
+
+MAGIC = b'RVTR'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI')
+STEP = struct.Struct('<BBBBIIIII')
+CHECKPOINT = struct.Struct('<B3xQI32I32I')
+TAG_STEP = 1
+TAG_CHECKPOINT = 2
+
+NO_REG = 0xFF
+MEM_NONE = 0
+MEM_READ = 1
+MEM_WRITE = 2
+
+DEFAULT_CHECKPOINT_INTERVAL = 65536
+CHUNK_SIZE = 1 << 16 # bytes per yielded chunk
+
+class TraceFormatError(Exception):
+    pass
+
+def trace(sim, max_steps=None, max_time=None, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+          chunk_size=CHUNK_SIZE):
+    # Steps sim until it halts or faults, or max_steps / max_time run out,
+    # yielding the trace as bytes chunks
+    deadline = None if max_time is None else time.perf_counter() + max_time
+    usage = {} # Instruction -> (rd, data access)
+    pack_step = STEP.pack
+    buf = bytearray(HEADER.pack(MAGIC, VERSION, STEP.size, checkpoint_interval))
+    count = 0
+    while max_steps is None or count < max_steps:
+        if deadline is not None and count % 4096 == 0 and time.perf_counter() >= deadline:
+            break
+        pc = sim.pc
+        inst = sim.fetch(pc)
+        if inst is None:
+            break
+        if count % checkpoint_interval == 0:
+            buf += CHECKPOINT.pack(TAG_CHECKPOINT, sim.instret, pc, *sim.x, *sim.f)
+
+        info = usage.get(inst)
+        if info is None:
+            info = usage[inst] = (register_usage(inst.op, inst.args)[0],
+                                  data_access(inst.op, inst.args))
+        rd, access = info
+        addr = size = 0
+        mem = MEM_NONE
+        if access is not None:
+            write, size, base, offset = access
+            addr = (sim.x[base] + offset) & 0xFFFFFFFF
+            mem = MEM_WRITE if write else MEM_READ
+            # With rd = x0 a failed SC is only visible from the reservation
+            reserved = sim.reservation == addr
+
+        sim.step()
+        if sim.fault is not None:
+            break
+        if inst.op == 'sc.w' and (sim.x[rd] if rd is not None else not reserved):
+            # Failed SC: nothing was stored
+            mem = MEM_NONE
+            addr = size = 0
+
+        value = 0
+        if rd is not None:
+            value = sim.x[rd] if rd < 32 else sim.f[rd - 32]
+        data = sim.memory.peek(addr, size) if mem else 0
+        buf += pack_step(TAG_STEP, NO_REG if rd is None else rd, mem, size,
+                         pc, inst.machine_code, value, addr, data)
+        count += 1
+        if len(buf) >= chunk_size:
+            yield bytes(buf)
+            buf.clear()
+    if buf:
+        yield bytes(buf)
+
+def write_trace(sim, path, **kwargs):
+    # trace() into a file; returns the number of bytes written
+    written = 0
+    with open(path, 'wb') as f:
+        for chunk in trace(sim, **kwargs):
+            f.write(chunk)
+            written += len(chunk)
+    return written
+
+def read_trace(f):
+    # Yields ('step', pc, word, rd, value, mem, addr, size, data) and
+    # ('checkpoint', instret, pc, x, f) tuples from a binary file object
+    header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise TraceFormatError("Truncated trace header")
+    magic, version, step_size, _ = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION or step_size != STEP.size:
+        raise TraceFormatError("Not a version 1 RVTR trace")
+    while True:
+        tag = f.read(1)
+        if not tag:
+            return
+        if tag[0] == TAG_STEP:
+            record = tag + f.read(STEP.size - 1)
+            if len(record) < STEP.size:
+                raise TraceFormatError("Truncated step record")
+            _, rd, mem, size, pc, word, value, addr, data = STEP.unpack(record)
+            yield ('step', pc, word, None if rd == NO_REG else rd, value, mem, addr, size, data)
+        elif tag[0] == TAG_CHECKPOINT:
+            record = tag + f.read(CHECKPOINT.size - 1)
+            if len(record) < CHECKPOINT.size:
+                raise TraceFormatError("Truncated checkpoint record")
+            fields = CHECKPOINT.unpack(record)
+            yield ('checkpoint', fields[1], fields[2], list(fields[3:35]), list(fields[35:67]))
+        else:
+            raise TraceFormatError(f"Unknown record tag {tag[0]}")
@@ -0,0 +1,433 @@
+import time
+from .riscv_sim import RISCVSimulator, STOP_HALTED, STOP_BUDGET, STOP_UNKNOWN, TIME_CHECK_INTERVAL
+from .memory import PAGE_SIZE
+from .batch import DEFAULT_MAX_STEPS
+from .instructions.rv32i import LOAD_OPS, STORE_OPS
+
+try:
+    import numpy as np
+except ImportError: # optional, only needed by VectorEngine
+    np = None
+
+# Runs one RV32IM program on N independent instances in lockstep. The
+# integer register files are one uint32 array, 32 x N (x is the N x 32
+# view), and each instruction is a handful of array operations over all
+# instances. When branches send instances different ways, the group at
+# the lowest PC runs next and the others wait until it catches up, so
+# structured code reconverges.
+#
+# Memory is the template's image, shared until an instance writes to a
+# page; from then on that page is an N x 4096 array. Instructions are
+# fetched from the template, so stores into the code are not seen.
+# Instructions outside RV32IM stop the instance with STOP_UNKNOWN.
+
+class VectorEngineError(Exception):
+    pass
+
+_M32 = 0xFFFFFFFF
+
+# (size, signed) -> little-endian element type for aligned accesses
+WORD_TYPES = {
+    (1, False): '<u1', (2, False): '<u2', (4, False): '<u4',
+    (1, True): '<i1', (2, True): '<i2', (4, True): '<i4',
+}
+
+def _signed(a):
+    return a.view(np.int32).astype(np.int64)
+
+def _div(a, b):
+    sa, sb = _signed(a), _signed(b)
+    d = np.where(sb == 0, 1, sb)
+    q = np.abs(sa) // np.abs(d) * np.sign(sa) * np.sign(d) # truncating
+    return np.where(sb == 0, -1, q), sa, d
+
+def _vdiv(a, b):
+    return _div(a, b)[0].astype(np.uint32)
+
+def _vrem(a, b):
+    q, sa, d = _div(a, b)
+    return np.where(_signed(b) == 0, sa, sa - d * q).astype(np.uint32)
+
+# Same operations as R_OPS / I_OPS / M_OPS, on uint32 arrays. Immediate
+# forms get the immediate as a 0-d uint32 array and use the register form.
+VECTOR_OPS = {
+    'add': lambda a, b: a + b,
+    'sub': lambda a, b: a - b,
+    'and': lambda a, b: a & b,
+    'or': lambda a, b: a | b,
+    'xor': lambda a, b: a ^ b,
+    'sll': lambda a, b: a << (b & 0x1F),
+    'srl': lambda a, b: a >> (b & 0x1F),
+    'sra': lambda a, b: (_signed(a) >> (b & 0x1F)).astype(np.uint32),
+    'slt': lambda a, b: (a.view(np.int32) < b.view(np.int32)).astype(np.uint32),
+    'sltu': lambda a, b: (a < b).astype(np.uint32),
+    'mul': lambda a, b: a * b,
+    'mulh': lambda a, b: ((_signed(a) * _signed(b)) >> 32).astype(np.uint32),
+    'mulhsu': lambda a, b: ((_signed(a) * b.astype(np.int64)) >> 32).astype(np.uint32),
+    'mulhu': lambda a, b: ((a.astype(np.uint64) * b.astype(np.uint64)) >> 32).astype(np.uint32),
+    'div': _vdiv,
+    'divu': lambda a, b: np.where(b == 0, _M32, a // np.where(b == 0, 1, b)).astype(np.uint32),
+    'rem': _vrem,
+    'remu': lambda a, b: np.where(b == 0, a, a % np.where(b == 0, 1, b)).astype(np.uint32),
+}
+IMM_FORMS = {'addi': 'add', 'andi': 'and', 'ori': 'or', 'xori': 'xor', 'slli': 'sll',
+             'srli': 'srl', 'srai': 'sra', 'slti': 'slt', 'sltiu': 'sltu'}
+VECTOR_BRANCHES = {
+    'beq': lambda a, b: a == b,
+    'bne': lambda a, b: a != b,
+    'blt': lambda a, b: a.view(np.int32) < b.view(np.int32),
+    'bge': lambda a, b: a.view(np.int32) >= b.view(np.int32),
+    'bltu': lambda a, b: a < b,
+    'bgeu': lambda a, b: a >= b,
+}
+
+class VectorEngine:
+    # sim: a RISCVSimulator with the program loaded (assembled or ELF) and
+    # whatever state all instances share; n: number of instances.
+    def __init__(self, sim, n):
+        if np is None:
+            raise VectorEngineError("The vector engine needs NumPy")
+        if n <= 0:
+            raise VectorEngineError("Need at least one instance")
+        self.sim = sim
+        self.n = n
+        self.regs = np.tile(np.array(sim.x, dtype=np.uint32)[:, None], (1, n))
+        self.pc = np.full(n, sim.pc, dtype=np.int64)
+        self.instret = np.full(n, sim.instret, dtype=np.int64)
+        self.active = np.ones(n, dtype=bool)
+        self.reasons = [None] * n # STOP_* once an instance stopped
+        self.exit_codes = [None] * n
+        self.outputs = [[] for _ in range(n)] # characters printed by ecall 1
+        self.image = {base: np.frombuffer(bytes(page), dtype=np.uint8)
+                      for base, page in sim.memory.pages.items()}
+        self.pages = {} # page base -> (n, PAGE_SIZE) uint8, once written
+        self.compiled = {} # pc -> function(mask) executing the instruction there
+        self.stopped = False # an instance stopped since run() last looked
+        self.lanes = np.arange(n)
+
+    @property
+    def x(self):
+        return self.regs.T
+
+    def set_register(self, reg, values):
+        # values: one per instance, or a single value for all
+        if reg:
+            self.regs[reg] = np.asarray(values, dtype=np.int64) & _M32
+
+    def load_memory(self, addr, data, lane=None):
+        # data (bytes) at addr for one instance, or all of them
+        rows = slice(None) if lane is None else lane
+        for i, b in enumerate(data):
+            a = (addr + i) & _M32
+            self._page(a & ~(PAGE_SIZE - 1))[rows, a & (PAGE_SIZE - 1)] = b
+
+    def _page(self, base):
+        page = self.pages.get(base)
+        if page is None:
+            page = np.zeros((self.n, PAGE_SIZE), dtype=np.uint8)
+            if base in self.image:
+                page[:] = self.image[base]
+            self.pages[base] = page
+        return page
+
+    def _same_page(self, addr, size):
+        # Page base when every access is aligned and in one page (the usual
+        # case), else None
+        lo = int(addr.min())
+        if lo >> 12 != int(addr.max()) >> 12 or size > 1 and (addr & (size - 1)).any():
+            return None
+        return lo & ~(PAGE_SIZE - 1)
+
+    def _read(self, addr, lanes, size, signed):
+        # addr: int64 addresses of the instances in lanes
+        base = self._same_page(addr, size)
+        if base is not None:
+            page = self.pages.get(base)
+            if page is None and base not in self.image:
+                return np.zeros(len(lanes), dtype=np.uint32)
+            idx = (addr & (PAGE_SIZE - 1)) >> (size >> 1)
+            dtype = WORD_TYPES[size, signed]
+            if page is not None:
+                value = page.view(dtype)[lanes, idx]
+            else:
+                value = self.image[base].view(dtype)[idx]
+            return value.astype(np.uint32)
+
+        # Unaligned or spread over pages: byte by byte
+        value = np.zeros(len(lanes), dtype=np.int64)
+        for k in range(size):
+            a = (addr + k) & _M32
+            base = a & ~(PAGE_SIZE - 1)
+            off = a & (PAGE_SIZE - 1)
+            for b in np.unique(base):
+                sel = base == b
+                page = self.pages.get(int(b))
+                if page is not None:
+                    byte = page[lanes[sel], off[sel]]
+                else:
+                    image = self.image.get(int(b))
+                    if image is None:
+                        continue
+                    byte = image[off[sel]]
+                value[sel] |= byte.astype(np.int64) << (8 * k)
+        if signed:
+            top = 1 << (8 * size - 1)
+            value = (value ^ top) - top
+        return value.astype(np.uint32)
+
+    def _write(self, addr, lanes, size, value):
+        # value: uint32 per instance in lanes
+        base = self._same_page(addr, size)
+        if base is not None:
+            idx = (addr & (PAGE_SIZE - 1)) >> (size >> 1)
+            self._page(base).view(WORD_TYPES[size, False])[lanes, idx] = value
+            return
+        value = value.astype(np.int64)
+        for k in range(size):
+            a = (addr + k) & _M32
+            base = a & ~(PAGE_SIZE - 1)
+            off = a & (PAGE_SIZE - 1)
+            byte = (value >> (8 * k)) & 0xFF
+            for b in np.unique(base):
+                sel = base == b
+                self._page(int(b))[lanes[sel], off[sel]] = byte[sel]
+
+    def _compile(self, inst):
+        # function(mask) for inst; mask is a bool array of the instances
+        # executing it, or None for all of them. Returns the next pc, as an
+        # int when it is the same for all of them.
+        op = inst.op
+        args = inst.args
+        pc = inst.address
+        regs = self.regs
+
+        def write(rd, value, mask):
+            if rd:
+                np.copyto(regs[rd], value, where=True if mask is None else mask)
+
+        if op in VECTOR_OPS or op in IMM_FORMS:
+            rd, rs1, b = args
+            alu = VECTOR_OPS[IMM_FORMS.get(op, op)]
+            imm = np.array(b & _M32, dtype=np.uint32) if op in IMM_FORMS else None
+
+            def exec_alu(mask):
+                write(rd, alu(regs[rs1], regs[b] if imm is None else imm), mask)
+                return pc + 4
+            return exec_alu
+
+        if op in LOAD_OPS:
+            rd, imm, rs1 = args
+            size, signed = LOAD_OPS[op]
+
+            def exec_load(mask):
+                lanes = self.lanes if mask is None else np.flatnonzero(mask)
+                addr = (regs[rs1][lanes].astype(np.int64) + imm) & _M32
+                if rd:
+                    regs[rd][lanes] = self._read(addr, lanes, size, signed)
+                return pc + 4
+            return exec_load
+
+        if op in STORE_OPS:
+            rs2, imm, rs1 = args
+            size = STORE_OPS[op]
+
+            def exec_store(mask):
+                lanes = self.lanes if mask is None else np.flatnonzero(mask)
+                addr = (regs[rs1][lanes].astype(np.int64) + imm) & _M32
+                self._write(addr, lanes, size, regs[rs2][lanes])
+                return pc + 4
+            return exec_store
+
+        if op in VECTOR_BRANCHES:
+            rs1, rs2, imm = args
+            cond = VECTOR_BRANCHES[op]
+
+            def exec_branch(mask):
+                take = cond(regs[rs1], regs[rs2])
+                if mask is not None:
+                    take = take[mask]
+                if take.all():
+                    return pc + imm
+                if not take.any():
+                    return pc + 4
+                nxt = np.full(self.n, pc + 4, dtype=np.int64)
+                if mask is None:
+                    nxt[take] = pc + imm
+                else:
+                    nxt[np.flatnonzero(mask)[take]] = pc + imm
+                return nxt
+            return exec_branch
+
+        if op == 'jal':
+            rd, imm = args
+
+            def exec_jal(mask):
+                write(rd, (pc + 4) & _M32, mask)
+                return pc + imm
+            return exec_jal
+
+        if op == 'jalr':
+            rd, rs1, imm = args
+
+            def exec_jalr(mask):
+                target = (regs[rs1].astype(np.int64) + imm) & ~1
+                write(rd, (pc + 4) & _M32, mask)
+                if mask is not None:
+                    target = np.where(mask, target, 0)
+                    first = target[np.argmax(mask)]
+                    return int(first) if (target[mask] == first).all() else target
+                return int(target[0]) if (target == target[0]).all() else target
+            return exec_jalr
+
+        if op in ('lui', 'auipc'):
+            rd, imm = args
+            value = ((imm << 12) + (pc if op == 'auipc' else 0)) & _M32
+
+            def exec_upper(mask):
+                write(rd, value, mask)
+                return pc + 4
+            return exec_upper
+
+        if op == 'ecall':
+            def exec_ecall(mask):
+                lanes = self.lanes if mask is None else np.flatnonzero(mask)
+                syscall = regs[17][lanes]
+                a0 = regs[10][lanes]
+                for i in lanes[syscall == 1]:
+                    self.outputs[i].append(chr(regs[10][i] & 0xFF))
+                exits = lanes[syscall == 93]
+                if len(exits):
+                    for i, code in zip(exits, a0[syscall == 93].view(np.int32)):
+                        self.exit_codes[i] = int(code)
+                    self._stop(exits, STOP_HALTED, 0xFFFFFFFF)
+                    if mask is not None:
+                        mask[exits] = False
+                return pc + 4
+            return exec_ecall
+
+        return None
+
+    def _stop(self, lanes, reason, pc):
+        for i in lanes:
+            self.reasons[i] = reason
+        self.active[lanes] = False
+        self.pc[lanes] = pc
+        self.stopped = True
+
+    def running(self):
+        return int(self.active.sum())
+
+    def run(self, max_steps=None, max_time=None):
+        # Runs until every instance stopped, an instance used up max_steps
+        # instructions (it stops with STOP_BUDGET) or max_time seconds passed
+        # (call again to resume). Returns the number still running.
+        with np.errstate(all='ignore'): # uint32 arithmetic wraps on purpose
+            self._lockstep(max_steps, max_time)
+        return self.running()
+
+    def _lockstep(self, max_steps, max_time):
+        deadline = None if max_time is None else time.perf_counter() + max_time
+        active = self.active
+        pcs = self.pc
+        limit = self.instret + max_steps if max_steps is not None else None
+        steps = 0
+        cur = None # pc shared by every active instance (pcs is stale then)
+        everyone = active.all()
+        while True:
+            if self.stopped:
+                self.stopped = False
+                everyone = False
+                if cur is not None:
+                    np.copyto(pcs, cur, where=active)
+                    cur = None
+            if cur is None:
+                if not active.any():
+                    break
+                live = pcs[active]
+                lo = int(live.min())
+                if lo == live.max():
+                    cur = lo
+            if cur is not None:
+                at = cur
+                mask = None if everyone else active
+            else:
+                at = lo
+                mask = active & (pcs == lo)
+
+            if deadline is not None and steps % TIME_CHECK_INTERVAL == 0 and steps \
+                    and time.perf_counter() >= deadline:
+                break
+            if limit is not None and steps >= max_steps:
+                over = (self.instret >= limit) & (active if mask is None else mask)
+                if over.any():
+                    self._stop(np.flatnonzero(over), STOP_BUDGET, at)
+                    continue
+
+            fn = self.compiled.get(at, False)
+            if fn is False:
+                inst = self.sim.fetch(at)
+                fn = self.compiled[at] = self._compile(inst) if inst is not None else None
+            if fn is None:
+                lanes = np.flatnonzero(active if mask is None else mask)
+                reason = STOP_HALTED if self.sim.fetch(at) is None else STOP_UNKNOWN
+                self._stop(lanes, reason, at)
+                continue
+
+            if mask is None:
+                self.instret += 1
+            else:
+                np.add(self.instret, 1, out=self.instret, where=mask)
+            nxt = fn(mask)
+            steps += 1
+            if isinstance(nxt, int):
+                if cur is not None:
+                    cur = nxt
+                else:
+                    np.copyto(pcs, nxt, where=mask)
+            else:
+                np.copyto(pcs, nxt, where=active if cur is not None else mask)
+                cur = None
+        if cur is not None:
+            np.copyto(pcs, cur, where=active)
+
+    def results(self):
+        # One dict per instance, as batch.run_job returns them
+        x = self.x
+        return [{
+            'success': True,
+            'reason': self.reasons[i],
+            'exit_code': self.exit_codes[i],
+            'instret': int(self.instret[i]),
+            'pc': int(self.pc[i]),
+            'registers': x[i].tolist(),
+            'output': ''.join(self.outputs[i])
+        } for i in range(self.n)]
+
+def run_inputs(job, inputs, max_steps=None, max_time=None):
+    # job as for batch.run_job (source or elf, shared registers/memory);
+    # inputs: one dict per instance with its own 'registers' and
+    # 'memory'. Returns run_job style results in input order.
+    sim = RISCVSimulator(trace=False)
+    if 'elf' in job:
+        sim.load_elf(job['elf'])
+    else:
+        ok, msg = sim.assemble(job.get('source', ''))
+        if not ok:
+            return [{'success': False, 'message': 'Assembly Failed', 'errors': msg}] * len(inputs)
+    for reg, val in job.get('registers', {}).items():
+        sim.write_reg(int(reg), int(val))
+    for addr, data in job.get('memory', {}).items():
+        sim.memory.load(int(addr), bytes(data))
+
+    engine = VectorEngine(sim, len(inputs))
+    regs = {}
+    for i, lane in enumerate(inputs):
+        for reg, val in lane.get('registers', {}).items():
+            regs.setdefault(int(reg), [sim.x[int(reg)]] * len(inputs))[i] = int(val)
+        for addr, data in lane.get('memory', {}).items():
+            engine.load_memory(int(addr), bytes(data), lane=i)
+    for reg, values in regs.items():
+        engine.set_register(reg, values)
+    engine.run(max_steps=job.get('max_steps', DEFAULT_MAX_STEPS) if max_steps is None else max_steps,
+               max_time=job.get('max_time') if max_time is None else max_time)
+    return engine.results()
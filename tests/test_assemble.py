@@ -0,0 +1,30 @@
+import pytest
+from simulator.riscv_sim import RISCVSimulator, STOP_HALTED
+
+def test_failed_assembly_leaves_no_program():
+    sim = RISCVSimulator(trace=False)
+    assert sim.assemble("addi x5, x0, 7")[0]
+    ok, errors = sim.assemble("bogus x1")
+    assert not ok and errors
+    assert sim.run() == STOP_HALTED
+    assert sim.instret == 0 and sim.x[5] == 0
+
+def test_long_text_moves_data_up():
+    sim = RISCVSimulator(trace=False)
+    code = "addi x5, x5, 1\n" * 17000 + ".data\nvalue: .word 42\n.text\nla a0, value\nlw a1, 0(a0)\n"
+    ok, message = sim.assemble(code)
+    assert ok, message
+    assert sim.labels['value'] == 0x20000
+    sim.run()
+    assert sim.x[5] == 17000 and sim.x[11] == 42
+
+def test_long_text_without_data():
+    sim = RISCVSimulator(trace=False)
+    assert sim.assemble("addi x5, x5, 1\n" * 17000)[0]
+
+@pytest.mark.parametrize('code', [".data\n.space 200000000",
+                                  ".data\n.space 40000000\n.zero 40000000",
+                                  ".align 40"])
+def test_rejects_huge_sections(code):
+    ok, errors = RISCVSimulator(trace=False).assemble(code)
+    assert not ok and errors
@@ -0,0 +1,80 @@
+import contextlib
+import io
+import os
+import random
+import pytest
+from simulator.encoding import encode
+from simulator.riscv_sim import RISCVSimulator, STOP_BUDGET
+
+KERNELS = os.path.join(os.path.dirname(__file__), '..', 'benchmarks', 'kernels')
+
+# Stores into the loop's own block, ahead of and behind the store
+PATCH_AHEAD = f"""
+    la t0, ahead
+    li t2, {encode('addi', [10, 10, 100])}
+    li s1, 5
+loop:
+    addi s0, s0, 1
+    sw t2, 0(t0)
+ahead:
+    addi a0, a0, 1
+    blt s0, s1, loop
+"""
+PATCH_BEHIND = f"""
+    la t0, behind
+    li t2, {encode('addi', [10, 10, 100])}
+    li s1, 5
+loop:
+behind:
+    addi a0, a0, 1
+    addi s0, s0, 1
+    sw t2, 0(t0)
+    blt s0, s1, loop
+"""
+
+def state(sim):
+    pages = {base: bytes(page) for base, page in sim.memory.pages.items() if any(page)}
+    return sim.x, sim.f, sim.pc, sim.instret, sim.exit_code, pages
+
+def stepped(source):
+    sim = RISCVSimulator(trace=False)
+    assert sim.assemble(source)[0]
+    with contextlib.redirect_stdout(io.StringIO()):
+        while sim.fetch(sim.pc) is not None and sim.exit_code is None:
+            sim.step()
+    return state(sim)
+
+def blocks(source, seed):
+    # Odd budgets so blocks that loop onto themselves stop part way
+    rng = random.Random(seed)
+    sim = RISCVSimulator(trace=False)
+    assert sim.assemble(source)[0]
+    with contextlib.redirect_stdout(io.StringIO()):
+        while True:
+            budget = rng.randrange(1, 5000)
+            before = sim.instret
+            reason = sim.run(max_steps=budget)
+            assert sim.instret - before <= budget
+            if reason != STOP_BUDGET:
+                return state(sim)
+
+def kernel(name):
+    with open(os.path.join(KERNELS, name + '.s')) as f:
+        return f.read()
+
+@pytest.mark.parametrize('source', [kernel(name) for name in sorted(
+    name[:-2] for name in os.listdir(KERNELS) if name.endswith('.s'))] + [PATCH_AHEAD, PATCH_BEHIND])
+def test_blocks_match_stepping(source):
+    expected = stepped(source)
+    assert blocks(source, 1) == expected
+    assert blocks(source, 2) == expected
+
+def test_store_into_block_takes_effect():
+    sim = RISCVSimulator(trace=False)
+    assert sim.assemble(PATCH_AHEAD)[0]
+    sim.run()
+    assert sim.x[10] == 500
+    sim = RISCVSimulator(trace=False)
+    assert sim.assemble(PATCH_BEHIND)[0]
+    sim.run()
+    assert sim.x[10] == 1 + 4 * 100
@@ -0,0 +1,19 @@
+import pytest
+
+from simulator.cache import Cache, CacheConfigError, CacheHierarchy
+
+@pytest.mark.parametrize('geometry', [
+    {'line_size': 0},
+    {'line_size': 24},
+    {'ways': 0},
+    {'ways': -2},
+    {'size': 0},
+    {'size': 1000},
+])
+def test_rejects_bad_geometry(geometry):
+    with pytest.raises(CacheConfigError):
+        Cache('L1D', **geometry)
+
+def test_hierarchy_rejects_zero_line_size():
+    with pytest.raises(CacheConfigError):
+        CacheHierarchy(l1d={'line_size': 0})
@@ -0,0 +1,66 @@
+import json
+import pytest
+from simulator.riscv_sim import RISCVSimulator
+from simulator.checkpoint import save_checkpoint, load_checkpoint, CheckpointFormatError, HEADER
+
+PROGRAM = """
+    li t0, 0x12345
+    li t1, 0x10000
+    sw t0, 0(t1)
+"""
+
+def test_round_trip(tmp_path):
+    sim = RISCVSimulator(trace=False)
+    assert sim.assemble(PROGRAM)[0]
+    sim.run()
+    path = str(tmp_path / 'state.rvck')
+    save_checkpoint(sim, path)
+    other = RISCVSimulator(trace=False)
+    load_checkpoint(other, path)
+    assert other.x == sim.x and other.pc == sim.pc
+    assert other.memory.peek(0x10000, 4) == sim.memory.peek(0x10000, 4)
+
+@pytest.mark.parametrize('contents', [b'', b'RV', b'XXXX' + bytes(60), b'RVCK\x01\x00\x00\x00' + bytes(16)])
+def test_rejects_bad_files(tmp_path, contents):
+    path = tmp_path / 'bad.rvck'
+    path.write_bytes(contents)
+    with pytest.raises(CheckpointFormatError):
+        load_checkpoint(RISCVSimulator(trace=False), str(path))
+
+def rewrite_meta(path, edit):
+    # Re-packs a checkpoint with edited metadata, pages unchanged
+    data = open(path, 'rb').read()
+    magic, version, _, meta_len, offset = HEADER.unpack_from(data)
+    meta = json.loads(data[HEADER.size:HEADER.size + meta_len])
+    edit(meta)
+    blob = json.dumps(meta).encode()
+    assert HEADER.size + len(blob) <= offset
+    head = HEADER.pack(magic, version, 0, len(blob), offset) + blob
+    open(path, 'wb').write(head + bytes(offset - len(head)) + data[offset:])
+
+@pytest.mark.parametrize('key', ['pc', 'x', 'f', 'csrs', 'reservation', 'exit_code', 'instret',
+                                 'program', 'labels', 'code', 'pages'])
+def test_missing_key_leaves_simulator_alone(tmp_path, key):
+    sim = RISCVSimulator(trace=False)
+    assert sim.assemble(PROGRAM)[0]
+    sim.run()
+    path = str(tmp_path / 'state.rvck')
+    save_checkpoint(sim, path)
+    rewrite_meta(path, lambda meta: meta.pop(key))
+    before = (sim.x[:], sim.pc, sim.instret, dict(sim.program))
+    with pytest.raises(CheckpointFormatError):
+        load_checkpoint(sim, path)
+    assert (sim.x, sim.pc, sim.instret, sim.program) == before
+
+@pytest.mark.parametrize('edit', [lambda meta: meta.update(x=[0] * 5),
+                                  lambda meta: meta.update(code=[0]),
+                                  lambda meta: meta.update(pages=[0x10004]),
+                                  lambda meta: meta.update(csrs=[1])])
+def test_malformed_metadata(tmp_path, edit):
+    sim = RISCVSimulator(trace=False)
+    assert sim.assemble(PROGRAM)[0]
+    path = str(tmp_path / 'state.rvck')
+    save_checkpoint(sim, path)
+    rewrite_meta(path, edit)
+    with pytest.raises(CheckpointFormatError):
+        load_checkpoint(sim, path)
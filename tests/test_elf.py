@@ -0,0 +1,50 @@
+import mmap
+import struct
+import pytest
+from simulator import elf
+from simulator.elf import ELFError
+from simulator.riscv_sim import RISCVSimulator, STOP_HALTED
+
+VADDR = 0x10000
+
+def image():
+    # One executable PT_LOAD segment of two pages at VADDR, file offset 4096
+    sim = RISCVSimulator(trace=False)
+    assert sim.assemble("li x5, 10\nloop:\nadd x6, x6, x5\naddi x5, x5, -1\nbnez x5, loop\n"
+                        "li a7, 93\necall")[0]
+    text = bytes(sim.memory.peek(a, 1) for a in range(sim.memory.code_end))
+    text += bytes(2 * 4096 - len(text))
+    ehdr = b'\x7fELF' + bytes([1, 1, 1]) + bytes(9) + \
+        struct.pack('<HHIIIIIHHHHHH', 2, 243, 1, VADDR, 52, 0, 0, 52, 32, 1, 40, 0, 0)
+    phdr = struct.pack('<IIIIIIII', 1, 4096, VADDR, VADDR, len(text), len(text), 5, 4096)
+    head = ehdr + phdr
+    return head + bytes(4096 - len(head)) + text
+
+@pytest.mark.parametrize('kind', ['bytes', 'bytearray', 'path'])
+def test_load_and_run(tmp_path, kind):
+    data = image()
+    path = tmp_path / 'prog.elf'
+    path.write_bytes(data)
+    source = {'bytes': data, 'bytearray': bytearray(data), 'path': str(path)}[kind]
+    sim = RISCVSimulator(trace=False)
+    assert sim.load_elf(source) == VADDR
+    assert sim.run(max_steps=1000) == STOP_HALTED and sim.x[6] == 55
+    # Simulated stores never reach the caller's buffer or the file
+    sim.memory.write(VADDR + 4096 + 100, 0xFFFFFFFF, 4)
+    if kind == 'bytearray':
+        assert source == data
+    assert path.read_bytes() == data
+
+@pytest.mark.parametrize('contents', [b'', b'junk' * 20])
+def test_bad_file_is_closed(tmp_path, monkeypatch, contents):
+    maps = []
+    original = mmap.mmap
+    def tracked(*args, **kwargs):
+        maps.append(original(*args, **kwargs))
+        return maps[-1]
+    monkeypatch.setattr(elf.mmap, 'mmap', tracked)
+    path = tmp_path / 'bad.elf'
+    path.write_bytes(contents)
+    with pytest.raises(ELFError):
+        RISCVSimulator(trace=False).load_elf(str(path))
+    assert all(m.closed for m in maps)
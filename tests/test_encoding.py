@@ -0,0 +1,20 @@
+import random
+import pytest
+from simulator.encoding import decode_word, encode
+
+def test_decode_encode_round_trip():
+    rng = random.Random(1)
+    decoded = 0
+    for i in range(40000):
+        word = rng.getrandbits(32) if i % 2 else rng.getrandbits(16)
+        result = decode_word(word)
+        if result is None:
+            continue
+        op, args, length = result
+        assert decode_word(encode(op, args)) == (op, args, length), hex(word)
+        decoded += 1
+    assert decoded > 10000
+
+@pytest.mark.parametrize('word', [0x9285, 0x9685]) # c.srli / c.srai, shamt[5] set
+def test_rv32_reserved_compressed_shifts(word):
+    assert decode_word(word) is None
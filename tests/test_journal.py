@@ -0,0 +1,37 @@
+from simulator.riscv_sim import RISCVSimulator
+from simulator.journal import RING_ENTRY_BYTES
+
+LOOP = """
+    li t0, 100000
+loop:
+    addi t0, t0, -1
+    bnez t0, loop
+"""
+
+def make_sim(size=0):
+    sim = RISCVSimulator(trace=False)
+    assert sim.assemble(LOOP)[0]
+    sim.enable_journal(size=size, checkpoint_interval=50000)
+    sim.run(max_steps=60000)
+    return sim
+
+def test_seek_replays_from_checkpoint():
+    sim = make_sim()
+    assert sim.seek(40000) == 40000
+
+def test_seek_replay_stops_at_max_time():
+    sim = make_sim()
+    reached = sim.seek(40000, max_time=0)
+    assert 0 < reached < 40000
+    # Calling again continues from where the replay stopped
+    assert sim.seek(40000) == 40000
+
+def test_memory_bytes_counts_shared_pages_once():
+    sim = make_sim(size=100)
+    journal = sim.journal
+    # The loop never stores, so both checkpoints hold the same page copies
+    assert len(journal.checkpoints) == 2
+    assert journal.memory_bytes() == len(sim.memory.pages) * 4096
+    for _ in range(10):
+        sim.step()
+    assert journal.memory_bytes() == len(sim.memory.pages) * 4096 + 10 * RING_ENTRY_BYTES
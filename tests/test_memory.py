@@ -0,0 +1,47 @@
+import pickle
+import pytest
+from simulator.memory import Memory
+
+RAM = (0x10000, 0x10000)
+
+def accesses(memory):
+    # Word, half and byte accesses inside the region, across its page
+    # boundaries and just outside it
+    out = []
+    for i, addr in enumerate([0x10000, 0x10ffe, 0x11ffd, 0x1fffc, 0x1fffe, 0x20000, 0xfffe]):
+        memory.write(addr, 0x8badf00d + i, 4)
+        memory.write_word(addr + 8, 0x12345678 + i)
+        memory.write(addr + 5, 0xbeef, 2)
+        out += [memory.read(addr, 4), memory.read(addr, 2, True), memory.read_word(addr + 8),
+                memory.read(addr + 5, 1, True)]
+    return out
+
+def test_flat_region_matches_pages():
+    paged, flat = Memory(), Memory(ram=RAM)
+    assert accesses(flat) == accesses(paged)
+    assert {b: bytes(p) for b, p in flat.pages.items() if any(p)} == \
+        {b: bytes(p) for b, p in paged.pages.items() if any(p)}
+    assert flat.dirty_pages(0) and set(paged.dirty_pages(0)) <= set(flat.dirty_pages(0))
+
+def test_flat_region_page_crossing_marks_both_pages():
+    memory = Memory(ram=RAM)
+    memory.epoch = 5
+    memory.write_word(0x10ffe, 0xffffffff)
+    assert sorted(memory.dirty_pages(4)) == [0x10000, 0x11000]
+
+def test_flat_region_flags_code_writes():
+    memory = Memory(ram=RAM)
+    memory.set_code_range(0x10000, 0x10100)
+    memory.write_word(0x100fe, 1)
+    assert memory.code_written and memory.code_writes == [(0x100fe, 4)]
+
+def test_flat_region_watchpoints_and_pickle():
+    memory = Memory(ram=RAM)
+    memory.set_watchpoints([(0x10010, 0x10014, False, True)])
+    memory.write_word(0x10010, 7)
+    assert memory.watch_hit['addr'] == 0x10010
+    memory.set_watchpoints([])
+    copy = pickle.loads(pickle.dumps(memory))
+    assert copy.read_word(0x10010) == 7
+    copy.write_word(0x10020, 9)
+    assert copy.ram[0x20] == 9
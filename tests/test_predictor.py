@@ -0,0 +1,21 @@
+import pytest
+
+from simulator.predictor import BranchPredictor, PredictorConfigError, TABLE_PREDICTORS
+
+@pytest.mark.parametrize('kind', TABLE_PREDICTORS)
+@pytest.mark.parametrize('entries', [0, -4, 3])
+def test_rejects_bad_table_size(kind, entries):
+    with pytest.raises(PredictorConfigError):
+        BranchPredictor(kind, entries=entries)
+
+@pytest.mark.parametrize('btb_entries', [0, -8, 6])
+def test_rejects_bad_btb_size(btb_entries):
+    with pytest.raises(PredictorConfigError):
+        BranchPredictor('bimodal2', btb_entries=btb_entries)
+
+def test_rejects_negative_history():
+    with pytest.raises(PredictorConfigError):
+        BranchPredictor('gshare', history_bits=-1)
+
+def test_table_size_ignored_without_table():
+    assert BranchPredictor('not_taken', entries=0).report()['predictions'] == 0
@@ -0,0 +1,38 @@
+import io
+from simulator.riscv_sim import RISCVSimulator
+from simulator.trace import trace, read_trace, MEM_NONE, MEM_WRITE
+
+def sc_steps(code):
+    sim = RISCVSimulator(trace=False)
+    assert sim.assemble(code)[0]
+    records = read_trace(io.BytesIO(b''.join(trace(sim))))
+    return [r for r in records if r[0] == 'step'][-1:]
+
+def test_successful_sc_is_a_store():
+    [step] = sc_steps("""
+        li t0, 0x10000
+        li t1, 7
+        lr.w t2, (t0)
+        sc.w t3, t1, (t0)
+    """)
+    _, _, _, rd, value, mem, addr, size, data = step
+    assert (rd, value, mem, addr, size, data) == (28, 0, MEM_WRITE, 0x10000, 4, 7)
+
+def test_sc_after_broken_reservation_stores_nothing():
+    [step] = sc_steps("""
+        li t0, 0x10000
+        li t1, 7
+        lr.w t2, (t0)
+        sw zero, 0(t0)
+        sc.w t3, t1, (t0)
+    """)
+    _, _, _, rd, value, mem, addr, size, data = step
+    assert (rd, value, mem, addr, size, data) == (28, 1, MEM_NONE, 0, 0, 0)
+
+def test_failed_sc_into_x0_stores_nothing():
+    [step] = sc_steps("""
+        li t0, 0x10000
+        li t1, 7
+        sc.w zero, t1, (t0)
+    """)
+    assert step[5] == MEM_NONE